@@ -0,0 +1,51 @@
+#!/usr/bin/env python3
+"""Add the columns that newer versions need to the tables of an existing database, with their indexes.
+
+New tables are made by prepare_tables when the app starts, but columns of existing tables aren't.
+Existing rows get the values the code assumed before the columns were there:
+the old password hashing settings, version 1, and an unknown time of posting for old bug messages.
+Run this once after upgrading, before starting the app. Running it again does nothing.
+"""
+from sys import argv, exit
+
+from pyserv.blog import BlogPost
+from pyserv.bug import Bug, BugMessage
+from pyserv.database import db
+from pyserv.person import User
+
+if argv[1:]:
+	print("Usage: ./add_missing_columns.py")
+	exit(1)
+
+"""The new columns, with the value for the existing rows (None to leave them empty)."""
+new_columns = [
+	(User.__table__.c.password_algorithm, 'pbkdf2_sha256'),
+	(User.__table__.c.password_cost, 100000),
+	(Bug.__table__.c.version, 1),
+	(BlogPost.__table__.c.version, 1),
+	(BugMessage.__table__.c.posted, None),
+]
+
+dialect = db.engine.dialect
+# 'user' is a reserved word in some databases, so quote the names
+quote = dialect.identifier_preparer
+inspector = db.inspect(db.engine)
+added = set()
+for column, value in new_columns:
+	table = column.table
+	if column.name in {existing['name'] for existing in inspector.get_columns(table.name)}:
+		continue
+	definition = "{} {}".format(quote.format_column(column), column.type.compile(dialect=dialect))
+	if value is not None:
+		# SQLite can only add a NOT NULL column with a default, which also fills in the existing rows
+		literal = db.literal(value).compile(dialect=dialect, compile_kwargs={'literal_binds': True})
+		definition += " NOT NULL DEFAULT {}".format(literal)
+	db.engine.execute('ALTER TABLE {} ADD COLUMN {}'.format(quote.format_table(table), definition))
+	print("Added the {}.{} column".format(table.name, column.name))
+	added.add(column)
+
+for table in {column.table for column in added}:
+	for index in table.indexes:
+		if added.intersection(index.columns):
+			index.create(bind=db.engine)
+			print("Added the {} index".format(index.name))
@@ -0,0 +1,11 @@
+#!/usr/bin/env python3
+from sys import argv, exit
+
+from pyserv.bug import backfill_bug_trends
+
+if argv[1:]:
+	print("Usage: ./backfill_bug_trends.py")
+	exit(1)
+
+replayed = backfill_bug_trends()
+print("Rebuilt the bug trends from {} messages".format(replayed))
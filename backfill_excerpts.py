@@ -0,0 +1,27 @@
+#!/usr/bin/env python3
+"""Add the excerpt and HTML columns to the blog posts if needed, and fill them in for all existing posts.
+
+Run this again after changing the renderer, so the posts don't have to be rendered while viewing them.
+"""
+from sys import argv, exit
+
+from pyserv.blog import BlogPost, backfill_excerpts
+from pyserv.database import db
+from pyserv.page_cache import bump_page_version
+
+if argv[1:]:
+	print("Usage: ./backfill_excerpts.py")
+	exit(1)
+
+table = BlogPost.__table__
+existing = {column['name'] for column in db.inspect(db.engine).get_columns(table.name)}
+for column in (table.c.excerpt, table.c.html, table.c.html_version):
+	if column.name not in existing:
+		column_type = column.type.compile(dialect=db.engine.dialect)
+		db.engine.execute('ALTER TABLE {} ADD COLUMN {} {}'.format(table.name, column.name, column_type))
+		print("Added the {} column".format(column.name))
+
+done = backfill_excerpts()
+# the cached pages may still show the old excerpts
+bump_page_version()
+print("Set the excerpts and HTML of {} posts".format(done))
@@ -4,6 +4,12 @@ import pyserv.config
 pyserv.config.debug = True
 pyserv.config.test = True
 pyserv.config.database_uri = 'sqlite:////tmp/test.db'
+# hashing passwords should be secure in production, but fast in testing
+pyserv.config.password_algorithm = 'pbkdf2_sha256'
+pyserv.config.password_cost = 1
+pyserv.config.password_workers = 0
+pyserv.config.dynamic_file_path = '/tmp/test_dynamic'
+pyserv.config.preload_templates = True
 
 from pyserv.database import reset_tables
 import pyserv.view
@@ -0,0 +1,49 @@
+#!/usr/bin/env python3
+"""Measure how long a single has_auth check takes.
+
+Compares the compiled bitmask against running the auth functions on every call,
+which is how has_auth used to work.
+"""
+from timeit import repeat
+
+import pyserv.config
+pyserv.config.debug = True
+pyserv.config.database_uri = 'sqlite://'
+pyserv.config.password_cost = 1
+pyserv.config.password_workers = 0
+
+from flask import session
+
+from pyserv.app import app, setup
+from pyserv.auth import _auth_lookup, _has_auth_god, has_auth, levels
+from pyserv.database import db, prepare_tables
+from pyserv.person import User, get_auth_context, get_logged_in
+
+def dispatch_has_auth(level):
+	"""has_auth as it was before compiling the levels into a bitmask."""
+	user = get_logged_in()
+	context = get_auth_context()
+	if _has_auth_god(user, context):
+		return True
+	return _auth_lookup[level](user, context)
+
+def time_per_check(func, number=100000):
+	"""The best time for a single call to func, in nanoseconds."""
+	return min(repeat(func, number=number, repeat=5)) / number * 1e9
+
+def main():
+	setup()
+	prepare_tables()
+	user = User(full_name="Benchmark User", nickname="bench", password="")
+	db.session.add(user)
+	db.session.commit()
+
+	with app.test_request_context('/'):
+		session['current_user'] = user.id
+		for level in (levels.logged_in, levels.no_key, levels.blog):
+			before = time_per_check(lambda: dispatch_has_auth(level))
+			after = time_per_check(lambda: has_auth(level))
+			print("{:>10}: dispatch {:7.0f} ns, bitmask {:7.0f} ns per check".format(level.name, before, after))
+
+if __name__ == '__main__':
+	main()
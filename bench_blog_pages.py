@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+"""Measure how long getting a deep page of the blog takes with many posts.
+
+Compares skipping posts with an offset against continuing from a cursor,
+both for visitors (public posts only) and for users with blog rights.
+Usage: bench_blog_pages.py [number of posts]
+"""
+from datetime import datetime, timedelta
+import os
+import sys
+from tempfile import mkdtemp
+from time import perf_counter
+
+import pyserv.config
+pyserv.config.debug = True
+pyserv.config.database_uri = 'sqlite:///' + os.path.join(mkdtemp(), 'bench.db')
+pyserv.config.password_cost = 1
+pyserv.config.password_workers = 0
+
+from pyserv.app import setup
+from pyserv.auth import grant_level, levels
+from pyserv.blog import BlogPost, all_posts
+from pyserv.database import db, prepare_tables
+from pyserv.person import User
+
+def best_time(func, repeat=20):
+	"""The best time of func(), in milliseconds."""
+	times = []
+	for i in range(repeat):
+		start = perf_counter()
+		func()
+		times.append((perf_counter() - start) * 1000)
+	return min(times)
+
+def main():
+	count = int(sys.argv[1]) if len(sys.argv) > 1 else 50000
+	setup()
+	prepare_tables()
+	start = datetime(2000, 1, 1)
+	db.engine.execute(BlogPost.__table__.insert(), [{
+		'title': "Post {}".format(i), 'contents': "Some contents " * 50,
+		'posted': start + timedelta(minutes=i), 'last_updated': start + timedelta(minutes=i),
+		'public': i % 3 != 0, 'type': 'BlogPost', 'version': 1,
+	} for i in range(count)])
+	author = User(full_name="Benchmark User", nickname="bench", password="")
+	db.session.add(author)
+	db.session.commit()
+	grant_level(author, levels.blog)
+	db.session.commit()
+
+	print("{} posts, pages of 10".format(count))
+	for name, user in (("visitor", None), ("blog rights", author)):
+		for depth in (0.1, 0.5, 0.9):
+			skip = int(count * depth) // 10 * 10 // (3 if user is None else 1)
+			# the cursor of the page just before the one we want
+			cursor = all_posts(start=skip - 10, count=10, user=user).next_cursor
+			offset = best_time(lambda: all_posts(start=skip, count=10, user=user))
+			keyset = best_time(lambda: all_posts(before=cursor, count=10, user=user))
+			assert all_posts(start=skip, count=10, user=user) == all_posts(before=cursor, count=10, user=user)
+			print("{:>11}, skipping {:6} posts: offset {:7.2f} ms, cursor {:7.2f} ms".format(name, skip, offset, keyset))
+
+if __name__ == '__main__':
+	main()
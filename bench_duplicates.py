@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+"""Measure how long finding duplicate suggestions takes with many bugs.
+
+Compares the MinHash index against a LIKE query over all titles,
+both for reports that are a reworded existing bug and for new reports.
+Usage: bench_duplicates.py [number of bugs]
+"""
+import json
+import os
+from random import Random
+import sys
+from tempfile import mkdtemp
+from time import perf_counter
+
+import pyserv.config
+pyserv.config.debug = True
+pyserv.config.database_uri = 'sqlite:///' + os.path.join(mkdtemp(), 'bench.db')
+
+from pyserv.app import setup
+from pyserv.bug import Bug
+from pyserv.bug_transfer import import_bugs
+from pyserv.database import db, prepare_tables
+from pyserv.duplicates import similar_bugs
+
+def make_words(random, count=5000):
+	letters = "abcdefghijklmnopqrstuvwxyz"
+	return ["".join(random.choice(letters) for i in range(random.randint(3, 9))) for j in range(count)]
+
+def random_title(random, words, weights):
+	# some words are much more common than others, like in real titles
+	return " ".join(random.choices(words, weights, k=random.randint(3, 8)))
+
+def reword(random, title):
+	"""Something a different reporter of the same bug might write: shuffled, with a word dropped."""
+	words = title.split()
+	words.pop(random.randrange(len(words)))
+	random.shuffle(words)
+	return " ".join(words)
+
+def median_time(func, queries):
+	"""The median time of func(query) over all queries, in milliseconds."""
+	times = []
+	for query in queries:
+		start = perf_counter()
+		func(query)
+		times.append((perf_counter() - start) * 1000)
+	return sorted(times)[len(times) // 2]
+
+def like_search(title):
+	"""What you'd do without an index: the titles containing most of the words."""
+	matches = [db.case([(Bug.title.like('%{}%'.format(word)), 1)], else_=0) for word in title.split()]
+	return Bug.query.order_by(sum(matches[1:], matches[0]).desc()).limit(5).all()
+
+def main():
+	count = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+	random = Random(42)
+	words = make_words(random)
+	weights = [1 / rank for rank in range(1, len(words) + 1)]
+	titles = [random_title(random, words, weights) for i in range(count)]
+	setup()
+	prepare_tables()
+	start = perf_counter()
+	import_bugs(json.dumps({'title': title, 'status': 'New', 'priority': 'Low', 'messages': [{
+		'type': 'BugUserMessage', 'new_title': title, 'new_status': 'New', 'new_priority': 'Low',
+		'description': random_title(random, words, weights),
+	}]}) for title in titles)
+	print("imported {} bugs in {:.1f} s".format(count, perf_counter() - start))
+
+	duplicates = {}
+	for bug_id in random.sample(range(1, count + 1), 100):
+		duplicates[reword(random, titles[bug_id - 1])] = bug_id
+	new_reports = [random_title(random, words, weights) for i in range(100)]
+	found = sum(any(suggestion.bug.id == bug_id for suggestion in similar_bugs(title))
+			for title, bug_id in duplicates.items())
+	print("found {} of {} reworded bugs".format(found, len(duplicates)))
+	for name, func in (("MinHash index", similar_bugs), ("LIKE query", like_search)):
+		print("{:>13}: {:7.1f} ms median for duplicates, {:7.1f} ms for new reports".format(
+				name, median_time(func, duplicates), median_time(func, new_reports)))
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,15 @@
+#!/usr/bin/env python3
+"""Hash the static files and compress them into dynamic_file_path/static, so the server doesn't need to."""
+from sys import argv, exit
+
+from pyserv.assets import build_manifest, compressed_directory, encodings, manifest
+
+if argv[1:]:
+	print("Usage: ./build_assets.py")
+	exit(1)
+
+compressed = build_manifest()
+for name, hashed in sorted(manifest.items()):
+	print("{} -> {}".format(name, hashed))
+print("Made {} compressed copies ({}) in {}".format(
+	compressed, ", ".join(encoding for encoding, extension, compress in encodings), compressed_directory()))
@@ -0,0 +1,21 @@
+#!/usr/bin/env python3
+from sys import argv, exit
+
+from pyserv.bug import check_bug_counts
+from pyserv.database import db
+
+repair = '--repair' in argv[1:]
+if any(arg != '--repair' for arg in argv[1:]):
+	print("Usage: ./check_bug_counts.py [--repair]")
+	exit(1)
+
+drift = check_bug_counts(repair=repair)
+for (status, priority), (stored, actual) in sorted(drift.items(), key=lambda item: (item[0][0].name, item[0][1].name)):
+	print("{} {}: stored {}, actually {}".format(status.name, priority.name, stored, actual))
+if repair:
+	db.session.commit()
+	print("Repaired {} counts".format(len(drift)))
+elif drift:
+	exit(2)
+else:
+	print("All bug counts are correct")
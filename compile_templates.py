@@ -0,0 +1,21 @@
+#!/usr/bin/env python3
+"""Compile all templates to modules in dynamic_file_path/templates, so the server doesn't need to."""
+from sys import argv, exit
+
+from pyserv import config
+from pyserv.app import setup
+from pyserv.templates import module_directory, preload_templates
+
+if argv[1:]:
+	print("Usage: ./compile_templates.py")
+	exit(1)
+if module_directory() is None:
+	print("Compiled templates aren't stored: set store_compiled_templates in the config")
+	exit(1)
+
+config.preload_templates = False
+setup()
+timings = preload_templates()
+for name, seconds in sorted(timings.items()):
+	print("{}: {:.1f} ms".format(name, seconds * 1000))
+print("Compiled {} templates to {} in {:.1f} ms".format(len(timings), module_directory(), sum(timings.values()) * 1000))
@@ -41,17 +41,26 @@ def test_user():
 @pytest.fixture
 def god_user(test_user):
 	"""A factory for users with unique nickname and god level powers."""
-	from pyserv import config
+	from pyserv.auth import grant_level, levels
 	from pyserv.database import db
 	def make_god_user():
 		god_user = test_user()
 		god_user.full_name="God User"
+		grant_level(god_user, levels.god)
 		db.session.add(god_user)
 		db.session.commit()
-		config.god_ids.add(god_user.id)
 		return god_user
 	return make_god_user
 @pytest.fixture
 def blog_user(test_user):
 	"""A factory for users that may write blog articles."""
-	return god_user(test_user) # TODO: when we've implemented actual blog auth, be less subtle
+	from pyserv.auth import grant_level, levels
+	from pyserv.database import db
+	def make_blog_user():
+		blog_user = test_user()
+		blog_user.full_name="Blog User"
+		grant_level(blog_user, levels.blog)
+		db.session.add(blog_user)
+		db.session.commit()
+		return blog_user
+	return make_blog_user
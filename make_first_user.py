@@ -1,6 +1,7 @@
 #!/usr/bin/env python3
 from sys import argv, exit
 
+from pyserv.auth import grant_level, levels
 from pyserv.database import db
 from pyserv.person import User
 from pyserv.apikey import APIKey
@@ -15,4 +16,7 @@ except IndexError:
 first_user = User(full_name="Generic User", nickname=username, password=password)
 db.session.add(first_user)
 db.session.commit()
-print("Created user +{}".format(first_user.id))
+# the first user gets to do everything, including giving others rights
+grant_level(first_user, levels.god)
+db.session.commit()
+print("Created god user +{}".format(first_user.id))
@@ -1,17 +1,68 @@
+from base64 import urlsafe_b64encode
+from hashlib import sha256
 from os import urandom
+from time import monotonic
 
+from . import config
 from .database import db, DBClass
+from .session import LRUCache
 
 class APIKey(DBClass):
 	"""Allows services to work just like the users.
 	
 	Prevents that tedious mucking about with sessions and cookies you would need to log in.
 	Also makes sure the actual user can revoke them anytime.
+	Services send the secret in the header `Authorization: Bearer <secret>`.
 	"""
 	id = db.Column(db.Integer, primary_key=True)
 	owner_id = db.Column(db.Integer, db.ForeignKey('user.id'))
-	secret_code = db.Column(db.LargeBinary(255), nullable=False)
+	"""The SHA-256 digest of the secret.
+
+	Like passwords, the secret itself should !!NEVER!! be stored.
+	Since the secret is long and random, a single round of hashing is enough.
+	"""
+	digest = db.Column(db.LargeBinary(32), nullable=False, unique=True, index=True)
 
 	def __init__(self, owner):
 		self.owner = owner
-		self.secret_code = urandom(64)
+		"""The secret for in the Authorization header, only available right after making the key."""
+		self.secret = urlsafe_b64encode(urandom(48)).decode('ascii')
+		self.digest = digest_secret(self.secret)
+
+	def __repr__(self):
+		return "APIKey <{} of {}>".format(self.id, self.owner_id)
+
+def digest_secret(secret):
+	"""Get the digest that is stored for the given secret."""
+	return sha256(secret.encode('utf-8')).digest()
+
+"""Maps digest -> (owner id, expiry time) for the recently used keys.
+
+Unknown keys are cached with owner id None, so guessing doesn't hit the database each time.
+"""
+_key_cache = LRUCache(config.api_key_cache_size)
+
+def get_key_owner_id(secret):
+	"""Get the id of the user owning the API key with this secret, or None if there is no such key.
+
+	Keys are remembered for config.api_key_cache_ttl seconds,
+	so revoking a key takes at most that long to reach every process.
+	"""
+	digest = digest_secret(secret)
+	now = monotonic()
+	cached = _key_cache.get(digest)
+	if cached is not None and cached[1] > now:
+		return cached[0]
+
+	owner_id = db.session.query(APIKey.owner_id).filter(APIKey.digest == digest).scalar()
+	_key_cache.put(digest, (owner_id, now + config.api_key_cache_ttl))
+	return owner_id
+
+def revoke_key(key):
+	"""Delete the key, so it can't be used anymore.
+
+	This process forgets about it immediately, others within config.api_key_cache_ttl seconds.
+	Commit the session afterwards.
+	"""
+	_key_cache.pop(key.digest)
+	db.session.delete(key)
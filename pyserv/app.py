@@ -2,7 +2,8 @@ import flask
 
 from . import config
 
-app = flask.Flask("databrowse")
+# static files are served by pyserv.view.static_file
+app = flask.Flask("databrowse", static_folder=None)
 app.config['SQLALCHEMY_DATABASE_URI'] = config.database_uri
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = True
 app.config['MAKO_DEFAULT_FILTERS'] = ['h']
@@ -12,11 +13,26 @@ _is_setup = False
 
 def setup(**kwargs):
 	from flask_mako import MakoTemplates
+	from .auth import grant_config_gods
+	from .assets import build_manifest
+	from .compression import GzipMiddleware
+	from .session import make_session_interface
+	from .templates import module_directory, preload_templates
 
 	app.template_folder = "views"
 	app.secret_key=config.secret_key
+	app.config['MAKO_MODULE_DIRECTORY'] = module_directory()
 	app.config.update(kwargs)
 	mako = MakoTemplates(app)
+	grant_config_gods()
+	build_manifest()
+	if config.preload_templates:
+		preload_templates()
+	if config.compression_level:
+		app.wsgi_app = GzipMiddleware(app.wsgi_app, config.compression_minimum_size, config.compression_level)
+	session_interface = make_session_interface()
+	if session_interface is not None:
+		app.session_interface = session_interface
 
 	_is_setup = True
 
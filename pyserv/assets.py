@@ -0,0 +1,106 @@
+"""Static files with the hash of their contents in their name, so browsers can keep them forever.
+
+The manifest maps each file in config.static_file_path (e.g. style/base.css)
+to a name with its hash (e.g. style/base.0123456789abcdef.css), and url_for('static') gives that name.
+When the file changes, so does its url, so its old version in a cache never gets used by accident.
+Text files also get a gzip (and if the brotli package is installed, a brotli) compressed copy
+in dynamic_file_path/static, so they don't need to be compressed for every request.
+"""
+
+from gzip import compress as gzip_compress
+from hashlib import sha256
+from mimetypes import guess_type
+import os
+
+from . import config
+
+try:
+	import brotli
+except ImportError:
+	brotli = None
+
+"""How long browsers may keep files with a hash in their name, in seconds (a year)."""
+far_future = 365 * 24 * 3600
+
+"""The Content-Encodings of the compressed copies, the extension of their file, and how to make them.
+
+Ordered by preference, since brotli files are usually smaller.
+"""
+encodings = [('gzip', '.gz', lambda data: gzip_compress(data, 9, mtime=0))]
+if brotli is not None:
+	encodings.insert(0, ('br', '.br', lambda data: brotli.compress(data, quality=11)))
+
+"""Maps file name -> hashed name, and hashed name -> file name."""
+manifest = {}
+_originals = {}
+
+def _is_compressible(name):
+	mimetype, encoding = guess_type(name)
+	if mimetype is None or encoding is not None:
+		return False
+	return mimetype.startswith('text/') or mimetype in ('application/javascript', 'application/json', 'image/svg+xml')
+
+def hashed_name(name, data):
+	"""Put (part of) the hash of the data before the extension of the name."""
+	base, extension = os.path.splitext(name)
+	return "{}.{}{}".format(base, sha256(data).hexdigest()[:16], extension)
+
+def compressed_directory():
+	return os.path.join(config.dynamic_file_path, 'static')
+
+def _write(path, data):
+	# write to a temporary file first, so other processes never serve half a file
+	os.makedirs(os.path.dirname(path), exist_ok=True)
+	temp_path = "{}.{}.tmp".format(path, os.getpid())
+	with open(temp_path, 'wb') as temp_file:
+		temp_file.write(data)
+	os.replace(temp_path, path)
+
+def build_manifest():
+	"""Hash all static files, and compress the text files that don't have compressed copies yet.
+
+	Returns how many compressed copies were made.
+	"""
+	new_manifest = {}
+	compressed = 0
+	for directory, subdirectories, files in os.walk(config.static_file_path):
+		for file_name in files:
+			path = os.path.join(directory, file_name)
+			name = os.path.relpath(path, config.static_file_path).replace(os.sep, '/')
+			with open(path, 'rb') as static_file:
+				data = static_file.read()
+			hashed = new_manifest[name] = hashed_name(name, data)
+			if not _is_compressible(name):
+				continue
+			for encoding, extension, compress in encodings:
+				compressed_path = os.path.join(compressed_directory(), hashed + extension)
+				# the name changes with the contents, so an existing copy is up to date
+				if os.path.exists(compressed_path):
+					continue
+				compressed_data = compress(data)
+				if len(compressed_data) < len(data):
+					_write(compressed_path, compressed_data)
+					compressed += 1
+	manifest.clear()
+	manifest.update(new_manifest)
+	_originals.clear()
+	_originals.update((hashed, name) for name, hashed in new_manifest.items())
+	return compressed
+
+def original_name(hashed):
+	"""The name of the static file with the hashed name, or None if there is no such file."""
+	return _originals.get(hashed)
+
+def compressed_file(hashed, accepted):
+	"""Find the best compressed copy of the file that the browser accepts.
+
+	Accepted is the Accept-Encoding header, like request.accept_encodings.
+	Returns (path, Content-Encoding), or (None, None) if there is no such copy.
+	"""
+	for encoding, extension, compress in encodings:
+		if not accepted[encoding]:
+			continue
+		path = os.path.join(compressed_directory(), hashed + extension)
+		if os.path.exists(path):
+			return path, encoding
+	return None, None
@@ -1,44 +1,116 @@
 from enum import Enum
-from flask import abort, session
+from flask import abort, has_request_context, session
 from functools import wraps
 
 from .app import app
 from . import config
-from .person import User, get_logged_in
+from .database import db, DBClass, bump_version, get_version, version_stamp
+from .person import User, forget_auth_context, get_auth_context
 
 class levels(Enum):
 	"""The possible authorization levels.
 	
 	See has_auth and require_auth for using these.
 	When adding another auth level, add an entry to _auth_lookup.
+	The value of a level is its bit in auth_mask, so keep them small and unique.
 	"""
 	any = 0
 	logged_in = 1
 	god = 2 # access to everything
 	shadow_god = 3 # the user or the shadow_user is a god
-	no_key = 4 # the user is not using an API key
+	no_key = 4 # the user is logged in, but not using an API key
 	blog = 5 # the user may make new blog posts and edit their own
 
-def _has_auth_any(user):
+class AuthGrant(DBClass):
+	"""Gives a user some auth level, e.g. levels.god or levels.blog.
+
+	Use grant_level and revoke_level to change these, so every process notices.
+	"""
+	id = db.Column(db.Integer, primary_key=True)
+	user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False, index=True)
+	level = db.Column(db.Enum(levels), nullable=False)
+
+	__table_args__ = (
+			db.UniqueConstraint('user_id', 'level'),
+	)
+
+	def __init__(self, user, level):
+		self.user_id = user.id
+		self.level = level
+
+"""The name of the VersionStamp that changes with the AuthGrants."""
+_grants_version_name = version_stamp('auth_grants')
+"""Maps user id -> frozenset of levels granted to them, as of _grant_cache_version."""
+_grant_cache = {}
+_grant_cache_version = None
+"""How many users to remember the grants of, before starting over."""
+_grant_cache_size = 10000
+
+def granted_levels(user_id):
+	"""Get the set of levels explicitly granted to the user with the given id.
+
+	The grants are cached in this process until the version stamp changes,
+	which is checked once per request.
+	"""
+	global _grant_cache_version
+	version = get_version(_grants_version_name)
+	if version != _grant_cache_version or len(_grant_cache) >= _grant_cache_size:
+		_grant_cache.clear()
+		_grant_cache_version = version
+	if user_id not in _grant_cache:
+		query = db.session.query(AuthGrant.level).filter_by(user_id=user_id)
+		_grant_cache[user_id] = frozenset(level for level, in query)
+	return _grant_cache[user_id]
+
+def grant_level(user, level):
+	"""Give the user the auth level. Commit the session afterwards."""
+	if level in granted_levels(user.id):
+		return
+	db.session.add(AuthGrant(user, level))
+	bump_version(_grants_version_name)
+	_grant_cache.pop(user.id, None)
+def revoke_level(user, level):
+	"""Take the auth level away from the user. Commit the session afterwards."""
+	AuthGrant.query.filter_by(user_id=user.id, level=level).delete(synchronize_session=False)
+	bump_version(_grants_version_name)
+	_grant_cache.pop(user.id, None)
+
+def grant_config_gods():
+	"""Make the users in config.god_ids gods, returning how many weren't yet.
+
+	Gods used to be listed in the config, so setup calls this to keep them gods after upgrading.
+	"""
+	granted = 0
+	for user_id in getattr(config, 'god_ids', ()):
+		user = User.query.get(user_id)
+		if user is not None and levels.god not in granted_levels(user.id):
+			grant_level(user, levels.god)
+			granted += 1
+	db.session.commit()
+	return granted
+
+# The checks get the AuthContext of the request, or None when there is no request.
+def _has_auth_any(user, context):
 	return True
-def _has_auth_logged_in(user):
+def _has_auth_logged_in(user, context):
 	return user is not None
-def _has_auth_god(user):
-	return user is not None and user.id in config.god_ids
-def _has_auth_shadow_god(user):
+def _has_auth_god(user, context):
+	return user is not None and levels.god in granted_levels(user.id)
+def _has_auth_shadow_god(user, context):
 	# Note that this condition shouldn't be true,
 	# as long as the has_auth function doesn't change.
 	# Of course, that's a bit of a dangerous assumption.
-	if _has_auth_god(user):
+	if _has_auth_god(user, context):
 		return True
-	if 'shadow_user' in session:
-		return session['shadow_user'] in config.god_ids
-def _has_auth_no_key(user):
-	if 'current_user' not in session:
+	if context is None or context.shadow_user_id is None:
+		return False
+	return levels.god in granted_levels(context.shadow_user_id)
+def _has_auth_no_key(user, context):
+	if user is None or context is None or context.api_key is not None:
 		return False
-	return user.id == session['current_user']
-def _has_auth_blog(user):
-	return False # TODO let non-gods make blog posts
+	return user.id == context.user_id
+def _has_auth_blog(user, context):
+	return user is not None and levels.blog in granted_levels(user.id)
 
 _auth_lookup = {
 	levels.any: _has_auth_any,
@@ -49,7 +121,46 @@ _auth_lookup = {
 	levels.blog: _has_auth_blog,
 }
 
+def level_mask(*auth_levels):
+	"""Get the bitmask that has exactly the bits for the given levels set."""
+	mask = 0
+	for level in auth_levels:
+		mask |= 1 << level.value
+	return mask
+"""The bitmask of someone who has every level."""
+_all_levels = level_mask(*levels)
+
+def _compile_auth_mask(user, context):
+	"""Run all the checks for the user, giving the bitmask of levels they have."""
+	if _has_auth_god(user, context):
+		if context is not None and context.api_key is not None:
+			# even a god's key can't manage keys, or a leaked key could make new ones before it's revoked
+			return _all_levels & ~level_mask(levels.no_key)
+		return _all_levels
+	mask = 0
+	for level, check in _auth_lookup.items():
+		if check(user, context):
+			mask |= 1 << level.value
+	return mask
+
 Unspecified = object()
+def auth_mask(user=Unspecified):
+	"""Get the bitmask of all levels the user has, see level_mask.
+
+	Not passing an argument means the currently logged in user (if any),
+	passing in None means a user that isn't logged in.
+	For the logged in user, the mask is computed once per request and stored in the AuthContext.
+	"""
+	if not has_request_context():
+		assert user is not Unspecified, "there is no logged in user outside a request"
+		return _compile_auth_mask(user, None)
+	context = get_auth_context()
+	if user is not Unspecified and user is not context.user:
+		return _compile_auth_mask(user, context)
+	if context.auth_mask is None:
+		context.auth_mask = _compile_auth_mask(context.user, context)
+	return context.auth_mask
+
 def has_auth(level, user=Unspecified):
 	"""Does the user have the given authorization level?
 
@@ -57,17 +168,17 @@ def has_auth(level, user=Unspecified):
 	passing in None means a user that isn't logged in.
 	This is basically a giant ball of special-casing, which you can find elsewhere in this file.
 	"""
-	if user is Unspecified:
-		user = get_logged_in()
-	if _has_auth_god(user):
-		return True
-	return _auth_lookup[level](user)
-def require_auth(level):
-	"""Decorator for requiring an auth level in a route function."""
+	return bool(auth_mask(user) & (1 << level.value))
+def require_auth(*auth_levels):
+	"""Decorator for requiring one or more auth levels in a route function.
+
+	The user needs to have all of the given levels.
+	"""
+	required = level_mask(*auth_levels)
 	def require_auth_decorator(func):
 		@wraps(func)
 		def wrapped(*args, **kwargs):
-			if not has_auth(level):
+			if auth_mask() & required != required:
 				return abort(403)
 			return func(*args, **kwargs)
 		return wrapped
@@ -86,10 +197,12 @@ def set_shadow_user(current_user):
 		# get rid of shadowing
 		app.logger.debug("ending shadowing for {}".format(session['shadow_user']))
 		session['current_user'] = session.pop('shadow_user', None)
+		forget_auth_context()
 		return
 
 	# don't overwrite the shadow user
 	if 'shadow_user' not in session:
 		session['shadow_user'] = session['current_user']
 	session['current_user'] = current_user
+	forget_auth_context()
 	app.logger.debug("{} is shadowing {}".format(session['shadow_user'], session['current_user']))
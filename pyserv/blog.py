@@ -1,7 +1,35 @@
 from datetime import datetime
+from html import unescape
+import re
+
+from sqlalchemy.orm import validates
+from sqlalchemy.orm.attributes import set_committed_value
 
 from .auth import Unspecified, has_auth, levels
-from .database import db, DBClass
+from .database import db, DBClass, Page, decode_cursor, encode_cursor
+from .markup import render, renderer_version
+
+"""How many characters of the text the excerpt of a post has at most (without the ellipsis)."""
+excerpt_length = 300
+
+_whitespace = re.compile(r'\s+')
+# the tags between blocks of text separate words, the others (like <em>) don't
+_block_tag = re.compile(r'</?(?:p|h[1-6]|ul|ol|li|br)\b[^>]*>')
+_tag = re.compile(r'<[^>]*>')
+
+def make_excerpt(html):
+	"""Get the start of the text of the rendered HTML, cut off between words and with an ellipsis if it was too long.
+
+	The excerpt is plain text, so it should be escaped like any other text.
+	"""
+	text = unescape(_tag.sub("", _block_tag.sub(" ", html or "")))
+	text = _whitespace.sub(" ", text).strip()
+	if len(text) <= excerpt_length:
+		return text
+	cut = text.rfind(" ", 0, excerpt_length + 1)
+	if cut <= 0:
+		cut = excerpt_length
+	return text[:cut].rstrip() + "…"
 
 class BlogPost(DBClass):
 	"""A single post with a title, contents and author."""
@@ -9,17 +37,30 @@ class BlogPost(DBClass):
 	id = db.Column(db.Integer, primary_key=True)
 	title = db.Column(db.Unicode(255))
 	contents = db.Column(db.UnicodeText())
+	"""The start of the text of the contents, for overviews. Kept up to date whenever the contents are set."""
+	excerpt = db.Column(db.Unicode(excerpt_length + 1))
+	"""The contents rendered as HTML, and the renderer_version that rendered it. See rendered_html."""
+	html = db.Column(db.UnicodeText())
+	html_version = db.Column(db.Integer)
 	posted = db.Column(db.DateTime(timezone=True))
 	last_updated = db.Column(db.DateTime(timezone=True))
 	# TEST: when modifying a BlogPost, last_updated >= posted
 	"""Can users without blog rights see this post?"""
 	public = db.Column(db.Boolean())
+	"""Goes up with every edit, so concurrent edits can't overwrite each other (see commit_with_retries)."""
+	version = db.Column(db.Integer, nullable=False)
 
 	type = db.Column(db.Unicode(255))
 	__mapper_args__ = {
 			'polymorphic_identity': 'BlogPost',
-			'polymorphic_on': type
+			'polymorphic_on': type,
+			'version_id_col': version,
 	}
+	# for the overview with and without blog rights, see all_posts
+	__table_args__ = (
+			db.Index('ix_blog_post_posted_id', 'posted', 'id'),
+			db.Index('ix_blog_post_public_posted_id', 'public', 'posted', 'id'),
+	)
 	def __init__(self, *, title, contents, posted=None, last_updated=None, public=False):
 		"""Make a new blog post.
 		
@@ -40,22 +81,123 @@ class BlogPost(DBClass):
 		self.last_updated = last_updated
 		self.public = public
 
+	@validates('contents')
+	def _update_excerpt(self, key, contents):
+		# render now, so showing the post never has to
+		self.html = render(contents)
+		self.html_version = renderer_version
+		self.excerpt = make_excerpt(self.html)
+		return contents
+
+	def rendered_html(self):
+		"""Get the contents as HTML, rendering them again if the stored HTML was made by an older renderer.
+
+		The new HTML (and excerpt) is stored right away in a short transaction of its own,
+		so the post is rendered only once after a renderer change, even before backfill_excerpts has run.
+		The version of the post stays the same, so it doesn't get in the way of anyone editing it.
+		"""
+		if self.html_version == renderer_version:
+			return self.html
+		html = render(self.contents)
+		excerpt = make_excerpt(html)
+		table = BlogPost.__table__
+		with db.engine.begin() as connection:
+			# if the post was edited in the meantime, its HTML is already up to date
+			connection.execute(table.update().where(db.and_(
+				table.c.id == self.id, table.c.version == self.version,
+			)).values(html=html, html_version=renderer_version, excerpt=excerpt))
+		set_committed_value(self, 'html', html)
+		set_committed_value(self, 'html_version', renderer_version)
+		set_committed_value(self, 'excerpt', excerpt)
+		return html
+
 	def should_see(self, user=Unspecified):
 		"""Determine whether the user has enough rights to see this post."""
 		return has_auth(levels.blog, user) or self.public
 
-def all_posts(start=0, count=10, user=Unspecified):
-	"""Get all blog posts, latest first, from the start number up to some limit.
+def _post_cursor(post):
+	return encode_cursor([post.posted.isoformat(), post.id])
+
+def backfill_excerpts(batch_size=500):
+	"""Set the excerpt of every post from its HTML, a batch of posts at a time.
+
+	Posts rendered by an older renderer (or not at all) are rendered again first.
+	This doesn't change the version of the posts, so it doesn't get in the way of anyone editing them.
+	Returns the number of posts.
+	"""
+	table = BlogPost.__table__
+	last_id = 0
+	done = 0
+	while True:
+		with db.engine.begin() as connection:
+			rows = connection.execute(db.select([
+				table.c.id, table.c.version, table.c.contents, table.c.html, table.c.html_version,
+			]).where(table.c.id > last_id).order_by(table.c.id).limit(batch_size)).fetchall()
+			if not rows:
+				return done
+			for row in rows:
+				html = row.html
+				values = {}
+				if row.html_version != renderer_version:
+					html = values['html'] = render(row.contents)
+					values['html_version'] = renderer_version
+				# if the post was edited in the meantime, it is already up to date
+				connection.execute(table.update().where(db.and_(
+					table.c.id == row.id, table.c.version == row.version,
+				)).values(excerpt=make_excerpt(html), **values))
+		last_id = rows[-1].id
+		done += len(rows)
+
+def all_posts(start=0, count=10, user=Unspecified, *, before=None, after=None):
+	"""Get a Page of blog posts, latest first, from the start number up to some limit.
 	
-	Note that we define "latest" as the one which has the latest posting timestamp.
+	Note that we define "latest" as the one which has the latest posting timestamp (then the highest id).
 	When you want to sort on updates, you might want to extend this function.
 	
+	Instead of counting from the start, which gets slower for every post you skip,
+	pass the page's next_cursor as `before` to get older posts,
+	or its previous_cursor as `after` to get newer posts.
+	Raises a ValueError if the cursor is invalid.
+	
+	The contents of the posts aren't loaded until you use them, so use the excerpt instead.
+
 	Useful for implementing functions like an overview of all posts to the blog.
 	"""
-	query = BlogPost.query
+	query = BlogPost.query.options(db.defer(BlogPost.contents))
 	# Users with no special rights still have to see the right number of posts
 	# so we filter in the database before sending to the client
 	if not has_auth(levels.blog, user):
 		query = query.filter(BlogPost.public == True)
-	return query.order_by(BlogPost.posted.desc()).offset(start).limit(count).all()
+
+	cursor = before if before is not None else after
+	if cursor is not None:
+		try:
+			posted, post_id = decode_cursor(cursor)
+			posted = datetime.fromisoformat(posted)
+		except (TypeError, ValueError) as e:
+			raise ValueError("invalid cursor {}".format(cursor)) from e
+		if not isinstance(post_id, int):
+			raise ValueError("invalid cursor {}".format(cursor))
+	# the first condition on posted alone is redundant, but lets the database start walking the index at the cursor
+	if before is not None:
+		query = query.filter(BlogPost.posted <= posted, db.or_(BlogPost.posted < posted, BlogPost.id < post_id))
+	elif after is not None:
+		# walk towards the newer posts, and turn them around afterwards
+		query = query.filter(BlogPost.posted >= posted, db.or_(BlogPost.posted > posted, BlogPost.id > post_id))
+		posts = query.order_by(BlogPost.posted, BlogPost.id).limit(count + 1).all()
+		newer = len(posts) > count
+		posts = posts[:count][::-1]
+		if not posts:
+			return Page([])
+		return Page(posts, next_cursor=_post_cursor(posts[-1]),
+				previous_cursor=_post_cursor(posts[0]) if newer else None)
+
+	# get one more than we need to see whether there are older posts
+	posts = query.order_by(BlogPost.posted.desc(), BlogPost.id.desc()).offset(start).limit(count + 1).all()
+	older = len(posts) > count
+	posts = posts[:count]
+	if not posts:
+		return Page([])
+	return Page(posts, next_cursor=_post_cursor(posts[-1]) if older else None,
+			previous_cursor=_post_cursor(posts[0]) if before is not None else None)
 
@@ -1,6 +1,9 @@
+from collections import Counter, namedtuple
+from datetime import datetime, timedelta
 from enum import Enum
+from sqlalchemy import event
 
-from .database import db, DBClass
+from .database import db, DBClass, Page, decode_cursor, encode_cursor
 
 class BugStatus(Enum):
 	# open: when you can work on it
@@ -58,12 +61,21 @@ class Bug(DBClass):
 	status = db.Column(db.Enum(BugStatus))
 	priority = db.Column(db.Enum(BugPriority))
 	messages = db.relationship('BugMessage', backref='bug', lazy='dynamic')
+	"""Goes up with every change, so concurrent changes can't overwrite each other (see commit_with_retries)."""
+	version = db.Column(db.Integer, nullable=False)
 
 	type = db.Column(db.Unicode(255))
 	__mapper_args__ = {
 			'polymorphic_identity': 'Bug',
-			'polymorphic_on': type
+			'polymorphic_on': type,
+			'version_id_col': version,
 	}
+	# for the overview, see get_all_bugs
+	__table_args__ = (
+			db.Index('ix_bug_status_priority_id', 'status', 'priority', 'id'),
+			db.Index('ix_bug_status_id', 'status', 'id'),
+			db.Index('ix_bug_priority_id', 'priority', 'id'),
+	)
 
 	def __init__(self, *,
 			title,
@@ -81,25 +93,35 @@ class BugMessage(DBClass):
 	new_title = db.Column(db.Unicode(255))
 	new_status = db.Column(db.Enum(BugStatus))
 	new_priority = db.Column(db.Enum(BugPriority))
+	posted = db.Column(db.DateTime(timezone=True))
 
 	type = db.Column(db.Unicode(255))
 	__mapper_args__ = {
 			'polymorphic_identity': 'BugMessage',
 			'polymorphic_on': type
 	}
+	# for the timeline, see bug_timeline, and for the past, see bug_as_of
+	__table_args__ = (
+			db.Index('ix_bug_message_bug_id_id', 'bug_id', 'id'),
+			db.Index('ix_bug_message_posted', 'posted'),
+	)
 
 	def __init__(self, bug, *,
-			title=None, status=None, priority=None):
+			title=None, status=None, priority=None, posted=None):
 		"""Constructor for the BugMessage class.
 		
 		Does not modify any field in the parent Bug.
 		For that, use the new_message function.
 		(Or directly call self.update().)
+		If the time of posting is left None, it will be the time this object is created.
 		"""
+		if posted is None:
+			posted = datetime.now()
 		self.bug = bug
 		self.new_title = title
 		self.new_status = status
 		self.new_priority = priority
+		self.posted = posted
 
 	@property
 	def description(self):
@@ -109,8 +131,18 @@ class BugMessage(DBClass):
 		"""
 		return ""
 
+	def record_change(self, old_status, old_priority):
+		"""Remember how this message changes the status and priority of the bug, for the BugTrends.
+
+		The change is added to the trends when the message is inserted.
+		"""
+		self.trend_changes = trend_changes(old_status, old_priority,
+				old_status if self.new_status is None else self.new_status,
+				old_priority if self.new_priority is None else self.new_priority)
+
 	def update(self):
 		"""Set the parent Bug's fields to the values in this Message."""
+		self.record_change(self.bug.status, self.bug.priority)
 		if self.new_title is not None:
 			self.bug.title = self.new_title
 		if self.new_priority is not None:
@@ -132,6 +164,224 @@ class BugUserMessage(BugMessage):
 		super().__init__(bug, **kwargs)
 		self.description = description
 
+class BugCount(DBClass):
+	"""How many bugs there are with some status and priority.
+
+	There is a row for each combination, kept up to date whenever a Bug is flushed,
+	so reading all of them takes a constant amount of work.
+	See bug_counts and check_bug_counts.
+	"""
+	status = db.Column(db.Enum(BugStatus), primary_key=True)
+	priority = db.Column(db.Enum(BugPriority), primary_key=True)
+	count = db.Column(db.Integer, nullable=False, default=0)
+
+	def __init__(self, status, priority, count=0):
+		self.status = status
+		self.priority = priority
+		self.count = count
+
+@event.listens_for(BugCount.__table__, 'after_create')
+def _create_bug_counts(table, connection, **kwargs):
+	connection.execute(table.insert(), [
+		{'status': status, 'priority': priority, 'count': 0}
+		for status in BugStatus for priority in BugPriority
+	])
+
+def _change_bug_count(connection, status, priority, change):
+	if status is None or priority is None:
+		return
+	table = BugCount.__table__
+	connection.execute(table.update().where(db.and_(
+		table.c.status == status, table.c.priority == priority
+	)).values(count=table.c.count + change))
+
+@event.listens_for(Bug, 'after_insert')
+def _count_new_bug(mapper, connection, bug):
+	_change_bug_count(connection, bug.status, bug.priority, 1)
+
+@event.listens_for(Bug, 'after_update')
+def _count_updated_bug(mapper, connection, bug):
+	state = db.inspect(bug)
+	status = state.attrs.status.history
+	priority = state.attrs.priority.history
+	if not (status.has_changes() or priority.has_changes()):
+		return
+	old_status = status.deleted[0] if status.deleted else bug.status
+	old_priority = priority.deleted[0] if priority.deleted else bug.priority
+	_change_bug_count(connection, old_status, old_priority, -1)
+	_change_bug_count(connection, bug.status, bug.priority, 1)
+
+@event.listens_for(Bug, 'after_delete')
+def _count_deleted_bug(mapper, connection, bug):
+	_change_bug_count(connection, bug.status, bug.priority, -1)
+
+def bug_counts():
+	"""Get a dict (status, priority) -> number of bugs, for every status and priority."""
+	return {(status, priority): count for status, priority, count in
+			db.session.query(BugCount.status, BugCount.priority, BugCount.count)}
+
+def check_bug_counts(repair=False):
+	"""Count all the bugs from scratch and compare them to the BugCounts.
+
+	Returns a dict (status, priority) -> (stored count, actual count) of the counts that drifted.
+	If repair is True, the stored counts are fixed too, so commit the session afterwards.
+	"""
+	actual = {(status, priority): 0 for status in BugStatus for priority in BugPriority}
+	query = db.session.query(Bug.status, Bug.priority, db.func.count(Bug.id)).group_by(Bug.status, Bug.priority)
+	for status, priority, count in query:
+		if (status, priority) in actual:
+			actual[status, priority] = count
+
+	stored = {(row.status, row.priority): row for row in BugCount.query.all()}
+	drift = {}
+	for (status, priority), actual_count in actual.items():
+		row = stored.get((status, priority))
+		stored_count = row.count if row is not None else None
+		if stored_count == actual_count:
+			continue
+		drift[status, priority] = (stored_count, actual_count)
+		if not repair:
+			continue
+		if row is None:
+			db.session.add(BugCount(status, priority, actual_count))
+		else:
+			row.count = actual_count
+	return drift
+
+class BugTrend(DBClass):
+	"""How many bugs with some priority were opened and closed on a day.
+
+	Bugs that stay open but change priority are counted as moved out of the old priority and into the new one,
+	so the number of open bugs on a day is the sum of opened - closed + moved_in - moved_out up to that day.
+	The rows are updated whenever a message that changes these is inserted (see BugMessage.record_change),
+	and can be rebuilt from all messages with backfill_bug_trends.
+	"""
+	day = db.Column(db.Date, primary_key=True)
+	priority = db.Column(db.Enum(BugPriority), primary_key=True)
+	opened = db.Column(db.Integer, nullable=False, default=0)
+	closed = db.Column(db.Integer, nullable=False, default=0)
+	moved_in = db.Column(db.Integer, nullable=False, default=0)
+	moved_out = db.Column(db.Integer, nullable=False, default=0)
+
+def trend_changes(old_status, old_priority, new_status, new_priority):
+	"""Get a Counter (priority, column of BugTrend) -> change for a bug going from the old to the new values.
+
+	A new bug has None as its old status and priority.
+	"""
+	was_open = old_status in open_statuses
+	is_open = new_status in open_statuses
+	changes = Counter()
+	if is_open and not was_open:
+		changes[new_priority, 'opened'] += 1
+	elif was_open and not is_open:
+		changes[old_priority, 'closed'] += 1
+	elif was_open and is_open and old_priority != new_priority:
+		changes[old_priority, 'moved_out'] += 1
+		changes[new_priority, 'moved_in'] += 1
+	return changes
+
+def _change_trend(connection, day, priority, changes):
+	"""Add the changes (column -> number) to the BugTrend of the day and priority."""
+	if priority is None:
+		return
+	table = BugTrend.__table__
+	if connection.dialect.name == 'postgresql':
+		# two transactions could both be the first to change the trend of today
+		from sqlalchemy.dialects.postgresql import insert
+		statement = insert(table).values(day=day, priority=priority, **changes)
+		connection.execute(statement.on_conflict_do_update(
+			index_elements=[table.c.day, table.c.priority],
+			set_={column: table.c[column] + statement.excluded[column] for column in changes},
+		))
+		return
+	# elsewhere (e.g. SQLite) only one transaction writes at a time
+	updated = connection.execute(table.update().where(db.and_(
+		table.c.day == day, table.c.priority == priority,
+	)).values({column: table.c[column] + change for column, change in changes.items()}))
+	if not updated.rowcount:
+		connection.execute(table.insert().values(day=day, priority=priority, **changes))
+
+def apply_trend_changes(connection, changes):
+	"""Add a Counter (day, priority, column) -> change to the BugTrends."""
+	by_row = {}
+	for (day, priority, column), change in changes.items():
+		if change:
+			by_row.setdefault((day, priority), {})[column] = change
+	for (day, priority), row_changes in by_row.items():
+		_change_trend(connection, day, priority, row_changes)
+
+@event.listens_for(BugMessage, 'after_insert', propagate=True)
+def _trend_message(mapper, connection, message):
+	changes = getattr(message, 'trend_changes', None)
+	if not changes:
+		return
+	day = (message.posted or datetime.now()).date()
+	apply_trend_changes(connection, Counter({
+		(day, priority, column): change for (priority, column), change in changes.items()
+	}))
+
+def backfill_bug_trends():
+	"""Rebuild all BugTrends from the messages of all bugs.
+
+	Reads the messages through a server-side cursor, so it works for any number of messages.
+	Messages posted while it runs may be missed, so run it when nobody is posting.
+	Commits when it is done, and returns the number of messages that were replayed.
+	"""
+	messages = BugMessage.__table__
+	query = db.select([
+		messages.c.bug_id, messages.c.posted, messages.c.new_status, messages.c.new_priority,
+	]).order_by(messages.c.bug_id, messages.c.id)
+	changes = Counter()
+	replayed = 0
+	with db.engine.begin() as connection:
+		bug_id = status = priority = None
+		for message in connection.execution_options(stream_results=True).execute(query):
+			if message.bug_id != bug_id:
+				bug_id, status, priority = message.bug_id, None, None
+			new_status = status if message.new_status is None else message.new_status
+			new_priority = priority if message.new_priority is None else message.new_priority
+			day = (message.posted or datetime.now()).date()
+			for (changed_priority, column), change in trend_changes(status, priority, new_status, new_priority).items():
+				changes[day, changed_priority, column] += change
+			status, priority = new_status, new_priority
+			replayed += 1
+		connection.execute(BugTrend.__table__.delete())
+		apply_trend_changes(connection, changes)
+	return replayed
+
+"""The numbers of bugs with some priority on a day, see bug_trends."""
+TrendDay = namedtuple('TrendDay', ['open', 'opened', 'closed'])
+
+def bug_trends(start, end):
+	"""Get a list of (day, {priority: TrendDay}) for every day from start up to and including end.
+
+	Only reads the BugTrends, never the messages.
+	"""
+	days = (end - start).days + 1
+	if days <= 0:
+		return []
+	net = BugTrend.opened - BugTrend.closed + BugTrend.moved_in - BugTrend.moved_out
+	open_bugs = {priority: 0 for priority in BugPriority}
+	for priority, count in db.session.query(BugTrend.priority, db.func.sum(net)).filter(
+			BugTrend.day < start,
+	).group_by(BugTrend.priority):
+		open_bugs[priority] = count or 0
+
+	rows = {(row.day, row.priority): row for row in BugTrend.query.filter(
+			BugTrend.day >= start, BugTrend.day <= end,
+	)}
+	trends = []
+	for offset in range(days):
+		day = start + timedelta(days=offset)
+		trend = {}
+		for priority in BugPriority:
+			row = rows.get((day, priority))
+			if row is not None:
+				open_bugs[priority] += row.opened - row.closed + row.moved_in - row.moved_out
+			trend[priority] = TrendDay(open_bugs[priority], row.opened if row else 0, row.closed if row else 0)
+		trends.append((day, trend))
+	return trends
+
 def bug_from_user(*, title, status, priority, description):
 	"""Make a new Bug from a user's report.
 	
@@ -139,30 +389,310 @@ def bug_from_user(*, title, status, priority, description):
 	"""
 	new_bug = Bug(title=title, status=status, priority=priority)
 	new_message = BugUserMessage(new_bug, description, title=title, status=status, priority=priority)
+	new_message.record_change(None, None)
 
 	return new_bug
 
-def get_all_bugs(statuses=open_statuses):
-	"""Get all bugs with one of the given statuses."""
+"""Maps name -> (column, enum of its values or None) for the columns get_all_bugs can sort on."""
+# bugs without a title sort as if it were empty, so the cursor can continue after them
+_sort_title = db.func.coalesce(Bug.title, "")
+db.Index('ix_bug_sort_title_id', _sort_title, Bug.id)
+
+bug_sort_columns = {
+	'status': (Bug.status, BugStatus),
+	'priority': (Bug.priority, BugPriority),
+	'title': (_sort_title, None),
+}
+
+def get_all_bugs(statuses=open_statuses, priorities=None, *,
+		sort='status', descending=False, after=None, count=None):
+	"""Get all bugs with one of the given statuses (and priorities), as a Page.
+
+	The bugs are sorted by the column named by `sort` (see bug_sort_columns), then by id.
+	Leaving count None gives all bugs at once, otherwise you get at most count bugs,
+	and passing the page's next_cursor as `after` gives the bugs after those.
+	Raises a ValueError if the cursor is invalid.
+	"""
+	column, column_enum = bug_sort_columns[sort]
+	query = Bug.query.filter(Bug.status.in_(list(statuses)))
+	if priorities is not None:
+		query = query.filter(Bug.priority.in_(list(priorities)))
+
+	if after is not None:
+		try:
+			last_value, last_id = decode_cursor(after)
+			if column_enum is not None:
+				last_value = column_enum[last_value]
+		except (KeyError, TypeError) as e:
+			raise ValueError("invalid cursor {}".format(after)) from e
+		# other databases than SQLite don't compare numbers to strings, so check before querying
+		if not isinstance(last_id, int) or (column_enum is None and not isinstance(last_value, str)):
+			raise ValueError("invalid cursor {}".format(after))
+		# continue right after the last bug of the previous page, so the index does the skipping
+		if descending:
+			query = query.filter(db.or_(column < last_value, db.and_(column == last_value, Bug.id < last_id)))
+		else:
+			query = query.filter(db.or_(column > last_value, db.and_(column == last_value, Bug.id > last_id)))
+
+	if descending:
+		query = query.order_by(column.desc(), Bug.id.desc())
+	else:
+		query = query.order_by(column, Bug.id)
+	if count is None:
+		return Page(query.all())
 
-	# TODO: is this really the best way to do this?
-	result = []
-	for status in statuses:
-		result.extend(Bug.query.filter_by(status=status).all())
-	return result
+	# get one more than we need to see whether there is a next page
+	bugs = query.limit(count + 1).all()
+	if len(bugs) <= count:
+		return Page(bugs)
+	bugs = bugs[:count]
+	last = bugs[-1]
+	last_value = getattr(last, sort)
+	if last_value is None:
+		last_value = ""
+	return Page(bugs, next_cursor=encode_cursor([last_value, last.id]))
 
-def new_message(message_cls, bug, *args, title=None, status=None, priority=None, **kwargs):
+def new_message(message_cls, bug, *args, title=None, status=None, priority=None, seen=None, **kwargs):
 	"""Create a new BugMessage that is the last update to the Bug.
 	
 	Will set the Bug's fields to this message's fields, if applicable.
+	If seen is given, it is the BugState the poster saw when writing the message,
+	and only the fields that differ from it are changed, so changes made in the meantime stay.
+	When someone else changed the same field in the meantime, their change wins,
+	and the name of the field is put in the message's `conflicts` list.
 	"""
-	# don't modify things when they're already the same
-	if title == bug.title:
-		title = None
-	if status == bug.status:
-		status = None
-	if priority == bug.priority:
-		priority = None
-	message = message_cls(bug, *args, title=title, status=status, priority=priority, **kwargs)
+	message_conflicts = []
+	new_values = {}
+	for field, value in (('title', title), ('status', status), ('priority', priority)):
+		if seen is not None and value is not None and value != getattr(bug, field):
+			if value == getattr(seen, field):
+				# the poster didn't touch this field
+				value = None
+			elif getattr(bug, field) != getattr(seen, field):
+				message_conflicts.append(field)
+				value = None
+		# don't modify things when they're already the same
+		if value == getattr(bug, field):
+			value = None
+		new_values[field] = value
+	message = message_cls(bug, *args, **new_values, **kwargs)
 	message.update()
+	message.conflicts = message_conflicts
 	return message
+
+"""A message in the timeline of a bug, with the values of the fields before the message."""
+TimelineEntry = namedtuple('TimelineEntry', ['message', 'prev_title', 'prev_status', 'prev_priority'])
+
+def bug_timeline(bug, before=None, count=50, until=None):
+	"""Get a Page of TimelineEntries for the bug's messages, newest first.
+
+	All kinds of messages are loaded in a single query.
+	Pass the page's next_cursor as `before` to get the older messages.
+	If until is given, only messages posted up to that time are included.
+	Raises a ValueError if the cursor is invalid.
+	"""
+	any_message = db.with_polymorphic(BugMessage, '*')
+	query = db.session.query(any_message).filter(any_message.bug_id == bug.id)
+	if until is not None:
+		query = query.filter(any_message.posted <= until)
+	if before is not None:
+		try:
+			before_id, = decode_cursor(before)
+		except TypeError as e:
+			raise ValueError("invalid cursor {}".format(before)) from e
+		if not isinstance(before_id, int):
+			raise ValueError("invalid cursor {}".format(before))
+		query = query.filter(any_message.id < before_id)
+
+	# get one more than we need to see whether there are older messages
+	messages = query.order_by(any_message.id.desc()).limit(count + 1).all()
+	next_cursor = None
+	if len(messages) > count:
+		messages = messages[:count]
+		next_cursor = encode_cursor([messages[-1].id])
+	if not messages:
+		return Page([])
+
+	# the previous values of the oldest message come from the messages before this page
+	oldest_id = messages[-1].id
+	prev = {}
+	for field in ('new_title', 'new_status', 'new_priority'):
+		column = getattr(BugMessage, field)
+		prev[field] = db.session.query(column).filter(
+				BugMessage.bug_id == bug.id,
+				BugMessage.id < oldest_id,
+				column != None,
+		).order_by(BugMessage.id.desc()).limit(1).scalar()
+
+	entries = []
+	for message in reversed(messages):
+		entries.append(TimelineEntry(message, prev['new_title'], prev['new_status'], prev['new_priority']))
+		for field in prev:
+			if getattr(message, field) is not None:
+				prev[field] = getattr(message, field)
+	entries.reverse()
+	return Page(entries, next_cursor=next_cursor)
+
+class BugCheckpoint(DBClass):
+	"""The state of a bug right after one of its messages.
+
+	Made automatically every checkpoint_interval messages,
+	so the state at any time can be found by replaying a few messages after a checkpoint.
+	"""
+	id = db.Column(db.Integer, primary_key=True)
+	bug_id = db.Column(db.Integer, db.ForeignKey('bug.id'), nullable=False)
+	"""The last message that is included in this checkpoint."""
+	message_id = db.Column(db.Integer, db.ForeignKey('bug_message.id'), nullable=False)
+	posted = db.Column(db.DateTime(timezone=True))
+	title = db.Column(db.Unicode(255))
+	status = db.Column(db.Enum(BugStatus))
+	priority = db.Column(db.Enum(BugPriority))
+
+	__table_args__ = (
+			db.Index('ix_bug_checkpoint_bug_id_posted', 'bug_id', 'posted'),
+			db.Index('ix_bug_checkpoint_posted', 'posted'),
+	)
+
+"""How many messages there are between two checkpoints of a bug."""
+checkpoint_interval = 20
+
+"""The values of a bug at some moment, see bug_as_of."""
+BugState = namedtuple('BugState', ['id', 'title', 'status', 'priority'])
+
+def _replay(state, messages):
+	"""Apply the messages (rows with new_title, new_status and new_priority) to the state."""
+	for message in messages:
+		state = state._replace(
+			title=state.title if message.new_title is None else message.new_title,
+			status=state.status if message.new_status is None else message.new_status,
+			priority=state.priority if message.new_priority is None else message.new_priority,
+		)
+	return state
+
+@event.listens_for(BugMessage, 'after_insert', propagate=True)
+def _checkpoint_bug(mapper, connection, message):
+	"""Make a checkpoint if the bug has had checkpoint_interval messages since the last one."""
+	checkpoints = BugCheckpoint.__table__
+	messages = BugMessage.__table__
+	last = connection.execute(db.select([
+		checkpoints.c.message_id, checkpoints.c.title, checkpoints.c.status, checkpoints.c.priority,
+	]).where(checkpoints.c.bug_id == message.bug_id).order_by(checkpoints.c.message_id.desc()).limit(1)).first()
+
+	since = 0
+	state = BugState(message.bug_id, None, None, None)
+	if last is not None:
+		since = last.message_id
+		state = BugState(message.bug_id, last.title, last.status, last.priority)
+	replay = connection.execute(db.select([
+		messages.c.new_title, messages.c.new_status, messages.c.new_priority,
+	]).where(db.and_(
+		messages.c.bug_id == message.bug_id, messages.c.id > since, messages.c.id <= message.id,
+	)).order_by(messages.c.id)).fetchall()
+	if len(replay) < checkpoint_interval:
+		return
+
+	state = _replay(state, replay)
+	connection.execute(checkpoints.insert().values(
+		bug_id=message.bug_id, message_id=message.id, posted=message.posted,
+		title=state.title, status=state.status, priority=state.priority,
+	))
+
+def bug_as_of(bug_id, when):
+	"""Get the BugState of the bug at the given time, or None if it had no messages yet."""
+	# messages may be posted out of id order (e.g. when imported), so go by the time
+	checkpoint = BugCheckpoint.query.filter(
+			BugCheckpoint.bug_id == bug_id,
+			BugCheckpoint.posted <= when,
+	).order_by(BugCheckpoint.posted.desc(), BugCheckpoint.message_id.desc()).first()
+	since = 0
+	state = BugState(bug_id, None, None, None)
+	if checkpoint is not None:
+		since = checkpoint.message_id
+		state = BugState(bug_id, checkpoint.title, checkpoint.status, checkpoint.priority)
+
+	replay = db.session.query(BugMessage.new_title, BugMessage.new_status, BugMessage.new_priority).filter(
+			BugMessage.bug_id == bug_id,
+			BugMessage.id > since,
+			BugMessage.posted <= when,
+	).order_by(BugMessage.id).all()
+	if checkpoint is None and not replay:
+		return None
+	return _replay(state, replay)
+
+"""How many bugs all_bugs_as_of replays at once."""
+as_of_chunk_size = 500
+
+def _states_as_of(when, first_id, last_id):
+	"""Get the BugStates of the bugs with ids from first_id to last_id at the given time, sorted by id.
+
+	Bugs without any messages at that time are left out.
+	Each bug only needs its latest checkpoint and at most checkpoint_interval messages.
+	"""
+	# like bug_as_of, the latest checkpoint is the one with the latest time, not the highest id
+	latest_posted = db.session.query(
+			BugCheckpoint.bug_id,
+			db.func.max(BugCheckpoint.posted).label('posted'),
+	).filter(
+			BugCheckpoint.bug_id.between(first_id, last_id),
+			BugCheckpoint.posted <= when,
+	).group_by(BugCheckpoint.bug_id).subquery()
+	latest = db.session.query(
+			BugCheckpoint.bug_id,
+			db.func.max(BugCheckpoint.message_id).label('message_id'),
+	).join(latest_posted, db.and_(
+			BugCheckpoint.bug_id == latest_posted.c.bug_id,
+			BugCheckpoint.posted == latest_posted.c.posted,
+	)).group_by(BugCheckpoint.bug_id).subquery()
+
+	states = {}
+	checkpoints = BugCheckpoint.query.join(latest, db.and_(
+			BugCheckpoint.bug_id == latest.c.bug_id,
+			BugCheckpoint.message_id == latest.c.message_id,
+	))
+	for checkpoint in checkpoints:
+		states[checkpoint.bug_id] = BugState(checkpoint.bug_id, checkpoint.title, checkpoint.status, checkpoint.priority)
+
+	replay = db.session.query(
+			BugMessage.bug_id, BugMessage.new_title, BugMessage.new_status, BugMessage.new_priority,
+	).outerjoin(latest, BugMessage.bug_id == latest.c.bug_id).filter(
+			BugMessage.bug_id.between(first_id, last_id),
+			BugMessage.posted <= when,
+			db.or_(latest.c.message_id == None, BugMessage.id > latest.c.message_id),
+	).order_by(BugMessage.bug_id, BugMessage.id)
+	for message in replay:
+		state = states.get(message.bug_id, BugState(message.bug_id, None, None, None))
+		states[message.bug_id] = _replay(state, [message])
+	return [state for bug_id, state in sorted(states.items())]
+
+def all_bugs_as_of(when, statuses=open_statuses, priorities=None, *, after=None, count=None):
+	"""Get the BugStates of all bugs with the given statuses (and priorities) at the given time, as a Page.
+
+	The states are sorted by id, and bugs without any messages at that time are left out.
+	Leaving count None gives all bugs at once, otherwise you get at most count bugs,
+	and passing the page's next_cursor as `after` gives the bugs after those.
+	The bugs are replayed as_of_chunk_size at a time, until there are enough of them with the statuses and priorities.
+	Raises a ValueError if the cursor is invalid.
+	"""
+	last_id = 0
+	if after is not None:
+		values = decode_cursor(after)
+		if len(values) != 1 or not isinstance(values[0], int):
+			raise ValueError("invalid cursor {}".format(after))
+		last_id, = values
+
+	states = []
+	# get one more than we need to see whether there is a next page
+	while count is None or len(states) <= count:
+		ids = [bug_id for bug_id, in db.session.query(Bug.id).filter(
+				Bug.id > last_id,
+		).order_by(Bug.id).limit(as_of_chunk_size)]
+		if not ids:
+			break
+		states.extend(state for state in _states_as_of(when, ids[0], ids[-1])
+				if state.status in statuses and (priorities is None or state.priority in priorities))
+		last_id = ids[-1]
+
+	if count is None or len(states) <= count:
+		return Page(states)
+	states = states[:count]
+	return Page(states, next_cursor=encode_cursor([states[-1].id]))
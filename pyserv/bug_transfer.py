@@ -0,0 +1,274 @@
+"""Importing and exporting all bugs at once, as newline-delimited JSON.
+
+Each line is a bug, with its messages oldest first:
+	{"id": 1, "title": ..., "status": "New", "priority": "Low", "messages": [
+		{"type": "BugUserMessage", "posted": "2017-01-01T12:00:00",
+			"new_title": ..., "new_status": ..., "new_priority": ..., "description": ...},
+	]}
+Statuses and priorities are given by their enum names, and the type is the polymorphic identity of the message.
+The ids in the export are only informational: imported bugs and messages get new ones.
+
+Importing bypasses the ORM to insert many rows per statement,
+so it does the work of the mapper events itself:
+updating the BugCounts and BugTrends, making the BugCheckpoints, indexing for search and duplicates
+and outdating the cached pages.
+"""
+
+from collections import Counter, namedtuple
+from datetime import datetime
+from itertools import groupby
+import json
+
+from .bug import (Bug, BugCheckpoint, BugMessage, BugPriority, BugState, BugStatus, BugUserMessage,
+		_change_bug_count, _replay, apply_trend_changes, checkpoint_interval, trend_changes)
+from . import config
+from .database import db
+from .duplicates import BugBucket, BugSignature, index_rows
+from .page_cache import bump_page_version
+from .search import index_document
+
+"""The fields of a message that _replay needs."""
+_Change = namedtuple('_Change', ['new_title', 'new_status', 'new_priority'])
+
+"""How many values a single insert statement may contain (SQLite allows 999 by default)."""
+_max_parameters = 900
+
+def _message_tables():
+	"""All tables that store BugMessages, with the table of BugMessage itself first."""
+	tables = [BugMessage.__table__]
+	for mapper in BugMessage.__mapper__.self_and_descendants:
+		if mapper.local_table not in tables:
+			tables.append(mapper.local_table)
+	return tables
+
+def _extra_columns():
+	"""The columns of the subclasses of BugMessage, except their id."""
+	return [column for table in _message_tables()[1:] for column in table.columns if column.name != 'id']
+
+def _enum_name(value):
+	return None if value is None else value.name
+
+def _parse_enum(enum, name):
+	if name is None:
+		return None
+	try:
+		return enum[name]
+	except KeyError:
+		raise ValueError("unknown {} {}".format(enum.__name__, name))
+
+def export_bugs():
+	"""Generate the lines of the export of all bugs, ordered by id.
+
+	All bugs and messages come from a single query through a server-side cursor,
+	so there are only the messages of one bug in memory at a time.
+	"""
+	bugs = Bug.__table__
+	messages = BugMessage.__table__
+	extra_columns = _extra_columns()
+	joined = bugs.outerjoin(messages, messages.c.bug_id == bugs.c.id)
+	for table in _message_tables()[1:]:
+		joined = joined.outerjoin(table, table.c.id == messages.c.id)
+	query = db.select([
+		bugs.c.id.label('bug_id'), bugs.c.title, bugs.c.status, bugs.c.priority,
+		messages.c.id.label('message_id'), messages.c.type, messages.c.posted,
+		messages.c.new_title, messages.c.new_status, messages.c.new_priority,
+	] + extra_columns).select_from(joined).order_by(bugs.c.id, messages.c.id)
+
+	with db.engine.connect() as connection:
+		rows = connection.execution_options(stream_results=True).execute(query)
+		for bug_id, bug_rows in groupby(rows, key=lambda row: row.bug_id):
+			bug_rows = list(bug_rows)
+			first = bug_rows[0]
+			exported_messages = []
+			for row in bug_rows:
+				if row.message_id is None:
+					# the outer join gives a single empty row for bugs without messages
+					continue
+				message = {
+					'type': row.type,
+					'posted': None if row.posted is None else row.posted.isoformat(),
+					'new_title': row.new_title,
+					'new_status': _enum_name(row.new_status),
+					'new_priority': _enum_name(row.new_priority),
+				}
+				for column in extra_columns:
+					if row[column] is not None:
+						message[column.name] = row[column]
+				exported_messages.append(message)
+			yield json.dumps({
+				'id': bug_id,
+				'title': first.title,
+				'status': _enum_name(first.status),
+				'priority': _enum_name(first.priority),
+				'messages': exported_messages,
+			}) + "\n"
+
+def _parse_bug(line, mappers):
+	"""Turn a line of the export into (BugState without id, [(mapper, message values)])."""
+	data = json.loads(line)
+	messages = []
+	for message in data.get('messages', []):
+		mapper = mappers.get(message.get('type'))
+		if mapper is None:
+			raise ValueError("unknown message type {}".format(message.get('type')))
+		posted = message.get('posted')
+		values = dict(message,
+			new_title=message.get('new_title'),
+			new_status=_parse_enum(BugStatus, message.get('new_status')),
+			new_priority=_parse_enum(BugPriority, message.get('new_priority')),
+			posted=datetime.now() if posted is None else datetime.fromisoformat(posted),
+		)
+		messages.append((mapper, values))
+
+	# the bug's fields default to where its messages leave it
+	state = _replay(BugState(None, None, None, None), [
+		_Change(values['new_title'], values['new_status'], values['new_priority'])
+		for mapper, values in messages
+	])
+	state = state._replace(
+		title=data.get('title', state.title),
+		status=_parse_enum(BugStatus, data.get('status')) or state.status or BugStatus.default(),
+		priority=_parse_enum(BugPriority, data.get('priority')) or state.priority or BugPriority.default(),
+	)
+	return state, messages
+
+def _reserve_ids(connection, table, count):
+	"""Get count new ids for rows in the table."""
+	if connection.dialect.name == 'postgresql':
+		return [row[0] for row in connection.execute(db.text(
+			"SELECT nextval(pg_get_serial_sequence(:table, 'id')) FROM generate_series(1, :count)"
+		), table=table.name, count=count)]
+	# other databases don't have sequences, so nothing else should insert bugs during the import
+	last = connection.execute(db.select([db.func.max(table.c.id)])).scalar() or 0
+	return list(range(last + 1, last + count + 1))
+
+"""Maps (dialect name, table) -> compiled insert statement for a full chunk of rows, see _insert_rows."""
+_insert_statements = {}
+
+def _multi_row_insert(connection, table, count):
+	"""Compile the statement for inserting count rows into the table at once.
+
+	The parameters are called r<row number>_<column name>.
+	"""
+	statement = table.insert().values([{
+		column.name: db.bindparam('r{}_{}'.format(i, column.name), type_=column.type)
+		for column in table.columns
+	} for i in range(count)])
+	return statement.compile(dialect=connection.dialect)
+
+def _insert_rows(connection, table, rows):
+	"""Insert the rows with as few statements as possible.
+
+	Compiling a statement with many rows takes longer than running it,
+	so the statement for a full chunk is compiled only once per table.
+	The last chunk has a different size every time, so that one is compiled when needed.
+	"""
+	if not rows:
+		return
+	columns = [column.name for column in table.columns]
+	per_statement = max(_max_parameters // len(columns), 1)
+	for start in range(0, len(rows), per_statement):
+		chunk = rows[start:start + per_statement]
+		if len(chunk) == per_statement:
+			key = (connection.dialect.name, table)
+			if key not in _insert_statements:
+				_insert_statements[key] = _multi_row_insert(connection, table, per_statement)
+			statement = _insert_statements[key]
+		else:
+			statement = _multi_row_insert(connection, table, len(chunk))
+		connection.execute(statement, {
+			'r{}_{}'.format(i, column): row.get(column)
+			for i, row in enumerate(chunk) for column in columns
+		})
+
+def _import_batch(connection, batch):
+	bug_ids = _reserve_ids(connection, Bug.__table__, len(batch))
+	message_ids = iter(_reserve_ids(connection, BugMessage.__table__,
+			sum(len(messages) for state, messages in batch)))
+
+	bug_rows = []
+	message_rows = {table: [] for table in _message_tables()}
+	checkpoint_rows = []
+	signature_rows = []
+	bucket_rows = []
+	counts = Counter()
+	trends = Counter()
+	for bug_id, (state, messages) in zip(bug_ids, batch):
+		bug_rows.append({
+			'id': bug_id, 'type': Bug.__mapper__.polymorphic_identity, 'version': 1,
+			'title': state.title, 'status': state.status, 'priority': state.priority,
+		})
+		counts[state.status, state.priority] += 1
+		index_document(connection, 'bug', bug_id, state.title, "")
+
+		first_description = next((values.get('description') for mapper, values in messages
+				if issubclass(mapper.class_, BugUserMessage)), None)
+		signature_row, bug_bucket_rows = index_rows(bug_id, state.title, first_description)
+		signature_rows.append(signature_row)
+		bucket_rows.extend(bug_bucket_rows)
+
+		history = BugState(bug_id, None, None, None)
+		for number, (mapper, values) in enumerate(messages, 1):
+			message_id = next(message_ids)
+			row = dict(values, id=message_id, bug_id=bug_id, type=mapper.polymorphic_identity)
+			for table in mapper.tables:
+				message_rows[table].append(row)
+			if issubclass(mapper.class_, BugUserMessage):
+				index_document(connection, 'bug_message', message_id, "", values.get('description'), parent=bug_id)
+
+			# the same checkpoints and trends as the mapper events would have made
+			previous = history
+			history = _replay(history, [_Change(row['new_title'], row['new_status'], row['new_priority'])])
+			changes = trend_changes(previous.status, previous.priority, history.status, history.priority)
+			for (priority, column), change in changes.items():
+				trends[row['posted'].date(), priority, column] += change
+			if number % checkpoint_interval == 0:
+				checkpoint_rows.append({
+					'bug_id': bug_id, 'message_id': message_id, 'posted': row['posted'],
+					'title': history.title, 'status': history.status, 'priority': history.priority,
+				})
+
+	_insert_rows(connection, Bug.__table__, bug_rows)
+	for table, rows in message_rows.items():
+		_insert_rows(connection, table, rows)
+	_insert_rows(connection, BugCheckpoint.__table__, checkpoint_rows)
+	_insert_rows(connection, BugSignature.__table__, signature_rows)
+	_insert_rows(connection, BugBucket.__table__, bucket_rows)
+	for (status, priority), count in counts.items():
+		_change_bug_count(connection, status, priority, count)
+	apply_trend_changes(connection, trends)
+
+def import_bugs(lines, batch_size=None):
+	"""Import bugs from the lines of an export (see export_bugs), returning how many there were.
+
+	The lines are read and inserted batch_size bugs at a time (default config.bug_import_batch_size),
+	so any number of bugs can be imported in constant memory.
+	Each batch is committed on its own, so if a line is invalid,
+	the batches before it stay imported and a ValueError tells which line it was.
+	"""
+	if batch_size is None:
+		batch_size = config.bug_import_batch_size
+	mappers = {mapper.polymorphic_identity: mapper for mapper in BugMessage.__mapper__.self_and_descendants}
+
+	imported = 0
+	batch = []
+	def flush():
+		nonlocal imported, batch
+		if batch:
+			with db.engine.begin() as connection:
+				_import_batch(connection, batch)
+			bump_page_version()
+			imported += len(batch)
+			batch = []
+
+	for number, line in enumerate(lines, 1):
+		if not line.strip():
+			continue
+		try:
+			batch.append(_parse_bug(line, mappers))
+		except (ValueError, KeyError, TypeError, AttributeError) as e:
+			raise ValueError("line {}: {}".format(number, e)) from e
+		if len(batch) >= batch_size:
+			flush()
+	flush()
+	return imported
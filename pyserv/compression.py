@@ -0,0 +1,169 @@
+"""Gzip responses on their way out, for browsers that accept it.
+
+GzipMiddleware wraps the WSGI app, so it works for everything: rendered pages, JSON and streamed exports.
+Only text of at least config.compression_minimum_size bytes is compressed,
+and responses that already have a Content-Encoding (like the precompressed static files) are left alone.
+Streamed responses (without a Content-Length) are compressed chunk by chunk,
+and each chunk is flushed, so the browser gets everything as soon as it would have without compression.
+Responses that would be compressed for a browser that accepts it get Vary: Accept-Encoding,
+also when they aren't compressed (for HEAD requests or other browsers), so caches keep the versions apart.
+"""
+
+from itertools import chain
+from threading import Lock
+from time import thread_time
+import zlib
+
+"""The types of content that are worth compressing, besides text/*."""
+compressible_types = {
+	'application/javascript', 'application/json', 'application/x-ndjson', 'application/xml', 'image/svg+xml',
+}
+
+class CompressionStats:
+	"""How much the middleware compressed, and how much CPU time that took."""
+	def __init__(self):
+		self._lock = Lock()
+		self.responses = 0
+		self.bytes_in = 0
+		self.bytes_out = 0
+		self.cpu_seconds = 0.0
+
+	def record(self, bytes_in, bytes_out, cpu_seconds):
+		with self._lock:
+			self.responses += 1
+			self.bytes_in += bytes_in
+			self.bytes_out += bytes_out
+			self.cpu_seconds += cpu_seconds
+
+	def stats(self):
+		"""The counters, as a dict for JSON. The ratio is the compressed size divided by the original size."""
+		with self._lock:
+			return {
+				'responses': self.responses,
+				'bytes_in': self.bytes_in,
+				'bytes_out': self.bytes_out,
+				'ratio': self.bytes_out / self.bytes_in if self.bytes_in else None,
+				'cpu_seconds': self.cpu_seconds,
+			}
+
+compression_stats = CompressionStats()
+
+def _accepts_gzip(environ):
+	for coding in environ.get('HTTP_ACCEPT_ENCODING', '').split(','):
+		name, _, parameters = coding.partition(';')
+		if name.strip().lower() in ('gzip', '*'):
+			return parameters.replace(' ', '') not in ('q=0', 'q=0.0', 'q=0.00', 'q=0.000')
+	return False
+
+def _header(headers, name):
+	name = name.lower()
+	return next((value for key, value in headers if key.lower() == name), None)
+
+def _with_vary(headers):
+	"""The headers, with Accept-Encoding added to the Vary header."""
+	vary = _header(headers, 'Vary')
+	headers = [(key, value) for key, value in headers if key.lower() != 'vary']
+	headers.append(('Vary', 'Accept-Encoding' if not vary else vary + ', Accept-Encoding'))
+	return headers
+
+def _body_chunks(chunks, written):
+	"""The chunks of the body, with the data given to the write callable in between, in the order they were made."""
+	while written:
+		yield written.pop(0)
+	for chunk in chunks:
+		while written:
+			yield written.pop(0)
+		yield chunk
+	while written:
+		yield written.pop(0)
+
+class GzipMiddleware:
+	"""Compress the responses of the WSGI app with gzip, see the module docstring."""
+	def __init__(self, app, minimum_size, level, stats=compression_stats):
+		self.app = app
+		self.minimum_size = minimum_size
+		self.level = level
+		self.stats = stats
+
+	def __call__(self, environ, start_response):
+		# HEAD responses have no body to compress, but should have the same Vary as GET
+		compress = environ.get('REQUEST_METHOD') != 'HEAD' and _accepts_gzip(environ)
+		started = []
+		written = []
+		def capture_start_response(status, headers, exc_info=None):
+			started[:] = [status, headers, exc_info]
+			return written.append
+		body = self.app(environ, capture_start_response)
+		return self._respond(body, started, written, start_response, compress)
+
+	def _eligible(self, status, headers, size):
+		"""Should the response be compressed for a browser that accepts gzip? The size is None if we don't know it yet."""
+		if not status.startswith('200'):
+			return False
+		if _header(headers, 'Content-Encoding') is not None:
+			return False
+		if 'no-transform' in (_header(headers, 'Cache-Control') or ''):
+			return False
+		content_type = (_header(headers, 'Content-Type') or '').split(';')[0].strip().lower()
+		if not (content_type.startswith('text/') or content_type in compressible_types):
+			return False
+		length = _header(headers, 'Content-Length')
+		if length is not None:
+			size = int(length)
+		return size is None or size >= self.minimum_size
+
+	def _respond(self, body, started, written, start_response, compress):
+		try:
+			chunks = _body_chunks(iter(body), written)
+			# read until we know the headers, and if we compress and there is no Content-Length, whether it is big enough
+			pending = []
+			size = 0
+			ended = False
+			while not started or (compress and _header(started[1], 'Content-Length') is None and size < self.minimum_size):
+				try:
+					chunk = next(chunks)
+				except StopIteration:
+					ended = True
+					break
+				pending.append(chunk)
+				size += len(chunk)
+			status, headers, exc_info = started
+
+			eligible = self._eligible(status, headers, size if ended else None)
+			if not (eligible and compress):
+				start_response(status, _with_vary(headers) if eligible else headers, exc_info)
+				yield from pending
+				yield from chunks
+				return
+
+			streamed = _header(headers, 'Content-Length') is None
+			headers = [(key, value) for key, value in _with_vary(headers) if key.lower() not in ('content-length', 'etag')]
+			headers.append(('Content-Encoding', 'gzip'))
+			etag = _header(started[1], 'ETag')
+			if etag is not None:
+				# the compressed body isn't byte for byte the same anymore
+				headers.append(('ETag', etag if etag.startswith('W/') else 'W/' + etag))
+			start_response(status, headers, exc_info)
+
+			compressor = zlib.compressobj(self.level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+			bytes_in = bytes_out = 0
+			cpu_seconds = 0.0
+			for chunk in chain(pending, chunks):
+				start = thread_time()
+				data = compressor.compress(chunk)
+				if streamed:
+					data += compressor.flush(zlib.Z_SYNC_FLUSH)
+				cpu_seconds += thread_time() - start
+				bytes_in += len(chunk)
+				bytes_out += len(data)
+				if data:
+					yield data
+			start = thread_time()
+			data = compressor.flush()
+			cpu_seconds += thread_time() - start
+			bytes_out += len(data)
+			yield data
+			self.stats.record(bytes_in, bytes_out, cpu_seconds)
+		finally:
+			if hasattr(body, 'close'):
+				body.close()
@@ -0,0 +1,86 @@
+"""Answer conditional GET requests with 304 Not Modified, without rendering anything.
+
+A view decorated with conditional(validator) first calls the validator with the same arguments,
+which does a few cheap queries to find out what the page depends on.
+From that, the page gets a (weak) ETag,
+and if the browser already has that version of the page, the view isn't called at all.
+The ETag also depends on who is looking and on the templates, code and static files of the site,
+so a deploy or logging in gives a new page.
+There is no Last-Modified header, since a time can't tell that someone logged in or that the site changed.
+"""
+
+from flask import request, session
+from functools import wraps
+from hashlib import blake2b
+import os
+
+from .app import app
+from .assets import manifest
+from .auth import _grants_version_name
+from .database import get_version
+from .person import get_auth_context
+from .templates import template_names
+
+_site_version = None
+
+def site_version():
+	"""A hash of the templates, code and static files, which changes with every deploy.
+
+	The contents of the templates and code are hashed, so copying the same files again doesn't change it,
+	and the static files by their names in the manifest, so pages link to the current static files.
+	"""
+	global _site_version
+	if _site_version is None:
+		package = os.path.dirname(__file__)
+		template_folder = os.path.join(app.root_path, app.template_folder)
+		paths = [os.path.join(template_folder, name) for name in template_names()]
+		paths += sorted(os.path.join(package, name) for name in os.listdir(package) if name.endswith('.py'))
+		digest = blake2b(digest_size=8)
+		for path in paths:
+			digest.update("{}\n".format(os.path.relpath(path, app.root_path)).encode('utf-8'))
+			with open(path, 'rb') as source:
+				digest.update(source.read())
+		digest.update(repr(sorted(manifest.items())).encode('utf-8'))
+		_site_version = digest.hexdigest()
+	return _site_version
+
+def conditional(validator):
+	"""Decorate a view so it gets an ETag from the validator, and answers 304 if it matches.
+
+	The validator returns a list of the values the page depends on,
+	or None if the view should handle the request as usual
+	(e.g. because it is going to give an error).
+	Pages with flashed messages never get an ETag, since they are only shown once.
+	"""
+	def decorator(view):
+		@wraps(view)
+		def conditional_view(*args, **kwargs):
+			if request.method not in ('GET', 'HEAD') or '_flashes' in session:
+				return view(*args, **kwargs)
+			validated = validator(*args, **kwargs)
+			if validated is None:
+				return view(*args, **kwargs)
+
+			context = get_auth_context()
+			parts = [request.full_path, site_version(), context.user_id, context.shadow_user_id]
+			if context.user_id is not None:
+				# the page may show more or less depending on the auth levels
+				parts.append(get_version(_grants_version_name))
+			parts.extend(validated)
+			etag = blake2b(repr(parts).encode('utf-8'), digest_size=16).hexdigest()
+
+			if not request.if_none_match.contains_weak(etag):
+				response = app.make_response(view(*args, **kwargs))
+				if response.status_code != 200:
+					return response
+			else:
+				response = app.response_class(status=304)
+			response.set_etag(etag, weak=True)
+			# browsers should always ask, so they never show an outdated page
+			response.cache_control.no_cache = True
+			if context.user_id is not None:
+				response.cache_control.private = True
+			response.vary.update(('Cookie', 'Authorization'))
+			return response
+		return conditional_view
+	return decorator
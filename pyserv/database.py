@@ -1,12 +1,148 @@
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from binascii import Error as Base64Error
+from flask import g, has_request_context
+import json
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm.exc import StaleDataError
 
 from .app import app
 
 db = SQLAlchemy(app)
 DBClass = db.Model
 
+class VersionStamp(DBClass):
+	"""A counter that goes up whenever some data changes.
+
+	Processes that cache the data can cheaply check whether their copy is still up to date.
+	See bump_version and get_version.
+	"""
+	name = db.Column(db.Unicode(64), primary_key=True)
+	version = db.Column(db.Integer, nullable=False)
+
+	def __init__(self, name, version=0):
+		self.name = name
+		self.version = version
+
+"""The names of the VersionStamps that are used, see version_stamp."""
+_version_names = set()
+
+def version_stamp(name):
+	"""Register the name of a VersionStamp, so prepare_tables makes its row before anyone bumps it.
+
+	Returns the name.
+	"""
+	_version_names.add(name)
+	return name
+
+def seed_version_stamps():
+	"""Make the rows of the registered VersionStamps that don't exist yet, each in its own transaction."""
+	table = VersionStamp.__table__
+	for name in sorted(_version_names):
+		try:
+			with db.engine.begin() as connection:
+				if connection.execute(db.select([table.c.name]).where(table.c.name == name)).first() is None:
+					connection.execute(table.insert().values(name=name, version=0))
+		except IntegrityError:
+			# another process made it at the same moment
+			pass
+
+def bump_version(name):
+	"""Mark the data with the given name as changed.
+
+	The new version is visible to other processes after you commit the session.
+	"""
+	def update():
+		return VersionStamp.query.filter_by(name=name).update({
+			VersionStamp.version: VersionStamp.version + 1
+		}, synchronize_session=False)
+	if not update():
+		# registered stamps already have a row, but make it if this one doesn't
+		try:
+			with db.session.begin_nested():
+				db.session.add(VersionStamp(name, 1))
+		except IntegrityError:
+			# another transaction made it first, so now there is a row to update
+			update()
+	if has_request_context():
+		g.get('versions', {}).pop(name, None)
+
+def bump_version_now(name):
+	"""Like bump_version, but in a short transaction of its own, so it doesn't wait for the session's commit."""
+	table = VersionStamp.__table__
+	with db.engine.begin() as connection:
+		updated = connection.execute(table.update().where(table.c.name == name).values(
+			version=table.c.version + 1,
+		))
+		if not updated.rowcount:
+			# only for stamps that weren't registered with version_stamp
+			connection.execute(table.insert().values(name=name, version=1))
+	if has_request_context():
+		g.get('versions', {}).pop(name, None)
+
+def get_version(name):
+	"""Get the current version of the data with the given name.
+
+	During a request, the database is only asked once, so caches stay consistent within the request.
+	"""
+	if has_request_context():
+		versions = g.setdefault('versions', {})
+		if name not in versions:
+			versions[name] = _load_version(name)
+		return versions[name]
+	return _load_version(name)
+
+def _load_version(name):
+	version = db.session.query(VersionStamp.version).filter_by(name=name).scalar()
+	return version or 0
+
+def commit_with_retries(change, attempts=3):
+	"""Call change() and commit, starting over if another transaction changed the same versioned rows meanwhile.
+
+	Since the session is rolled back before trying again, change should (re)load everything it modifies.
+	Returns the result of the change that got committed.
+	Raises a StaleDataError when all attempts had a conflict.
+	"""
+	for attempt in range(attempts):
+		result = change()
+		try:
+			db.session.commit()
+			return result
+		except StaleDataError:
+			db.session.rollback()
+			if attempt == attempts - 1:
+				raise
+
+class Page(list):
+	"""A list of query results, with cursors for getting the pages around it.
+
+	A cursor is None when there is no such page.
+	"""
+	def __init__(self, items, next_cursor=None, previous_cursor=None):
+		super().__init__(items)
+		self.next_cursor = next_cursor
+		self.previous_cursor = previous_cursor
+
+def encode_cursor(values):
+	"""Turn the sort key of a row into a string that you can put in a url.
+
+	Enums are encoded by their name, so they can be looked up again after decoding.
+	"""
+	values = [getattr(value, 'name', value) for value in values]
+	return urlsafe_b64encode(json.dumps(values).encode('utf-8')).decode('ascii')
+def decode_cursor(cursor):
+	"""Get the list of values from encode_cursor back, raising a ValueError if it is invalid."""
+	try:
+		values = json.loads(urlsafe_b64decode(cursor.encode('ascii')).decode('utf-8'))
+	except (Base64Error, UnicodeError, json.JSONDecodeError) as e:
+		raise ValueError("invalid cursor {}".format(cursor)) from e
+	if not isinstance(values, list):
+		raise ValueError("invalid cursor {}".format(cursor))
+	return values
+
 def prepare_tables():
 	db.create_all()
+	seed_version_stamps()
 
 def reset_tables():
 	"""Get rid of all data in the database.
@@ -20,3 +156,4 @@ def reset_tables():
 		raise ValueError("you can't truncate tables in production!")
 	db.drop_all()
 	db.create_all()
+	seed_version_stamps()
@@ -0,0 +1,184 @@
+"""Suggesting existing bugs that a new report might be a duplicate of.
+
+The title and first description of each bug are split into trigrams (like PostgreSQL's pg_trgm),
+and summarized in a MinHash signature: the chance that two signatures agree in some position
+is the Jaccard similarity of the two sets of trigrams.
+The signatures are split into bands, and each band is stored as a bucket in the BugBucket table,
+so bugs that are similar enough almost surely share a bucket with the report,
+while most other bugs share none. Finding suggestions then only needs to look at those few bugs,
+however many bugs there are.
+
+The index is kept up to date by listening for changes of the title and new first messages,
+just like the search index.
+"""
+
+from collections import namedtuple
+from hashlib import blake2b
+from random import Random
+import re
+import struct
+from zlib import crc32
+
+from sqlalchemy import event
+
+from .bug import Bug, BugMessage, BugUserMessage
+from .database import db, DBClass
+
+"""How many bands each signature has, and how many hashes are in each band.
+
+More hashes per band means only more similar bugs share a bucket,
+more bands means more chances to share one.
+"""
+bands = 10
+rows_per_band = 3
+_signature_format = '>{}I'.format(bands * rows_per_band)
+
+# each hash function of the signature is x -> (a * x + b) mod 2**64, keeping the highest 32 bits
+# the seed is fixed, since the signatures in the database have to stay valid
+_random = Random(14)
+_hash_functions = [(_random.getrandbits(64) | 1, _random.getrandbits(64)) for i in range(bands * rows_per_band)]
+_mask = 2**64 - 1
+
+"""The parts of a bug that get a signature, and their number in the buckets."""
+_parts = {
+	'title': 0,
+	'description': 1,
+}
+
+class BugSignature(DBClass):
+	"""The signatures of the title and first description of a bug, packed as 32-bit integers."""
+	bug_id = db.Column(db.Integer, db.ForeignKey('bug.id'), primary_key=True)
+	title = db.Column(db.LargeBinary)
+	description = db.Column(db.LargeBinary)
+
+class BugBucket(DBClass):
+	"""A band of one of the signatures of a bug, hashed into a single number."""
+	bucket = db.Column(db.BigInteger, primary_key=True)
+	bug_id = db.Column(db.Integer, db.ForeignKey('bug.id'), primary_key=True, index=True)
+
+_non_word = re.compile(r'\W+')
+
+def trigrams(text):
+	"""Get the set of trigrams in the text, ignoring case and punctuation.
+
+	Like pg_trgm, each word is padded with two spaces in front and one after,
+	so short words and the starts of words count more.
+	"""
+	result = set()
+	for word in _non_word.split((text or "").lower()):
+		if not word or word == '_':
+			continue
+		padded = "  " + word + " "
+		result.update(padded[i:i+3] for i in range(len(padded) - 2))
+	return result
+
+def signature(text):
+	"""Get the MinHash signature of the trigrams in the text, or None if it has none."""
+	hashes = [crc32(trigram.encode('utf-8')) for trigram in trigrams(text)]
+	if not hashes:
+		return None
+	return [min(((a * x + b) & _mask) >> 32 for x in hashes) for a, b in _hash_functions]
+
+def _buckets(part, sig):
+	"""The buckets of each band of the signature of the part."""
+	packed = struct.pack(_signature_format, *sig)
+	band_size = 4 * rows_per_band
+	return [
+		# 7 bytes, so the bucket fits in a signed BIGINT
+		int.from_bytes(blake2b(packed[band * band_size:(band + 1) * band_size],
+				digest_size=7, key=bytes([_parts[part], band])).digest(), 'big')
+		for band in range(bands)
+	]
+
+def similarity(first, second):
+	"""Estimate the Jaccard similarity of the trigrams behind two signatures."""
+	if first is None or second is None:
+		return 0
+	return sum(x == y for x, y in zip(first, second)) / len(first)
+
+def index_rows(bug_id, title, description):
+	"""The BugSignature row and the BugBucket rows of a bug with the given title and first description."""
+	signature_row = {'bug_id': bug_id, 'title': None, 'description': None}
+	bucket_rows = set()
+	for part, text in (('title', title), ('description', description)):
+		sig = signature(text)
+		if sig is None:
+			continue
+		signature_row[part] = struct.pack(_signature_format, *sig)
+		bucket_rows.update(_buckets(part, sig))
+	return signature_row, [{'bucket': bucket, 'bug_id': bug_id} for bucket in bucket_rows]
+
+def _index_bug(connection, bug_id):
+	"""Replace the signatures of the bug by those of its current title and first description."""
+	bugs = Bug.__table__
+	messages = BugMessage.__table__
+	user_messages = BugUserMessage.__table__
+	title = connection.execute(db.select([bugs.c.title]).where(bugs.c.id == bug_id)).scalar()
+	description = connection.execute(db.select([user_messages.c.description]).select_from(
+		messages.join(user_messages, user_messages.c.id == messages.c.id)
+	).where(messages.c.bug_id == bug_id).order_by(messages.c.id).limit(1)).scalar()
+
+	signatures = BugSignature.__table__
+	buckets = BugBucket.__table__
+	connection.execute(signatures.delete().where(signatures.c.bug_id == bug_id))
+	connection.execute(buckets.delete().where(buckets.c.bug_id == bug_id))
+	signature_row, bucket_rows = index_rows(bug_id, title, description)
+	connection.execute(signatures.insert(), signature_row)
+	if bucket_rows:
+		connection.execute(buckets.insert(), bucket_rows)
+
+@event.listens_for(Bug, 'after_insert')
+def _index_new_bug(mapper, connection, bug):
+	_index_bug(connection, bug.id)
+
+@event.listens_for(Bug, 'after_update')
+def _index_updated_bug(mapper, connection, bug):
+	if db.inspect(bug).attrs.title.history.has_changes():
+		_index_bug(connection, bug.id)
+
+@event.listens_for(BugUserMessage, 'after_insert')
+def _index_first_message(mapper, connection, message):
+	messages = BugMessage.__table__
+	user_messages = BugUserMessage.__table__
+	first = connection.execute(db.select([db.func.min(messages.c.id)]).select_from(
+		messages.join(user_messages, user_messages.c.id == messages.c.id)
+	).where(messages.c.bug_id == message.bug_id)).scalar()
+	if first == message.id:
+		_index_bug(connection, message.bug_id)
+
+"""A bug that might be a duplicate, with a score between 0 (nothing in common) and 1 (the same trigrams)."""
+Suggestion = namedtuple('Suggestion', ['bug', 'score'])
+
+"""How many bugs sharing buckets with the report are compared to it at most, most shared buckets first."""
+max_candidates = 100
+
+def similar_bugs(title, description=None, count=5, min_score=0.3):
+	"""Get up to count Suggestions of bugs similar to the title and description, most similar first.
+
+	The score is the estimated similarity of the titles,
+	averaged with that of the descriptions if there is a description.
+	"""
+	query = {'title': signature(title), 'description': signature(description)}
+	query_buckets = [bucket for part, sig in query.items() if sig is not None for bucket in _buckets(part, sig)]
+	if not query_buckets:
+		return []
+
+	shared = db.func.count(BugBucket.bucket)
+	candidates = [bug_id for bug_id, in db.session.query(BugBucket.bug_id).filter(
+			BugBucket.bucket.in_(query_buckets),
+	).group_by(BugBucket.bug_id).order_by(shared.desc()).limit(max_candidates)]
+	if not candidates:
+		return []
+	parts = [part for part, sig in query.items() if sig is not None]
+	scores = {}
+	for row in BugSignature.query.filter(BugSignature.bug_id.in_(candidates)):
+		scores[row.bug_id] = sum(similarity(query[part],
+				getattr(row, part) and struct.unpack(_signature_format, getattr(row, part)))
+				for part in parts) / len(parts)
+
+	best = sorted((bug_id for bug_id, score in scores.items() if score >= min_score),
+			key=lambda bug_id: (-scores[bug_id], bug_id))[:count]
+	if not best:
+		return []
+	bugs = {bug.id: bug for bug in Bug.query.filter(Bug.id.in_(best))}
+	return [Suggestion(bugs[bug_id], scores[bug_id]) for bug_id in best if bug_id in bugs]
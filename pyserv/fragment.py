@@ -0,0 +1,83 @@
+"""Remember the HTML of pieces of pages that are shown over and over, like bug rows and blog sneak peeks.
+
+Fragments are keyed on (entity, id, version, visibility class), where the version changes
+whenever the object does, so a changed object never gets its old HTML.
+Views that change an object also invalidate its fragments right away,
+so the outdated fragments don't take up room until they are evicted.
+Each process has its own cache; the version in the key keeps them correct without talking to each other.
+"""
+
+from threading import Lock
+
+from .auth import has_auth, levels
+from . import config
+from .session import LRUCache
+
+class FragmentCache:
+	"""An LRU cache of rendered fragments, counting hits and misses so it can be sized."""
+	def __init__(self, size):
+		self.size = size
+		"""Maps key -> HTML."""
+		self._fragments = LRUCache(size)
+		"""Maps (entity, id) -> the keys of the fragments of that object, for invalidate."""
+		self._keys = {}
+		self._lock = Lock()
+		self.hits = 0
+		self.misses = 0
+		self.evictions = 0
+
+	def get_or_render(self, key, render):
+		"""Get the fragment with the key, calling render() to make it if it isn't there.
+
+		The key should start with the entity and id of the object, see invalidate.
+		"""
+		fragment = self._fragments.get(key)
+		with self._lock:
+			if fragment is not None:
+				self.hits += 1
+				return fragment
+			self.misses += 1
+		# render outside of the lock, so a slow fragment doesn't hold up the others
+		fragment = render()
+		with self._lock:
+			evicted = self._fragments.put(key, fragment)
+			self._keys.setdefault(key[:2], set()).add(key)
+			for evicted_key in evicted:
+				self._forget(evicted_key)
+			self.evictions += len(evicted)
+		return fragment
+
+	def _forget(self, key):
+		keys = self._keys.get(key[:2])
+		if keys is not None:
+			keys.discard(key)
+			if not keys:
+				del self._keys[key[:2]]
+
+	def invalidate(self, entity, id):
+		"""Forget all fragments of the object, in every version and visibility class."""
+		with self._lock:
+			for key in self._keys.pop((entity, int(id)), ()):
+				self._fragments.pop(key)
+
+	def clear(self):
+		with self._lock:
+			self._fragments.clear()
+			self._keys.clear()
+
+	def stats(self):
+		"""How many fragments were reused, rendered and evicted, to see whether config.fragment_cache_size is enough."""
+		with self._lock:
+			return {
+				'size': self.size,
+				'fragments': len(self._fragments),
+				'hits': self.hits,
+				'misses': self.misses,
+				'evictions': self.evictions,
+			}
+
+def visibility_class():
+	"""Which fragments the logged in user gets: users with the blog level see more than others."""
+	return 'blog' if has_auth(levels.blog) else 'public'
+
+fragments = FragmentCache(config.fragment_cache_size)
@@ -0,0 +1,71 @@
+"""A small markup language for blog posts, rendered to safe HTML.
+
+Paragraphs are separated by empty lines, lines starting with "# " up to "### " are headings
+and lines starting with "- " are list items.
+Within a line, **strong**, *emphasis*, `code` and [links](https://example.com) are recognised.
+Everything else is escaped, so the HTML can be put on a page as is.
+Links may only go to http(s) urls and urls on this site, so no javascript: links.
+"""
+
+from html import escape
+import re
+
+"""Goes up whenever render gives different HTML for the same source, so stored HTML gets rendered again."""
+renderer_version = 1
+
+_code = re.compile(r'`([^`]+)`')
+_link = re.compile(r'\[([^\]]+)\]\(((?:https?://|/|#)[^)\s*]*)\)')
+_strong = re.compile(r'\*\*(.+?)\*\*')
+_emphasis = re.compile(r'\*(.+?)\*')
+_heading = re.compile(r'(#{1,3}) (.*)')
+
+def _render_inline(text):
+	parts = _code.split(text)
+	html = []
+	# the odd parts are the contents of the code spans
+	for i, part in enumerate(parts):
+		if i % 2:
+			html.append("<code>{}</code>".format(escape(part)))
+			continue
+		part = escape(part)
+		part = _link.sub(r'<a href="\2">\1</a>', part)
+		part = _strong.sub(r'<strong>\1</strong>', part)
+		part = _emphasis.sub(r'<em>\1</em>', part)
+		html.append(part)
+	return "".join(html)
+
+def render(source):
+	"""Turn the markup source into HTML."""
+	html = []
+	paragraph = []
+	in_list = False
+	def end_blocks():
+		nonlocal in_list
+		if paragraph:
+			html.append("<p>{}</p>".format("\n".join(paragraph)))
+			paragraph.clear()
+		if in_list:
+			html.append("</ul>")
+			in_list = False
+
+	for line in (source or "").splitlines():
+		line = line.strip()
+		heading = _heading.fullmatch(line)
+		if not line:
+			end_blocks()
+		elif heading:
+			end_blocks()
+			level = len(heading.group(1))
+			html.append("<h{0}>{1}</h{0}>".format(level + 1, _render_inline(heading.group(2))))
+		elif line.startswith("- "):
+			if paragraph or not in_list:
+				end_blocks()
+				html.append("<ul>")
+				in_list = True
+			html.append("<li>{}</li>".format(_render_inline(line[2:])))
+		else:
+			if in_list:
+				end_blocks()
+			paragraph.append(_render_inline(line))
+	end_blocks()
+	return "\n".join(html)
@@ -0,0 +1,164 @@
+"""Serve the pages that look the same for every anonymous visitor from memory.
+
+Pages are keyed on their endpoint, path and query arguments, and belong to a version of the 'pages' VersionStamp.
+Every commit that changes a bug, bug message, blog post or user (whose names are on pages and in search results)
+bumps the version right afterwards, so a page is regenerated after the first commit that could change it, in every process.
+The version is bumped in a short transaction of its own, so writers don't all wait on the same row.
+
+When a page is outdated, only one request regenerates it and the others get the outdated page meanwhile.
+When a page isn't cached at all, the others wait for that one request instead,
+so a spike of visitors to a new page still renders it only once.
+"""
+
+from collections import namedtuple
+from flask import request, session
+from functools import wraps
+from threading import Event, Lock
+
+from sqlalchemy import event
+from sqlalchemy.orm import object_session
+
+from .app import app
+from .blog import BlogPost
+from .bug import Bug, BugMessage
+from . import config
+from .database import bump_version_now, db, get_version, version_stamp
+from .person import User, get_auth_context
+from .session import LRUCache
+
+"""The name of the VersionStamp that changes whenever a cached page might."""
+page_version_name = version_stamp('pages')
+
+"""The body of a response, and the version of the data it was made from."""
+CachedPage = namedtuple('CachedPage', ['version', 'body', 'content_type'])
+
+class PageCache:
+	"""An LRU cache of CachedPages, where only one thread at a time regenerates a page."""
+	def __init__(self, size, wait_timeout):
+		self.size = size
+		"""How many seconds to wait for another thread to fill in a page, before rendering it ourselves."""
+		self.wait_timeout = wait_timeout
+		self._pages = LRUCache(size)
+		"""Maps key -> Event that is set when the page of that key is done rendering."""
+		self._filling = {}
+		self._lock = Lock()
+		self.hits = 0
+		self.stale_hits = 0
+		self.misses = 0
+
+	def get_or_render(self, key, version, render):
+		"""Get the page with the key as of the version, or an older version if it is being regenerated.
+
+		render() should return the CachedPage, or None if the result should not be cached.
+		"""
+		with self._lock:
+			page = self._pages.get(key)
+			if page is not None and page.version == version:
+				self.hits += 1
+				return page
+			filling = self._filling.get(key)
+			if filling is not None and page is not None:
+				self.stale_hits += 1
+				return page
+			if filling is None:
+				filling = self._filling[key] = Event()
+				filler = True
+			else:
+				filler = False
+
+		if not filler:
+			# nothing to serve meanwhile, so wait for the page to be there
+			filling.wait(self.wait_timeout)
+			with self._lock:
+				page = self._pages.get(key)
+				if page is not None:
+					self.hits += 1
+					return page
+				self.misses += 1
+			return render()
+
+		try:
+			with self._lock:
+				self.misses += 1
+			page = render()
+			if page is not None:
+				self._pages.put(key, page)
+			return page
+		finally:
+			with self._lock:
+				del self._filling[key]
+			filling.set()
+
+	def clear(self):
+		self._pages.clear()
+
+	def stats(self):
+		"""How often a page was served from memory, outdated or rendered, as a dict for JSON."""
+		with self._lock:
+			return {
+				'size': self.size,
+				'pages': len(self._pages),
+				'hits': self.hits,
+				'stale_hits': self.stale_hits,
+				'misses': self.misses,
+			}
+
+pages = PageCache(config.page_cache_size, config.page_cache_wait)
+
+def _anonymous_request():
+	"""Would this request get the same page as any other anonymous visitor?"""
+	# flashed messages are only for this visitor
+	return request.method == 'GET' and get_auth_context().user_id is None and '_flashes' not in session
+
+def cached_page(view):
+	"""Decorate a view so anonymous visitors get a cached page if there is one.
+
+	Only successful responses are cached, so e.g. private blog posts never end up in the cache.
+	"""
+	@wraps(view)
+	def cached_view(*args, **kwargs):
+		if not _anonymous_request():
+			return view(*args, **kwargs)
+		key = (request.endpoint, request.path, tuple(sorted(request.args.items(multi=True))))
+		version = get_version(page_version_name)
+		uncached = []
+		def render():
+			response = app.make_response(view(*args, **kwargs))
+			if response.status_code != 200 or response.is_streamed:
+				uncached.append(response)
+				return None
+			return CachedPage(version, response.get_data(), response.content_type)
+		page = pages.get_or_render(key, version, render)
+		if page is None:
+			return uncached[0]
+		return app.response_class(page.body, content_type=page.content_type)
+	return cached_view
+
+def bump_page_version():
+	"""Mark all cached pages as outdated. Call this after committing the change."""
+	bump_version_now(page_version_name)
+
+@event.listens_for(Bug, 'after_insert')
+@event.listens_for(Bug, 'after_update')
+@event.listens_for(Bug, 'after_delete')
+@event.listens_for(BugMessage, 'after_insert', propagate=True)
+@event.listens_for(BlogPost, 'after_insert')
+@event.listens_for(BlogPost, 'after_update')
+@event.listens_for(BlogPost, 'after_delete')
+@event.listens_for(User, 'after_insert')
+@event.listens_for(User, 'after_update')
+def _outdate_pages(mapper, connection, target):
+	object_session(target).info['outdated_pages'] = True
+
+@event.listens_for(db.session, 'after_commit')
+def _bump_outdated_pages(session):
+	# releasing a savepoint also counts as a commit, but the changes aren't visible yet
+	if session.transaction.nested:
+		return
+	if session.info.pop('outdated_pages', False):
+		bump_page_version()
+
+@event.listens_for(db.session, 'after_soft_rollback')
+def _keep_pages(session, previous_transaction):
+	if previous_transaction.parent is None:
+		session.info.pop('outdated_pages', None)
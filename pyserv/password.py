@@ -0,0 +1,71 @@
+"""Hashing passwords without blocking the request thread.
+
+Hashing a password is deliberately slow, so it runs in a small pool of worker processes.
+The algorithm and the amount of work are set in the config,
+and are stored along with each hash so old hashes can be upgraded when the user logs in.
+"""
+
+from concurrent.futures import ProcessPoolExecutor, TimeoutError
+from hashlib import pbkdf2_hmac, scrypt
+from hmac import compare_digest
+
+from . import config
+
+def _hash_pbkdf2_sha256(password, salt, cost):
+	# cost is the number of iterations
+	return pbkdf2_hmac('sha256', password, salt, cost)
+def _hash_scrypt(password, salt, cost):
+	# cost is the CPU/memory cost n, which must be a power of 2
+	# scrypt needs about 128 * r * n bytes of memory, so make sure it is allowed to use that much
+	return scrypt(password, salt=salt, n=cost, r=8, p=1, maxmem=2 * 128 * 8 * cost + 2**20, dklen=64)
+
+"""Maps algorithm name -> function(password : bytes, salt : bytes, cost : int) -> bytes."""
+algorithms = {
+	'pbkdf2_sha256': _hash_pbkdf2_sha256,
+	'scrypt': _hash_scrypt,
+}
+
+def _hash(algorithm, cost, password, salt):
+	"""Does the actual hashing, in a worker process."""
+	return algorithms[algorithm](password, salt, cost)
+
+"""The worker processes, started the first time we hash a password."""
+_pool = None
+def _get_pool():
+	global _pool
+	if _pool is None:
+		_pool = ProcessPoolExecutor(max_workers=config.password_workers)
+	return _pool
+
+def hash_password(password, salt, algorithm=None, cost=None):
+	"""Hash the unhashed password string with the given salt.
+
+	Leaving the algorithm or cost None means the ones in the config.
+	When config.password_workers is 0, hashes on the calling thread (handy for testing).
+	Raises a concurrent.futures.TimeoutError if the hash isn't done within config.password_timeout seconds.
+	"""
+	if algorithm is None:
+		algorithm = config.password_algorithm
+	if cost is None:
+		cost = config.password_cost
+	if algorithm not in algorithms:
+		raise ValueError("unknown password hash algorithm {}".format(algorithm))
+
+	password = password.encode('utf-8')
+	if not config.password_workers:
+		return _hash(algorithm, cost, password, salt)
+	future = _get_pool().submit(_hash, algorithm, cost, password, salt)
+	try:
+		return future.result(timeout=config.password_timeout)
+	except TimeoutError:
+		# don't let a queued request keep the workers busy after we gave up on it
+		future.cancel()
+		raise
+
+def check_password(password, salt, expected, algorithm, cost):
+	"""Does the unhashed password match the expected hash?"""
+	return compare_digest(hash_password(password, salt, algorithm, cost), expected)
+
+def needs_rehash(algorithm, cost):
+	"""Should a hash made with the given algorithm and cost be replaced by one using the config?"""
+	return algorithm != config.password_algorithm or cost != config.password_cost
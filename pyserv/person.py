@@ -1,8 +1,10 @@
-from flask import session
-from hashlib import pbkdf2_hmac
+from flask import g, has_request_context, request, session
 from os import urandom
 
+from .apikey import get_key_owner_id
 from .database import db, DBClass
+from . import config
+from .password import check_password, hash_password, needs_rehash
 
 class Contact(DBClass):
 	id = db.Column(db.Integer, primary_key=True)
@@ -50,6 +52,12 @@ class User(Person):
 	password = db.Column(db.LargeBinary(255), nullable=False)
 	"""Salt for hashing the password."""
 	salt = db.Column(db.LargeBinary(255), nullable=False)
+	"""How the password was hashed, see pyserv.password.
+
+	The defaults are what we used before these were stored.
+	"""
+	password_algorithm = db.Column(db.Unicode(32), nullable=False, default='pbkdf2_sha256')
+	password_cost = db.Column(db.Integer, nullable=False, default=100000)
 
 	# see also apikey.py
 	api_keys = db.relationship('APIKey', backref='owner', lazy='dynamic')
@@ -64,23 +72,115 @@ class User(Person):
 		self.password_from_unhashed(password)
 
 	def password_from_unhashed(self, unhashed):
-		"""Set the user's password from an unhashed string."""
-		self.password = pbkdf2_hmac('sha256', unhashed.encode('utf-8'), self.salt, 100000)
+		"""Set the user's password from an unhashed string.
+
+		Uses the hash algorithm and cost from the config.
+		"""
+		self.password_algorithm = config.password_algorithm
+		self.password_cost = config.password_cost
+		self.password = hash_password(unhashed, self.salt, self.password_algorithm, self.password_cost)
 
 	def __repr__(self):
 		return "User <{} '{}'>".format(self.id, self.full_name)
 
 def get_login(name, password):
-	"""Get the user with given name or password, or None if not found."""
+	"""Get the user with given name or password, or None if not found.
+
+	If the password was hashed with outdated settings, it is rehashed,
+	so you should commit the session afterwards.
+	Raises a concurrent.futures.TimeoutError if the server is too busy to check the password.
+	"""
 	user = User.query.filter_by(nickname=name).first()
 	if user is None:
 		return None
-	pass_hash = pbkdf2_hmac('sha256', password.encode('utf-8'), user.salt, 100000)
-	if pass_hash != user.password:
+	if not check_password(password, user.salt, user.password, user.password_algorithm, user.password_cost):
 		return None
+	if needs_rehash(user.password_algorithm, user.password_cost):
+		user.password_from_unhashed(password)
+		db.session.add(user)
 	return user
 
+def load_user(user_id):
+	"""Look up the user with the given id, or None if there is no such user.
+
+	Each lookup is counted in g.user_lookups, so you can check how many are made per request.
+	"""
+	if user_id is None:
+		return None
+	if has_request_context():
+		g.user_lookups = g.get('user_lookups', 0) + 1
+	return User.query.get(user_id)
+
+"""Marks the users in an AuthContext that haven't been looked up yet."""
+_unloaded = object()
+
+def _bearer_secret():
+	"""Get the API key secret from the Authorization header, or None if there is none."""
+	scheme, _, secret = request.headers.get('Authorization', '').partition(' ')
+	if scheme.lower() != 'bearer' or not secret.strip():
+		return None
+	return secret.strip()
+
+class AuthContext:
+	"""Who is making the current request: the logged in user and the shadow user (if any).
+
+	The users are looked up the first time they are needed and then remembered,
+	so use get_auth_context instead of making your own.
+	If the request has an API key, the user is its owner and the session is ignored.
+	"""
+	def __init__(self, user_id, shadow_user_id=None, api_key=None):
+		self.user_id = user_id
+		self.shadow_user_id = shadow_user_id
+		self.api_key = api_key
+		"""The levels the user has, filled in by pyserv.auth.auth_mask."""
+		self.auth_mask = None
+		self._user = _unloaded
+		self._shadow_user = _unloaded
+
+	@property
+	def user(self):
+		if self._user is _unloaded:
+			self._user = load_user(self.user_id)
+		return self._user
+
+	@property
+	def shadow_user(self):
+		if self._shadow_user is _unloaded:
+			self._shadow_user = load_user(self.shadow_user_id)
+		return self._shadow_user
+
+	def matches_session(self):
+		"""Does this context still describe the users in the session?
+
+		Contexts for an API key always do, since the header can't change during the request.
+		"""
+		if self.api_key is not None:
+			return True
+		return (self.user_id == session.get('current_user')
+				and self.shadow_user_id == session.get('shadow_user'))
+
+def get_auth_context():
+	"""Get the AuthContext for the current request.
+
+	The context is stored in flask.g, so it lasts for a single request.
+	Logging in or out (or shadowing) halfway through a request gives a fresh context.
+	See also pyserv.apikey for logging in using the Authorization header.
+	"""
+	context = g.get('auth_context')
+	# only comparing two ids, so a stale context can't ever authorize the wrong user
+	if context is None or not context.matches_session():
+		api_key = _bearer_secret()
+		if api_key is not None:
+			context = AuthContext(get_key_owner_id(api_key), api_key=api_key)
+		else:
+			context = AuthContext(session.get('current_user'), session.get('shadow_user'))
+		g.auth_context = context
+	return context
+
+def forget_auth_context():
+	"""Make sure the next get_auth_context looks at the session again."""
+	g.pop('auth_context', None)
+
 def get_logged_in():
 	"""Get the user that is currently logged in, or None otherwise."""
-	if 'current_user' in session:
-		return User.query.get(session['current_user'])
+	return get_auth_context().user
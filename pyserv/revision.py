@@ -0,0 +1,129 @@
+"""The history of the title and contents of blog posts.
+
+Every time a post is saved with a new title or contents, it gets a new BlogRevision.
+Storing all contents in full would take a lot of space for posts that are edited often,
+so only every snapshot_interval-th revision has the full contents,
+and the others only have the lines that changed since the revision before.
+Getting a revision back needs at most snapshot_interval - 1 of those deltas.
+"""
+
+from difflib import SequenceMatcher
+import json
+
+from sqlalchemy import event
+
+from .blog import BlogPost
+from .database import db, DBClass
+
+"""Every revision with a number n where n % snapshot_interval == 1 has the full contents."""
+snapshot_interval = 10
+
+class BlogRevision(DBClass):
+	"""A saved version of a blog post, numbered from 1 onwards.
+
+	Exactly one of snapshot (the full contents) and delta (see make_delta) is not None.
+	"""
+	id = db.Column(db.Integer, primary_key=True)
+	post_id = db.Column(db.Integer, db.ForeignKey('blog_post.id'), nullable=False)
+	number = db.Column(db.Integer, nullable=False)
+	edited = db.Column(db.DateTime(timezone=True))
+	title = db.Column(db.Unicode(255))
+	snapshot = db.Column(db.UnicodeText())
+	delta = db.Column(db.UnicodeText())
+
+	__table_args__ = (
+			db.UniqueConstraint('post_id', 'number'),
+	)
+
+def make_delta(old, new):
+	"""Describe how to turn the old text into the new text, line by line, as a JSON string.
+
+	It is a list where a positive number n means copying the next n old lines,
+	a negative number -n means skipping the next n old lines,
+	and a list of strings means adding those new lines.
+	"""
+	old_lines = (old or "").splitlines(keepends=True)
+	new_lines = (new or "").splitlines(keepends=True)
+	delta = []
+	for tag, old_start, old_end, new_start, new_end in SequenceMatcher(None, old_lines, new_lines, autojunk=False).get_opcodes():
+		if tag == 'equal':
+			delta.append(old_end - old_start)
+			continue
+		if old_end > old_start:
+			delta.append(old_start - old_end)
+		if new_end > new_start:
+			delta.append(new_lines[new_start:new_end])
+	return json.dumps(delta)
+
+def apply_delta(old, delta):
+	"""Turn the old text into the new text again, using the result of make_delta."""
+	old_lines = (old or "").splitlines(keepends=True)
+	new_lines = []
+	position = 0
+	for step in json.loads(delta):
+		if isinstance(step, list):
+			new_lines.extend(step)
+		elif step > 0:
+			new_lines.extend(old_lines[position:position + step])
+			position += step
+		else:
+			position -= step
+	return "".join(new_lines)
+
+def _revision_contents(connection, post_id, number):
+	"""Rebuild the contents of a revision from the last snapshot before it, or None if there is no such revision."""
+	table = BlogRevision.__table__
+	snapshot_number = connection.execute(db.select([db.func.max(table.c.number)]).where(db.and_(
+		table.c.post_id == post_id, table.c.number <= number, table.c.snapshot != None,
+	))).scalar()
+	if snapshot_number is None:
+		return None
+	rows = connection.execute(db.select([table.c.number, table.c.snapshot, table.c.delta]).where(db.and_(
+		table.c.post_id == post_id, table.c.number >= snapshot_number, table.c.number <= number,
+	)).order_by(table.c.number)).fetchall()
+	if rows[-1].number != number:
+		return None
+	contents = None
+	for row in rows:
+		contents = row.snapshot if row.snapshot is not None else apply_delta(contents, row.delta)
+	return contents
+
+def revision_contents(post_id, number):
+	"""Get the contents of the post at the given revision, or None if there is no such revision."""
+	return _revision_contents(db.session.connection(), post_id, number)
+
+def _add_revision(connection, post_id, edited, title, contents):
+	table = BlogRevision.__table__
+	last = connection.execute(db.select([db.func.max(table.c.number)]).where(table.c.post_id == post_id)).scalar() or 0
+	number = last + 1
+	values = {'post_id': post_id, 'number': number, 'edited': edited, 'title': title}
+	if number % snapshot_interval == 1:
+		values['snapshot'] = contents or ""
+	else:
+		values['delta'] = make_delta(_revision_contents(connection, post_id, last), contents)
+	connection.execute(table.insert().values(**values))
+
+@event.listens_for(BlogPost, 'after_insert')
+def _first_revision(mapper, connection, post):
+	_add_revision(connection, post.id, post.last_updated, post.title, post.contents)
+
+@event.listens_for(BlogPost, 'after_update')
+def _next_revision(mapper, connection, post):
+	state = db.inspect(post)
+	title = state.attrs.title.history
+	contents = state.attrs.contents.history
+	if not (title.has_changes() or contents.has_changes()):
+		return
+	table = BlogRevision.__table__
+	has_revisions = connection.execute(db.select([table.c.id]).where(table.c.post_id == post.id).limit(1)).first()
+	if has_revisions is None and contents.deleted:
+		# posts from before there were revisions start their history with the version before this edit
+		old_title = title.deleted[0] if title.deleted else post.title
+		_add_revision(connection, post.id, post.posted, old_title, contents.deleted[0])
+	_add_revision(connection, post.id, post.last_updated, post.title, post.contents)
+
+def post_revisions(post_id):
+	"""Get the BlogRevisions of a post, newest first, without their contents."""
+	return BlogRevision.query.filter_by(post_id=post_id).options(
+		db.defer(BlogRevision.snapshot), db.defer(BlogRevision.delta),
+	).order_by(BlogRevision.number.desc()).all()
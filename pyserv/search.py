@@ -0,0 +1,143 @@
+"""Full-text search through bugs, bug messages, blog posts and users.
+
+The index is kept up to date by listening for inserts and updates of the indexed objects,
+so it changes in the same transaction as the objects themselves.
+On SQLite the index is an FTS5 table, on PostgreSQL a table with a tsvector column.
+Other databases don't get an index, and searching them finds nothing.
+"""
+
+from collections import namedtuple
+from sqlalchemy import DDL, event, text
+
+from .auth import Unspecified, has_auth, levels
+from .blog import BlogPost
+from .bug import Bug, BugUserMessage
+from .database import db
+from .person import User
+
+"""Maps kind of document -> a small number, used to make a unique id for each document."""
+_kinds = {
+	'bug': 0,
+	'bug_message': 1,
+	'blog_post': 2,
+	'user': 3,
+}
+def _document_id(kind, ref):
+	return ref * len(_kinds) + _kinds[kind]
+
+event.listen(db.metadata, 'after_create', DDL("""
+	CREATE VIRTUAL TABLE IF NOT EXISTS search_index USING fts5(
+		kind UNINDEXED, ref UNINDEXED, parent UNINDEXED, public UNINDEXED, title, body
+	)
+""").execute_if(dialect='sqlite'))
+event.listen(db.metadata, 'after_create', DDL("""
+	CREATE TABLE IF NOT EXISTS search_index (
+		id BIGINT PRIMARY KEY,
+		kind VARCHAR(32) NOT NULL, ref INTEGER NOT NULL, parent INTEGER NOT NULL, public BOOLEAN NOT NULL,
+		title TEXT NOT NULL, body TEXT NOT NULL,
+		vector TSVECTOR NOT NULL
+	);
+	CREATE INDEX IF NOT EXISTS ix_search_index_vector ON search_index USING GIN (vector)
+""").execute_if(dialect='postgresql'))
+event.listen(db.metadata, 'before_drop', DDL(
+	"DROP TABLE IF EXISTS search_index"
+).execute_if(dialect=('sqlite', 'postgresql')))
+
+def index_document(connection, kind, ref, title, body, *, parent=None, public=True):
+	"""Add a document to the index, replacing the old version if there is one.
+
+	The parent is the id of the object that the search result should link to,
+	e.g. the bug of a bug message. It defaults to the ref.
+	Documents that aren't public can only be found by users with the blog level.
+	"""
+	if parent is None:
+		parent = ref
+	values = {
+		'id': _document_id(kind, ref), 'kind': kind, 'ref': ref, 'parent': parent,
+		'public': bool(public), 'title': title or "", 'body': body or "",
+	}
+	dialect = connection.dialect.name
+	if dialect == 'sqlite':
+		connection.execute(text("DELETE FROM search_index WHERE rowid = :id"), id=values['id'])
+		connection.execute(text("""
+			INSERT INTO search_index (rowid, kind, ref, parent, public, title, body)
+			VALUES (:id, :kind, :ref, :parent, :public, :title, :body)
+		"""), **values)
+	elif dialect == 'postgresql':
+		connection.execute(text("DELETE FROM search_index WHERE id = :id"), id=values['id'])
+		connection.execute(text("""
+			INSERT INTO search_index (id, kind, ref, parent, public, title, body, vector)
+			VALUES (:id, :kind, :ref, :parent, :public, :title, :body,
+				setweight(to_tsvector('english', :title), 'A') || setweight(to_tsvector('english', :body), 'B'))
+		"""), **values)
+
+@event.listens_for(Bug, 'after_insert')
+@event.listens_for(Bug, 'after_update')
+def _index_bug(mapper, connection, bug):
+	index_document(connection, 'bug', bug.id, bug.title, "")
+
+@event.listens_for(BugUserMessage, 'after_insert')
+def _index_bug_message(mapper, connection, message):
+	index_document(connection, 'bug_message', message.id, "", message.description, parent=message.bug_id)
+
+@event.listens_for(BlogPost, 'after_insert')
+@event.listens_for(BlogPost, 'after_update')
+def _index_blog_post(mapper, connection, post):
+	index_document(connection, 'blog_post', post.id, post.title, post.contents, public=post.public)
+
+@event.listens_for(User, 'after_insert')
+@event.listens_for(User, 'after_update')
+def _index_user(mapper, connection, user):
+	index_document(connection, 'user', user.id, user.full_name,
+			" ".join(name for name in (user.nickname, user.personal_name) if name))
+
+"""A single search result. The snippet is a piece of the body with the matches between [ and ]."""
+SearchResult = namedtuple('SearchResult', ['kind', 'ref', 'parent', 'title', 'snippet'])
+
+def _fts5_query(term):
+	"""Turn the words in the term into an FTS5 query that matches all of them."""
+	return " ".join('"{}"'.format(word.replace('"', '""')) for word in term.split())
+
+def search(term, kinds=None, user=Unspecified, start=0, count=20):
+	"""Search the index for documents with all the words in the term, best match first.
+
+	Kinds limits the results to these kinds of documents (e.g. 'bug' and 'bug_message').
+	Private blog posts are only found if the user has the blog level,
+	where not passing a user means the logged in user (like has_auth).
+	"""
+	if not term.split():
+		return []
+	conditions = []
+	params = {'start': start, 'count': count}
+	if kinds is not None:
+		placeholders = []
+		for i, kind in enumerate(kinds):
+			params['kind{}'.format(i)] = kind
+			placeholders.append(':kind{}'.format(i))
+		conditions.append("kind IN ({})".format(", ".join(placeholders)))
+	if not has_auth(levels.blog, user):
+		conditions.append("public")
+	conditions = "".join(" AND " + condition for condition in conditions)
+
+	dialect = db.engine.dialect.name
+	if dialect == 'sqlite':
+		params['query'] = _fts5_query(term)
+		query = text("""
+			SELECT kind, ref, parent, title, snippet(search_index, -1, '[', ']', '…', 16)
+			FROM search_index
+			WHERE search_index MATCH :query {}
+			ORDER BY rank
+			LIMIT :count OFFSET :start
+		""".format(conditions))
+	elif dialect == 'postgresql':
+		params['query'] = term
+		query = text("""
+			SELECT kind, ref, parent, title, ts_headline('english', body, query, 'StartSel=[, StopSel=], MaxWords=16')
+			FROM search_index, plainto_tsquery('english', :query) query
+			WHERE vector @@ query {}
+			ORDER BY ts_rank(vector, query) DESC
+			LIMIT :count OFFSET :start
+		""".format(conditions))
+	else:
+		return []
+	return [SearchResult(*row) for row in db.session.execute(query, params)]
@@ -0,0 +1,332 @@
+"""Keep the session on the server, instead of in a signed cookie.
+
+The cookie only contains a random session id, so logging out really ends the session
+and flashed messages don't make every request larger.
+There are two stores: the database (SQLSessionStore) and a shared directory (FileSessionStore).
+Each process remembers the recently used sessions for a few seconds, so hot sessions aren't read every request.
+Ending a session (logging out or rotating it) is recorded as an EndedSession,
+and every process checks for those every config.session_end_check_interval seconds,
+so an ended session is served from another process's cache for at most that long.
+"""
+
+from base64 import urlsafe_b64encode
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from flask import session
+from flask.sessions import SessionInterface, SessionMixin, session_json_serializer
+import os
+import re
+from threading import Lock, Thread
+from time import monotonic, sleep, time
+from werkzeug.datastructures import CallbackDict
+
+from .app import app
+from . import config
+from .database import db, DBClass
+
+class LRUCache:
+	"""A dict of at most size entries that forgets the least recently used ones first, safe to share between threads."""
+	def __init__(self, size):
+		self.size = size
+		self._entries = OrderedDict()
+		self._lock = Lock()
+
+	def get(self, key, default=None):
+		with self._lock:
+			value = self._entries.get(key, default)
+			if key in self._entries:
+				self._entries.move_to_end(key)
+			return value
+
+	def put(self, key, value):
+		"""Store the value, returning the keys that were evicted to make room."""
+		evicted = []
+		with self._lock:
+			self._entries[key] = value
+			self._entries.move_to_end(key)
+			while len(self._entries) > self.size:
+				evicted.append(self._entries.popitem(last=False)[0])
+		return evicted
+
+	def pop(self, key, default=None):
+		with self._lock:
+			return self._entries.pop(key, default)
+
+	def clear(self):
+		with self._lock:
+			self._entries.clear()
+
+	def keys(self):
+		"""The keys, least recently used first."""
+		with self._lock:
+			return list(self._entries)
+
+	def __len__(self):
+		return len(self._entries)
+
+class StoredSession(DBClass):
+	"""The data of a single session, for the SQLSessionStore."""
+	sid = db.Column(db.Unicode(64), primary_key=True)
+	data = db.Column(db.LargeBinary(), nullable=False)
+	expires = db.Column(db.DateTime(), nullable=False, index=True)
+
+class EndedSession(DBClass):
+	"""A session that ended recently, so the other processes can drop it from their cache.
+
+	Only needed for session_cache_ttl seconds, since cached sessions are loaded again after that anyway.
+	"""
+	id = db.Column(db.Integer, primary_key=True)
+	sid = db.Column(db.Unicode(64), nullable=False)
+	ended = db.Column(db.DateTime(), nullable=False, index=True)
+
+class SQLSessionStore:
+	"""Store sessions in the StoredSession table.
+
+	Uses its own transactions, so saving the session never commits anything for the view.
+	"""
+	def load(self, sid):
+		"""Get the serialized data of the session, or None if it doesn't exist or has expired."""
+		table = StoredSession.__table__
+		with db.engine.connect() as connection:
+			return connection.execute(db.select([table.c.data]).where(db.and_(
+				table.c.sid == sid,
+				table.c.expires > datetime.utcnow(),
+			))).scalar()
+
+	def save(self, sid, data, expires):
+		"""Store the serialized data, valid until the expiry time (in UTC)."""
+		table = StoredSession.__table__
+		with db.engine.begin() as connection:
+			updated = connection.execute(table.update().where(table.c.sid == sid).values(
+				data=data, expires=expires,
+			))
+			if not updated.rowcount:
+				connection.execute(table.insert().values(sid=sid, data=data, expires=expires))
+
+	def delete(self, sid):
+		table = StoredSession.__table__
+		with db.engine.begin() as connection:
+			connection.execute(table.delete().where(table.c.sid == sid))
+
+	def sweep(self):
+		"""Remove all expired sessions at once, returning how many there were."""
+		table = StoredSession.__table__
+		with db.engine.begin() as connection:
+			return connection.execute(table.delete().where(table.c.expires <= datetime.utcnow())).rowcount
+
+class FileSessionStore:
+	"""Store each session in its own file in a (possibly shared) directory.
+
+	The modification time of a file is set to the time the session expires,
+	so sweeping only needs to look at the directory listing.
+	"""
+	def __init__(self, directory):
+		self.directory = directory
+		os.makedirs(directory, exist_ok=True)
+
+	def _path(self, sid):
+		# ServerSessionInterface only gives ids in the format of _new_sid, so they can't escape the directory
+		return os.path.join(self.directory, sid)
+
+	def load(self, sid):
+		try:
+			with open(self._path(sid), 'rb') as session_file:
+				if os.fstat(session_file.fileno()).st_mtime <= time():
+					return None
+				return session_file.read()
+		except FileNotFoundError:
+			return None
+
+	def save(self, sid, data, expires):
+		# write to a temporary file first, so other processes never read half a session
+		path = self._path(sid)
+		temp_path = "{}.{}.tmp".format(path, os.getpid())
+		with open(temp_path, 'wb') as session_file:
+			session_file.write(data)
+		expires = (expires - datetime(1970, 1, 1)).total_seconds()
+		os.utime(temp_path, (expires, expires))
+		os.replace(temp_path, path)
+
+	def delete(self, sid):
+		try:
+			os.remove(self._path(sid))
+		except FileNotFoundError:
+			pass
+
+	def sweep(self):
+		swept = 0
+		now = time()
+		for entry in os.scandir(self.directory):
+			if entry.name.endswith('.tmp'):
+				continue
+			try:
+				if entry.stat().st_mtime <= now:
+					os.remove(entry.path)
+					swept += 1
+			except FileNotFoundError:
+				# another process swept it first
+				pass
+		return swept
+
+class ServerSession(CallbackDict, SessionMixin):
+	"""The session object for a ServerSessionInterface."""
+	def __init__(self, initial=None, sid=None, new=False):
+		def on_update(self):
+			self.modified = True
+		CallbackDict.__init__(self, initial, on_update)
+		self.sid = sid
+		self.new = new
+		self.modified = False
+		"""Should the session get a new id when it is saved? See rotate_session."""
+		self.rotate = False
+
+def _new_sid():
+	return urlsafe_b64encode(os.urandom(32)).decode('ascii')
+
+"""The format of the ids made by _new_sid; anything else in the cookie is not a session."""
+_sid_format = re.compile(r'[A-Za-z0-9_-]{43}=')
+
+class ServerSessionInterface(SessionInterface):
+	"""Keeps sessions in a session store, with only their id in the cookie.
+
+	Recently used sessions are kept in a small LRU cache,
+	which may be up to cache_ttl seconds behind changes by other processes.
+	Sessions that other processes end are dropped from it within end_check_interval seconds, see _drop_ended.
+	"""
+	serializer = session_json_serializer
+
+	def __init__(self, store, cache_size, cache_ttl, end_check_interval):
+		self.store = store
+		self.cache_ttl = cache_ttl
+		self.end_check_interval = end_check_interval
+		"""Maps sid -> (serialized data, time the entry stops being valid)."""
+		self._cache = LRUCache(cache_size)
+		self._end_check_lock = Lock()
+		"""The id of the last EndedSession we know about, or None before the first check."""
+		self._last_ended_id = None
+		self._next_end_check = 0
+
+	def _drop_ended(self):
+		"""Drop the sessions other processes ended from the cache, if we haven't checked for a while."""
+		now = monotonic()
+		with self._end_check_lock:
+			if now < self._next_end_check:
+				return
+			self._next_end_check = now + self.end_check_interval
+		table = EndedSession.__table__
+		with db.engine.connect() as connection:
+			if self._last_ended_id is None:
+				# the cache starts out empty, so only the sessions that end from now on matter
+				self._last_ended_id = connection.execute(db.select([db.func.max(table.c.id)])).scalar() or 0
+				return
+			ended = connection.execute(db.select([table.c.id, table.c.sid]).where(
+				table.c.id > self._last_ended_id,
+			).order_by(table.c.id)).fetchall()
+		if ended:
+			for row in ended:
+				self._cache.pop(row.sid)
+			with self._end_check_lock:
+				self._last_ended_id = max(self._last_ended_id, ended[-1].id)
+
+	def _load(self, sid):
+		self._drop_ended()
+		cached = self._cache.get(sid)
+		if cached is not None and cached[1] > monotonic():
+			return cached[0]
+		data = self.store.load(sid)
+		if data is not None:
+			self._remember(sid, data)
+		return data
+
+	def _remember(self, sid, data):
+		self._cache.put(sid, (data, monotonic() + self.cache_ttl))
+
+	def _forget(self, sid):
+		self._cache.pop(sid)
+		self.store.delete(sid)
+		# the other processes may still have it cached
+		table = EndedSession.__table__
+		with db.engine.begin() as connection:
+			connection.execute(table.insert().values(sid=sid, ended=datetime.utcnow()))
+
+	def open_session(self, app, request):
+		sid = request.cookies.get(app.session_cookie_name)
+		# the cookie comes from the client, so it could be anything, like a path
+		if sid and _sid_format.fullmatch(sid):
+			data = self._load(sid)
+			if data is not None:
+				return ServerSession(self.serializer.loads(data.decode('utf-8')), sid=sid)
+		return ServerSession(sid=_new_sid(), new=True)
+
+	def save_session(self, app, session, response):
+		domain = self.get_cookie_domain(app)
+		path = self.get_cookie_path(app)
+		if session.rotate and not session.new:
+			self._forget(session.sid)
+			session.sid = _new_sid()
+			session.new = True
+
+		if not session:
+			if not session.new:
+				self._forget(session.sid)
+				response.delete_cookie(app.session_cookie_name, domain=domain, path=path)
+			return
+		if not (session.modified or session.new):
+			return
+
+		data = self.serializer.dumps(dict(session)).encode('utf-8')
+		self.store.save(session.sid, data, datetime.utcnow() + app.permanent_session_lifetime)
+		self._remember(session.sid, data)
+		response.set_cookie(app.session_cookie_name, session.sid,
+				expires=self.get_expiration_time(app, session),
+				httponly=self.get_cookie_httponly(app),
+				domain=domain, path=path,
+				secure=self.get_cookie_secure(app))
+
+def rotate_session():
+	"""Give the current session a new id, making the old one invalid.
+
+	Use this when logging in or out, so a copied cookie can't be used anymore.
+	Does nothing for cookie-based sessions.
+	"""
+	if isinstance(session._get_current_object(), ServerSession):
+		session.rotate = True
+
+def sweep_ended_sessions(cache_ttl):
+	"""Remove the EndedSessions that no process can have cached anymore, returning how many there were."""
+	table = EndedSession.__table__
+	with db.engine.begin() as connection:
+		return connection.execute(table.delete().where(
+			table.c.ended <= datetime.utcnow() - timedelta(seconds=cache_ttl),
+		)).rowcount
+
+def _sweep_forever(store, interval):
+	"""Periodically remove all expired sessions from the store."""
+	while True:
+		sleep(interval)
+		try:
+			swept = store.sweep()
+			swept += sweep_ended_sessions(config.session_cache_ttl)
+			app.logger.debug("swept {} expired sessions".format(swept))
+		except Exception:
+			app.logger.exception("couldn't sweep expired sessions")
+
+def make_session_interface():
+	"""Make the session interface chosen by config.session_store.
+
+	Returns None for 'cookie', meaning Flask's own signed cookies.
+	For the other stores, starts a thread that sweeps expired sessions.
+	"""
+	if config.session_store == 'cookie':
+		return None
+	elif config.session_store == 'sql':
+		store = SQLSessionStore()
+	elif config.session_store == 'file':
+		store = FileSessionStore(os.path.join(config.dynamic_file_path, 'sessions'))
+	else:
+		raise ValueError("unknown session store {}".format(config.session_store))
+
+	sweeper = Thread(target=_sweep_forever, args=(store, config.session_sweep_interval), daemon=True)
+	sweeper.start()
+	return ServerSessionInterface(store, config.session_cache_size, config.session_cache_ttl,
+			config.session_end_check_interval)
@@ -0,0 +1,79 @@
+"""Compiling the Mako templates ahead of time, and keeping track of how long they take.
+
+Mako compiles a template to Python the first time it is used, which makes the first requests
+of every new process slow. With config.store_compiled_templates, the compiled templates are kept
+as modules in dynamic_file_path/templates, so they are only compiled again when they change,
+and compile_templates.py can compile all of them while deploying.
+With config.preload_templates, setup loads all templates before anything is served.
+"""
+
+import os
+from threading import Lock
+from time import perf_counter
+
+from flask_mako import _lookup
+
+from .app import app
+from . import config
+
+"""The files in the template folder with these extensions are templates."""
+template_extensions = ('.html', '.tpl')
+
+def module_directory():
+	"""The directory the compiled templates go in, or None if they are only kept in memory."""
+	if not config.store_compiled_templates:
+		return None
+	return os.path.join(config.dynamic_file_path, 'templates')
+
+"""Maps template name -> {'load_seconds', 'renders', 'render_seconds'} for the templates used by this process.
+
+The load time includes compiling, unless the template was already compiled to a module.
+"""
+_timings = {}
+_timings_lock = Lock()
+
+def _timing(name):
+	return _timings.setdefault(name, {'load_seconds': None, 'renders': 0, 'render_seconds': 0.0})
+
+def template_names():
+	"""The names of all templates in the template folder, including those in subfolders."""
+	folder = os.path.join(app.root_path, app.template_folder)
+	names = []
+	for directory, subdirectories, files in os.walk(folder):
+		for file_name in files:
+			if file_name.endswith(template_extensions):
+				path = os.path.relpath(os.path.join(directory, file_name), folder)
+				names.append(path.replace(os.sep, '/'))
+	return sorted(names)
+
+def load_template(name):
+	"""Get the template with the given name, timing how long it takes if it's the first time."""
+	lookup = _lookup(app)
+	with _timings_lock:
+		loaded = _timing(name)['load_seconds'] is not None
+	if loaded:
+		return lookup.get_template(name)
+	start = perf_counter()
+	template = lookup.get_template(name)
+	with _timings_lock:
+		_timing(name)['load_seconds'] = perf_counter() - start
+	return template
+
+def preload_templates():
+	"""Load (and if needed, compile) all templates, returning the number of seconds each took."""
+	names = template_names()
+	for name in names:
+		load_template(name)
+	with _timings_lock:
+		return {name: _timings[name]['load_seconds'] for name in names}
+
+def record_render(name, seconds):
+	with _timings_lock:
+		timing = _timing(name)
+		timing['renders'] += 1
+		timing['render_seconds'] += seconds
+
+def template_timings():
+	"""A copy of the timings of each template used by this process."""
+	with _timings_lock:
+		return {name: dict(timing) for name, timing in _timings.items()}
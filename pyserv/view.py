@@ -4,18 +4,41 @@ Most basic pages are defined here, but any subsites have their own views.
 You could technically consider them more of a controller, but the whole MVC thing is overplayed.
 """
 
-from datetime import datetime
-from flask import abort, flash, redirect, request, session, url_for
+from concurrent.futures import TimeoutError
+from datetime import date, datetime, timedelta
+from difflib import unified_diff
+from time import perf_counter
+from flask import Response, abort, flash, jsonify, redirect, request, send_file, send_from_directory, session, stream_with_context, url_for
 import flask_mako
+from mimetypes import guess_type
+import os
 
-from .apikey import APIKey
+from .apikey import APIKey, revoke_key
 from .app import app
+from .assets import compressed_file, far_future, manifest, original_name
 from .auth import has_auth, levels, require_auth, set_shadow_user
-from .bug import Bug, BugPriority, BugStatus, BugUserMessage, bug_from_user, get_all_bugs, new_message
+from .bug import Bug, BugMessage, BugPriority, BugState, BugStatus, BugUserMessage, all_bugs_as_of, bug_as_of, bug_counts, bug_from_user, bug_sort_columns, bug_timeline, bug_trends, get_all_bugs, new_message, open_statuses
 from .blog import BlogPost, all_posts
+from .markup import renderer_version
+from .bug_transfer import export_bugs, import_bugs
+from .compression import compression_stats
+from .conditional import conditional
 from . import config
-from .database import db
-from .person import User, get_login, get_logged_in
+from .database import commit_with_retries, db, get_version
+from .duplicates import similar_bugs
+from .fragment import fragments
+from .page_cache import cached_page, page_version_name, pages
+from .person import User, forget_auth_context, get_auth_context, get_login, get_logged_in
+from .revision import post_revisions, revision_contents
+from .search import search
+from .session import rotate_session
+from .templates import load_template, record_render, template_timings
+
+@app.url_defaults
+def hash_static_urls(endpoint, values):
+	"""Link to static files by the name with their hash, see pyserv.assets."""
+	if endpoint == 'static' and values.get('filename') in manifest:
+		values['filename'] = manifest[values['filename']]
 
 @app.context_processor
 def inject_lang():
@@ -32,44 +55,83 @@ def inject_auth():
 def inject_current_user():
 	"""Grant access to the logged in user (and the shadowed user)."""
 	app.logger.debug(session)
-	if 'shadow_user' in session:
-		assert session['current_user'] is not None
+	context = get_auth_context()
+	if context.shadow_user_id is not None:
+		assert context.user_id is not None
 		assert config.debug # in case of any accidents
-		return {'current_user': get_logged_in(), 'shadow_user_id': session['shadow_user']}
+		return {'current_user': context.user, 'shadow_user_id': context.shadow_user_id}
 	else:
-		return {'current_user': get_logged_in()}
+		return {'current_user': context.user}
+
+def pages_validator(*args, **kwargs):
+	"""Validate pages that depend on many bugs, posts or users, by the version that changes with each of them."""
+	return [get_version(page_version_name)]
 
-def render_template(*args, **kwargs):
-	"""A wrapper for flask_mako.render_template that also renders the Mako template error."""
+def render_template(template_name, **kwargs):
+	"""A wrapper for flask_mako.render_template that also renders the Mako template error and times the template."""
+	load_template(template_name)
+	start = perf_counter()
 	try:
-		return flask_mako.render_template(*args, **kwargs)
+		rendered = flask_mako.render_template(template_name, **kwargs)
 	except flask_mako.TemplateError as e:
 		return e.text, 500
+	record_render(template_name, perf_counter() - start)
+	return rendered
 
 @app.route('/')
+@cached_page
 def front_page():
 	return render_template('front_page.html')
 
+@app.route('/static/<path:filename>', endpoint='static')
+def static_file(filename):
+	"""Serve a static file, compressed if possible, and cached forever if the name has its hash."""
+	name = original_name(filename)
+	if name is None:
+		return send_from_directory(config.static_file_path, filename)
+	path, encoding = compressed_file(filename, request.accept_encodings)
+	if path is None:
+		path = os.path.join(config.static_file_path, name)
+	response = send_file(path, mimetype=guess_type(name)[0], conditional=True, cache_timeout=far_future)
+	if encoding is not None:
+		response.headers['Content-Encoding'] = encoding
+	response.vary.add('Accept-Encoding')
+	response.headers['Cache-Control'] = 'public, max-age={}, immutable'.format(far_future)
+	return response
+
 @app.route('/service/api_key', methods=["GET", "POST"])
-@require_auth(levels.logged_in)
-@require_auth(levels.no_key)
+@require_auth(levels.logged_in, levels.no_key)
 def api_key_overview():
 	return render_template('api_key_overview.html')
 
 @app.route('/service/api_key/create', methods=["GET", "POST"])
-@require_auth(levels.logged_in)
-@require_auth(levels.no_key)
+@require_auth(levels.logged_in, levels.no_key)
 def create_api_key():
 	if request.method == "POST":
 		user = get_logged_in()
 		key = APIKey(user)
 		db.session.add(key)
 		db.session.commit()
-		flash('Created key "{}".'.format(key))
-		return redirect(url_for('api_key_overview'))
+		# this is the only time we know the secret, so show it now,
+		# in the response itself so it doesn't get stored in the session like a flashed message
+		response = app.make_response(render_template('api_key_created.html', key=key))
+		response.cache_control.no_store = True
+		return response
 	else:
 		return render_template('create_api_key_form.html')
 
+@app.route('/service/api_key/<key_id>/revoke', methods=["POST"])
+@require_auth(levels.logged_in, levels.no_key)
+def revoke_api_key(key_id):
+	key = APIKey.query.get(key_id)
+	if key is None or key.owner_id != get_logged_in().id:
+		# return 403 to not leak any information about other users' keys
+		return abort(403)
+	revoke_key(key)
+	db.session.commit()
+	flash('Revoked key #{}.'.format(key_id))
+	return redirect(url_for('api_key_overview'))
+
 @app.route('/service/shadow_user', methods=["GET", "POST"])
 @require_auth(levels.shadow_god)
 def shadow_user_form():
@@ -99,12 +161,21 @@ def login_form():
 		password = request.form.get('pass', '')
 		next_page = request.args.get('next', '')
 		# check username and password
-		current_user = get_login(user, password)
+		try:
+			current_user = get_login(user, password)
+		except TimeoutError:
+			app.logger.warning("timed out checking a password")
+			flash("The server is too busy to log you in, please try again later.")
+			return render_template('login_form.html'), 503
 		if current_user is None:
 			app.logger.info("authentication attempt failed")
 			flash("Invalid credentials.")
 			return render_template('login_form.html')
+		# store the upgraded password hash, if any
+		db.session.commit()
+		rotate_session()
 		session['current_user'] = current_user.id
+		forget_auth_context()
 		# display the page
 		flash("You were logged in.")
 		if not next_page or next_page == url_for('login_form'):
@@ -117,21 +188,144 @@ def logout():
 	next_page = request.args.get('next', '')
 	session.pop('current_user', None)
 	session.pop('shadow_user', None)
+	forget_auth_context()
+	# make sure a copy of the old cookie doesn't work anymore
+	rotate_session()
 	flash('You were logged out.')
 	if not next_page:
 		return redirect('/')
 	return redirect(next_page)
 
+def user_validator(user_id):
+	full_name = db.session.query(User.full_name).filter(User.id == user_id).scalar()
+	if full_name is None:
+		return None
+	return [full_name]
+
 @app.route('/user/<user_id>')
+@conditional(user_validator)
 def user_profile(user_id):
 	user = User.query.get(user_id)
 	if user is None:
 		abort(403)
 	return render_template('user_profile.html', user=user)
 
+def parse_as_of():
+	"""Get the time in the `as_of` query parameter, or None if there is none.
+
+	The time is formatted like 2016-12-31T23:59, or 2016-12-31 for the start of that day.
+	Raises a ValueError if it is formatted wrong.
+	"""
+	as_of = request.args.get('as_of')
+	if not as_of:
+		return None
+	try:
+		return datetime.strptime(as_of, '%Y-%m-%dT%H:%M')
+	except ValueError:
+		return datetime.strptime(as_of, '%Y-%m-%d')
+
+"""How many bugs the overview shows by default, and at most."""
+bugs_per_page = 50
+max_bugs_per_page = 500
+
 @app.route('/service/bug')
+@conditional(pages_validator)
+@cached_page
 def bug_overview():
-	return render_template('bug_overview.html', bugs=get_all_bugs())
+	"""Show a page of bugs, filtered and sorted by the query parameters.
+
+	Takes any number of `status` and `priority` names, `sort` (see bug_sort_columns),
+	`order` (asc or desc), `count` and the cursor `after`.
+	With `as_of`, shows the bugs as they were at that time instead, sorted by id.
+	"""
+	try:
+		statuses = [BugStatus[status] for status in request.args.getlist('status')] or open_statuses
+		priorities = [BugPriority[priority] for priority in request.args.getlist('priority')] or None
+		sort = request.args.get('sort', 'status')
+		if sort not in bug_sort_columns:
+			raise ValueError("can't sort on {}".format(sort))
+		descending = request.args.get('order', 'asc') == 'desc'
+		count = max(1, min(int(request.args.get('count', bugs_per_page)), max_bugs_per_page))
+		as_of = parse_as_of()
+		if as_of is not None:
+			bugs = all_bugs_as_of(as_of, statuses, priorities, after=request.args.get('after'), count=count)
+		else:
+			bugs = get_all_bugs(statuses, priorities,
+					sort=sort, descending=descending, after=request.args.get('after'), count=count)
+	except (KeyError, ValueError):
+		return abort(400)
+
+	next_url = None
+	if bugs.next_cursor is not None:
+		args = request.args.copy()
+		args['after'] = bugs.next_cursor
+		next_url = url_for('bug_overview', **args.to_dict(flat=False))
+	return render_template('bug_overview.html', bugs=bugs, next_url=next_url, counts=bug_counts(),
+			statuses=statuses, priorities=priorities or [], sort=sort, descending=descending, as_of=as_of)
+
+@app.route('/service/bug/stats/api')
+@conditional(pages_validator)
+def bug_stats_api():
+	"""The number of bugs with each status and priority, and the open bugs per priority."""
+	counts = bug_counts()
+	return jsonify({
+		'counts': [{
+			'status': status.name,
+			'priority': priority.name,
+			'count': count,
+		} for (status, priority), count in counts.items()],
+		'open': {
+			priority.name: sum(counts.get((status, priority), 0) for status in open_statuses)
+			for priority in BugPriority
+		},
+	})
+
+"""How many days the trends cover by default, and at most."""
+trend_days = 30
+max_trend_days = 3660
+
+def trends_validator():
+	# the default days depend on today
+	return [get_version(page_version_name), date.today()]
+
+@app.route('/service/bug/trends/api')
+@conditional(trends_validator)
+def bug_trends_api():
+	"""The open bugs and the bugs opened and closed per day and priority.
+
+	Takes the first and last day as `start` and `end` (YYYY-MM-DD), by default the last trend_days days.
+	"""
+	try:
+		end = request.args.get('end')
+		end = datetime.strptime(end, '%Y-%m-%d').date() if end else datetime.now().date()
+		start = request.args.get('start')
+		start = datetime.strptime(start, '%Y-%m-%d').date() if start else end - timedelta(days=trend_days - 1)
+	except ValueError:
+		return abort(400)
+	if not 0 <= (end - start).days < max_trend_days:
+		return abort(400)
+	return jsonify({'days': [{
+		'day': day.isoformat(),
+		'priorities': {priority.name: trend._asdict() for priority, trend in trend.items()},
+	} for day, trend in bug_trends(start, end)]})
+
+@app.route('/service/stats/cache')
+@require_auth(levels.god)
+def cache_stats_api():
+	"""Give the hit and miss counters of the caches of this process."""
+	return jsonify(fragments=fragments.stats(), pages=pages.stats())
+
+@app.route('/service/stats/compression')
+@require_auth(levels.god)
+def compression_stats_api():
+	"""Give how much the responses of this process were compressed, and how much CPU time it took."""
+	return jsonify(compression=compression_stats.stats())
+
+@app.route('/service/stats/templates')
+@require_auth(levels.god)
+def template_stats_api():
+	"""Give how long each template took to load and render in this process."""
+	return jsonify(templates=template_timings())
 
 @app.route('/service/bug/new', methods=["GET", "POST"])
 def bug_report():
@@ -154,44 +348,192 @@ def bug_report():
 	else:
 		return render_template('bug_form.html')
 
+@app.route('/service/bug/export')
+@require_auth(levels.god)
+def bug_export():
+	"""Stream all bugs and their messages as NDJSON, see bug_transfer."""
+	return Response(stream_with_context(export_bugs()), mimetype='application/x-ndjson')
+
+@app.route('/service/bug/import', methods=["POST"])
+@require_auth(levels.god)
+def bug_import():
+	"""Import the NDJSON in the request body, see bug_transfer.
+
+	Takes `batch_size` to override the number of bugs inserted at once.
+	"""
+	try:
+		batch_size = request.args.get('batch_size')
+		if batch_size is not None:
+			batch_size = max(int(batch_size), 1)
+		imported = import_bugs(request.stream, batch_size)
+	except ValueError as e:
+		return jsonify({'error': str(e)}), 400
+	return jsonify({'imported': imported})
+
+"""How many duplicate suggestions the bug form gets by default, and at most."""
+duplicate_suggestions = 5
+max_duplicate_suggestions = 20
+
+@app.route('/service/bug/duplicates/api')
+@conditional(pages_validator)
+def bug_duplicates_api():
+	"""Suggest bugs similar to the `title` and `description`, for the bug form."""
+	try:
+		count = max(1, min(int(request.args.get('count', duplicate_suggestions)), max_duplicate_suggestions))
+	except ValueError:
+		return abort(400)
+	suggestions = similar_bugs(request.args.get('title', ''), request.args.get('description'), count=count)
+	return jsonify({'suggestions': [{
+		'id': suggestion.bug.id,
+		'title': suggestion.bug.title,
+		'status': suggestion.bug.status.value,
+		'score': round(suggestion.score, 3),
+		'url': url_for('bug_profile', bug_id=suggestion.bug.id),
+	} for suggestion in suggestions]})
+
+"""How many messages the bug profile shows at once."""
+messages_per_page = 50
+
+def bug_validator(bug_id):
+	"""Validate the bug profile by the version of the bug and its latest message."""
+	try:
+		bug_id = int(bug_id)
+	except ValueError:
+		return None
+	row = db.session.query(Bug.version, db.func.max(BugMessage.id)).outerjoin(
+		BugMessage, BugMessage.bug_id == Bug.id,
+	).filter(Bug.id == bug_id).group_by(Bug.id).first()
+	if row is None:
+		return None
+	return list(row)
+
 @app.route('/service/bug/<bug_id>')
+@conditional(bug_validator)
+@cached_page
 def bug_profile(bug_id):
+	"""Show the bug and its messages, or with `as_of`, how they were at that time."""
 	bug = Bug.query.get_or_404(bug_id)
-	return render_template('bug_profile.html', bug=bug)
+	try:
+		as_of = parse_as_of()
+		timeline = bug_timeline(bug, before=request.args.get('before'), count=messages_per_page, until=as_of)
+	except ValueError:
+		return abort(400)
+	state = bug
+	if as_of is not None:
+		state = bug_as_of(bug.id, as_of)
+		if state is None:
+			return abort(404)
+	older_url = None
+	if timeline.next_cursor is not None:
+		args = request.args.to_dict()
+		args['before'] = timeline.next_cursor
+		older_url = url_for('bug_profile', bug_id=bug.id, **args)
+	return render_template('bug_profile.html', bug=bug, state=state, timeline=timeline, older_url=older_url, as_of=as_of)
+
+def seen_bug_state(bug_id):
+	"""The BugState in the `seen_*` fields of the form, or None if they aren't all there."""
+	try:
+		return BugState(bug_id, request.form['seen_title'],
+				BugStatus[request.form['seen_status']], BugPriority[request.form['seen_priority']])
+	except KeyError:
+		return None
 
 @app.route('/service/bug/<bug_id>/message', methods=["POST"])
 def bug_message(bug_id):
-	bug = Bug.query.get_or_404(bug_id)
+	"""Post a message to the bug, only changing the fields that differ from the `seen_*` fields."""
+	seen = seen_bug_state(bug_id)
+	def post_message():
+		bug = Bug.query.get_or_404(bug_id)
 
-	title = request.form.get('title', bug.title)
-	status = request.form.get('status', bug.status.name)
-	priority = request.form.get('priority', bug.priority.name)
-	description = request.form.get('description', '')
-
-	status = BugStatus[status]
-	priority = BugPriority[priority]
+		title = request.form.get('title', bug.title)
+		status = request.form.get('status', bug.status.name)
+		priority = request.form.get('priority', bug.priority.name)
+		description = request.form.get('description', '')
 
-	message = new_message(BugUserMessage,
-			bug, description, title=title, status=status, priority=priority
-	)
+		status = BugStatus[status]
+		priority = BugPriority[priority]
 
-	db.session.add(bug)
-	db.session.commit()
+		return new_message(BugUserMessage,
+				bug, description, title=title, status=status, priority=priority, seen=seen
+		)
+	message = commit_with_retries(post_message)
+	fragments.invalidate('bug', message.bug_id)
 
 	flash("Message posted!")
-	return redirect(url_for('bug_profile', bug_id=bug.id))
+	if message.conflicts:
+		flash("Someone else changed the {} in the meantime, so your change to it was not applied.".format(
+			" and ".join(message.conflicts)
+		))
+	return redirect(url_for('bug_profile', bug_id=message.bug_id))
+
+def search_results_json(term, kinds):
+	"""Search for the term and turn the results into JSON.
+
+	The `start` and `count` query parameters give the page of results,
+	and `next_start` in the JSON gives the start of the next page (or null).
+	"""
+	try:
+		start = max(int(request.values.get('start', 0)), 0)
+		count = max(1, min(int(request.values.get('count', search_results_per_page)), max_search_results_per_page))
+	except ValueError:
+		return abort(400)
+	results = search(term, kinds, start=start, count=count)
+	return jsonify({
+		'results': [{
+			'kind': result.kind,
+			'id': result.ref,
+			'title': result.title,
+			'snippet': result.snippet,
+			'url': search_result_url(result),
+		} for result in results],
+		'next_start': start + count if len(results) == count else None,
+	})
+
+"""Maps kind of search result -> (endpoint, argument name) of the page showing it."""
+search_result_urls = {
+	'bug': ('bug_profile', 'bug_id'),
+	'bug_message': ('bug_profile', 'bug_id'),
+	'blog_post': ('blog_post_profile', 'post_id'),
+	'user': ('user_profile', 'user_id'),
+}
+def search_result_url(result):
+	endpoint, argument = search_result_urls[result.kind]
+	return url_for(endpoint, **{argument: result.parent})
+"""How many search results to give by default, and at most."""
+search_results_per_page = 20
+max_search_results_per_page = 100
+
+@app.route('/service/search/api', methods=["GET", "POST"])
+@conditional(pages_validator)
+def search_api():
+	"""Search everything, or only the kinds given in the `kind` parameter."""
+	kinds = request.values.getlist('kind') or None
+	if kinds is not None and any(kind not in search_result_urls for kind in kinds):
+		return abort(400)
+	return search_results_json(request.values.get('term', ''), kinds)
 
 @app.route('/service/bug/search/api', methods=["POST"])
 def bug_search_api():
-	term = request.form.get("term", "")
-	if not term:
-		return {}
-	from_title = Bug.query.filter(Bug.title.like(term)).all()
-	return from_title
+	return search_results_json(request.form.get('term', ''), ['bug', 'bug_message'])
+
+"""How many posts the blog overview shows at once."""
+posts_per_page = 10
 
 @app.route('/blog')
+@conditional(pages_validator)
+@cached_page
 def blog_overview():
-	return render_template("blog_overview.html", posts=all_posts(start=0, count=10))
+	"""Show the latest posts, or with `before` or `after`, the older or newer posts than a page."""
+	try:
+		posts = all_posts(count=posts_per_page, before=request.args.get('before'), after=request.args.get('after'))
+	except ValueError:
+		return abort(400)
+	older_url = newer_url = None
+	if posts.next_cursor is not None:
+		older_url = url_for('blog_overview', before=posts.next_cursor)
+	if posts.previous_cursor is not None:
+		newer_url = url_for('blog_overview', after=posts.previous_cursor)
+	return render_template("blog_overview.html", posts=posts, older_url=older_url, newer_url=newer_url)
 @app.route('/blog/new', methods=["GET", "POST"])
 @require_auth(levels.blog)
 def blog_new_post():
@@ -206,7 +548,16 @@ def blog_new_post():
 	flash("Post blogged!")
 	return redirect(url_for('blog_post_profile', post_id=new_post.id))
 
+def post_validator(post_id):
+	row = db.session.query(BlogPost.version, BlogPost.public).filter(BlogPost.id == post_id).first()
+	if row is None or not (row.public or has_auth(levels.blog)):
+		return None
+	# the rendered contents change with the renderer
+	return [row.version, renderer_version]
+
 @app.route('/blog/<post_id>')
+@conditional(post_validator)
+@cached_page
 def blog_post_profile(post_id):
 	post = BlogPost.query.get(post_id)
 	if not post or not (post.public or has_auth(levels.blog)):
@@ -224,13 +575,52 @@ def blog_edit_post(post_id):
 	if request.method == "GET":
 		return render_template('blog_edit_post.html', post=post)
 
+	try:
+		# the version of the post the editor started with
+		version = int(request.form['version'])
+	except (KeyError, ValueError):
+		version = None
 	# TODO: genericize this whole construction for new/edit
 	# TODO: genericize this whole construction for other objects
-	post.title = request.form.get('title', post.title)
-	post.contents = request.form.get('contents', post.contents)
-	post.public = bool(request.form.getlist('public'))
-	post.last_updated = datetime.now()
-	db.session.add(post)
-	db.session.commit()
+	def edit_post():
+		post = BlogPost.query.get(post_id)
+		if version is not None and post.version != version:
+			return None
+		post.title = request.form.get('title', post.title)
+		post.contents = request.form.get('contents', post.contents)
+		post.public = bool(request.form.getlist('public'))
+		post.last_updated = datetime.now()
+		return post
+	edited = commit_with_retries(edit_post)
+	fragments.invalidate('blog_post', post_id)
+	if edited is None:
+		# let the editor merge their changes instead of overwriting the other ones
+		flash("Someone else edited this post in the meantime. Your version is below, check it and save again.")
+		draft = {
+			'title': request.form.get('title', post.title),
+			'contents': request.form.get('contents', post.contents),
+			'public': bool(request.form.getlist('public')),
+		}
+		return render_template('blog_edit_post.html', post=post, draft=draft), 409
 	flash("Your post has been updated!")
-	return redirect(url_for('blog_post_profile', post_id=post.id))
+	return redirect(url_for('blog_post_profile', post_id=edited.id))
+
+@app.route('/blog/<post_id>/revisions')
+@require_auth(levels.blog)
+def blog_post_revisions(post_id):
+	post = BlogPost.query.get_or_404(post_id)
+	return render_template('blog_revisions.html', post=post, revisions=post_revisions(post.id))
+
+@app.route('/blog/<post_id>/revisions/<int:number>')
+@require_auth(levels.blog)
+def blog_revision_diff(post_id, number):
+	"""Show what changed in the contents between revision `against` (by default the one before) and this revision."""
+	post = BlogPost.query.get_or_404(post_id)
+	against = request.args.get('against', number - 1, type=int)
+	new = revision_contents(post.id, number)
+	old = revision_contents(post.id, against) if against >= 1 else ""
+	if new is None or old is None:
+		return abort(404)
+	diff = list(unified_diff(old.splitlines(), new.splitlines(),
+			"revision {}".format(against), "revision {}".format(number), lineterm=""))
+	return render_template('blog_revision_diff.html', post=post, number=number, against=against, diff=diff)
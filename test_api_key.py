@@ -1,9 +1,12 @@
 from flask import session
 
 import base_test
-from test_login import login
+from test_login import ensure_logged_in, login, logout
 
-from pyserv.auth import has_auth
+from pyserv.apikey import APIKey, _key_cache, digest_secret, get_key_owner_id
+from pyserv.auth import has_auth, levels
+from pyserv.database import db
+from pyserv.person import get_logged_in
 
 def create_key(client):
 	return client.post('/service/api_key/create',
@@ -24,4 +27,84 @@ def test_make_api_key(client, test_user):
 	test = test_user()
 	assert b'You were logged in' in login(client, test.nickname, "").data
 	response = create_key(client)
+	base_test.check_response(response)
 	assert b'Created key' in response.data
+	assert 'no-store' in response.headers['Cache-Control']
+	# the secret is only in the response, not in the session
+	assert '_flashes' not in session
+	key = APIKey.query.filter_by(owner_id=test.id).one()
+	secret = response.data.decode('utf-8').split('<code class="api_key_secret">')[1].split('</code>')[0]
+	assert digest_secret(secret) == key.digest
+
+def bearer(key):
+	return {'Authorization': 'Bearer {}'.format(key.secret)}
+
+def test_key_authenticates(client, test_user):
+	"""Sending the key in the Authorization header logs you in as its owner, but not with no_key."""
+	test = test_user()
+	key = APIKey(test)
+	db.session.add(key)
+	db.session.commit()
+
+	base_test.check_response(client.get('/', headers=bearer(key)))
+	assert has_auth(levels.logged_in)
+	assert not has_auth(levels.no_key)
+	assert get_logged_in() == test
+	# and keys can't be used to manage keys
+	base_test.check_response(client.get('/service/api_key', headers=bearer(key)), expected=403)
+
+def test_god_key_no_key(client, god_user):
+	"""A god's key gives every level except no_key, so it can't make more keys."""
+	key = APIKey(god_user())
+	db.session.add(key)
+	db.session.commit()
+	key_id = key.id
+	headers = bearer(key)
+
+	base_test.check_response(client.get('/', headers=headers))
+	assert has_auth(levels.god)
+	assert not has_auth(levels.no_key)
+	base_test.check_response(client.get('/service/api_key', headers=headers), expected=403)
+	base_test.check_response(client.post('/service/api_key/create', headers=headers), expected=403)
+	assert APIKey.query.filter_by(owner_id=APIKey.query.get(key_id).owner_id).count() == 1
+
+def test_only_digest_stored(client, test_user):
+	"""The database only knows the digest of the secret."""
+	key = APIKey(test_user())
+	db.session.add(key)
+	db.session.commit()
+	key_id, secret = key.id, key.secret
+	db.session.expunge_all()
+	loaded = APIKey.query.get(key_id)
+	assert loaded.digest == digest_secret(secret)
+	assert secret.encode('ascii') not in loaded.digest
+
+def test_revoked_key(client, test_user):
+	"""A revoked key doesn't give any auth."""
+	test = test_user()
+	key = APIKey(test)
+	db.session.add(key)
+	db.session.commit()
+	key_id, headers = key.id, bearer(key)
+	base_test.check_response(client.get('/', headers=headers))
+	assert has_auth(levels.logged_in)
+
+	ensure_logged_in(client, test)
+	base_test.check_response(client.post('/service/api_key/{}/revoke'.format(key_id), follow_redirects=True))
+	logout(client)
+
+	base_test.check_response(client.get('/', headers=headers))
+	assert not has_auth(levels.logged_in)
+
+def test_key_cache_lru(client, test_user, monkeypatch):
+	"""When the cache of keys is full, only the least recently used key is forgotten."""
+	monkeypatch.setattr(_key_cache, 'size', 2)
+	_key_cache.clear()
+	keys = [APIKey(test_user()) for i in range(3)]
+	db.session.add_all(keys)
+	db.session.commit()
+	get_key_owner_id(keys[0].secret)
+	get_key_owner_id(keys[1].secret)
+	get_key_owner_id(keys[0].secret)
+	get_key_owner_id(keys[2].secret)
+	assert _key_cache.keys() == [keys[0].digest, keys[2].digest]
@@ -0,0 +1,38 @@
+from gzip import decompress
+
+import base_test
+
+from pyserv.assets import manifest
+
+def test_hashed_stylesheet(client):
+	"""Pages link to the stylesheet by its hashed name, which can be cached forever."""
+	hashed = manifest['style/base.css']
+	assert hashed != 'style/base.css'
+	response = client.get('/')
+	base_test.check_response(response)
+	assert '/static/{}'.format(hashed).encode('utf-8') in response.data
+
+	response = client.get('/static/{}'.format(hashed))
+	base_test.check_response(response)
+	assert response.mimetype == 'text/css'
+	assert 'immutable' in response.headers['Cache-Control']
+	assert 'Content-Encoding' not in response.headers
+	with open('static/style/base.css', 'rb') as stylesheet:
+		assert response.data == stylesheet.read()
+
+def test_compressed_stylesheet(client):
+	"""Browsers that accept gzip get the compressed copy."""
+	plain = client.get('/static/{}'.format(manifest['style/base.css'])).data
+	response = client.get('/static/{}'.format(manifest['style/base.css']), headers={'Accept-Encoding': 'gzip, deflate'})
+	base_test.check_response(response)
+	assert response.headers['Content-Encoding'] == 'gzip'
+	assert 'Accept-Encoding' in response.headers['Vary']
+	assert decompress(response.data) == plain
+
+def test_unhashed_static(client):
+	"""The plain names still work, but aren't cached forever, and other files don't exist."""
+	response = client.get('/static/style/base.css')
+	base_test.check_response(response)
+	assert 'immutable' not in response.headers.get('Cache-Control', '')
+	base_test.check_response(client.get('/static/style/nonexistent.css'), 404)
+	base_test.check_response(client.get('/static/../pyserv/config.py'), 404)
@@ -1,6 +1,12 @@
+from flask import session
+
 import base_test
 
-from pyserv.auth import has_auth, levels
+from pyserv.app import app
+from pyserv.auth import AuthGrant, auth_mask, grant_config_gods, grant_level, has_auth, level_mask, levels, revoke_level
+from pyserv.database import VersionStamp, bump_version, db, get_version
+import pyserv.config
+from pyserv.person import get_auth_context
 
 def test_any_auth(client, test_user):
 	"""Sanity check: any user has the auth level `any`."""
@@ -16,3 +22,68 @@ def test_god_auth(client, god_user):
 	user = god_user()
 	for level in levels:
 		assert has_auth(level, user)
+
+def test_auth_mask(client, test_user):
+	"""The auth mask has exactly the bits of the levels the user has."""
+	user = test_user()
+	mask = auth_mask(user)
+	for level in levels:
+		assert bool(mask & level_mask(level)) == has_auth(level, user)
+	assert mask & level_mask(levels.any, levels.logged_in) == level_mask(levels.any, levels.logged_in)
+	assert not mask & level_mask(levels.god)
+	assert auth_mask(None) == level_mask(levels.any)
+
+def test_context_follows_session(client, test_user):
+	"""Changing the session halfway through a request gives a fresh context, even without forget_auth_context."""
+	user = test_user()
+	with app.test_request_context():
+		assert not has_auth(levels.logged_in)
+		session['current_user'] = user.id
+		assert get_auth_context().user_id == user.id
+		assert has_auth(levels.logged_in)
+		del session['current_user']
+		assert not has_auth(levels.logged_in)
+
+def test_grant_blog(client, test_user):
+	"""Granting a level gives it to the user, and revoking it takes it away again."""
+	user = test_user()
+	assert not has_auth(levels.blog, user)
+	grant_level(user, levels.blog)
+	db.session.commit()
+	assert has_auth(levels.blog, user)
+	assert not has_auth(levels.god, user)
+	revoke_level(user, levels.blog)
+	db.session.commit()
+	assert not has_auth(levels.blog, user)
+
+def test_grants_from_other_process(client, test_user):
+	"""Changing the grants in the database reaches our cache once the version stamp changes."""
+	user = test_user()
+	assert not has_auth(levels.blog, user)
+	# pretend another process granted the level, without touching our cache
+	db.session.add(AuthGrant(user, levels.blog))
+	db.session.commit()
+	assert not has_auth(levels.blog, user)
+	bump_version('auth_grants')
+	db.session.commit()
+	assert has_auth(levels.blog, user)
+
+def test_config_gods(client, test_user, monkeypatch):
+	"""Users in the old config.god_ids become gods, once."""
+	user = test_user()
+	monkeypatch.setattr(pyserv.config, 'god_ids', {user.id, -1}, raising=False)
+	assert grant_config_gods() == 1
+	assert has_auth(levels.god, user)
+	assert grant_config_gods() == 0
+
+def test_new_version_stamp():
+	"""Stamps that weren't registered get a row when they are first bumped."""
+	name = 'test_new_version_stamp'
+	VersionStamp.query.filter_by(name=name).delete()
+	db.session.commit()
+	bump_version(name)
+	bump_version(name)
+	db.session.commit()
+	assert get_version(name) == 2
+	# while the registered ones have their row from the start
+	assert VersionStamp.query.get('auth_grants') is not None
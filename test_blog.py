@@ -1,10 +1,12 @@
-from datetime import datetime
+from datetime import datetime, timedelta
 from uuid import uuid4
 
 import base_test
 
-from pyserv.database import db
-from pyserv.blog import BlogPost, all_posts
+from pyserv.database import db, encode_cursor
+from pyserv.blog import BlogPost, all_posts, backfill_excerpts, excerpt_length, make_excerpt
+from pyserv.markup import render, renderer_version
+from pyserv.page_cache import pages
 
 from test_login import ensure_logged_in
 
@@ -142,3 +144,142 @@ def test_editing_updates_values(client, blog_user):
 	# and check that it has changed
 	updated_post = BlogPost.query.get(post.id)
 	assert updated_post.last_updated >= before_update
+
+def test_concurrent_edit(client, blog_user):
+	"""Saving an edit of an old version of a post doesn't overwrite the newer version."""
+	post = make_new_post()
+	post_id, title, old_version = post.id, post.title, post.version
+	author = blog_user()
+	base_test.check_response(ensure_logged_in(client, author))
+	response = client.get('/blog/{}/edit'.format(post_id))
+	assert 'name="version" value="{}"'.format(old_version).encode('utf-8') in response.data
+
+	response = client.post('/blog/{}/edit'.format(post_id), data={
+		"title": title, "contents": "first", "version": old_version,
+	})
+	base_test.check_response(response, expected=302)
+	response = client.post('/blog/{}/edit'.format(post_id), data={
+		"title": title, "contents": "second", "version": old_version,
+	})
+	base_test.check_response(response, expected=409)
+	assert b'second' in response.data
+	assert 'name="version" value="{}"'.format(old_version + 1).encode('utf-8') in response.data
+	assert BlogPost.query.get(post_id).contents == "first"
+
+def test_post_pages(client):
+	"""Walking through the pages in both directions shows every post once, also if some are posted at the same time."""
+	posted = datetime(1990, 1, 1)
+	posts = [make_new_post(commit_change=False) for i in range(25)]
+	for i, post in enumerate(posts):
+		post.posted = post.last_updated = posted if i % 2 else posted - timedelta(days=i)
+	db.session.add_all(posts)
+	db.session.commit()
+	expected = sorted(posts, key=lambda post: (post.posted, post.id), reverse=True)
+
+	# start right after the posts of the other tests
+	page = all_posts(count=10, user=None, before=encode_cursor([datetime(1990, 1, 2).isoformat(), 0]))
+	pages = [page]
+	while page.next_cursor is not None:
+		page = all_posts(count=10, user=None, before=page.next_cursor)
+		pages.append(page)
+	assert [len(page) for page in pages] == [10, 10, 5]
+	assert [post for page in pages for post in page] == expected
+
+	assert all_posts(count=10, user=None, after=pages[2].previous_cursor) == pages[1]
+	assert all_posts(count=10, user=None, after=pages[1].previous_cursor) == pages[0]
+
+	response = client.get('/blog?before={}'.format(pages[0].next_cursor))
+	base_test.check_response(response)
+	assert pages[1][0].title.encode('utf-8') in response.data
+	assert b'Older posts' in response.data and b'Newer posts' in response.data
+	base_test.check_response(client.get('/blog?before=nonsense'), expected=400)
+	for cursor in [["2000-01-01T00:00:00", "x"], ["2000-01-01T00:00:00", None]]:
+		base_test.check_response(client.get('/blog', query_string={'before': encode_cursor(cursor)}), expected=400)
+		base_test.check_response(client.get('/blog', query_string={'after': encode_cursor(cursor)}), expected=400)
+
+def test_excerpt():
+	assert make_excerpt(" short\n\tpost ") == "short post"
+	# the excerpt is the text of the HTML, not its markup
+	assert make_excerpt(render("# Title\n\nsome **strong** & *emphasis*\n\n- item")) == "Title some strong & emphasis item"
+	excerpt = make_excerpt("word " * excerpt_length)
+	assert len(excerpt) <= excerpt_length + 1
+	assert excerpt.endswith("word…")
+	assert make_excerpt("x" * (2 * excerpt_length)) == "x" * excerpt_length + "…"
+
+def test_overview_shows_excerpt(client, blog_user):
+	"""The overview doesn't load or show the whole contents of long posts."""
+	contents = " ".join(str(uuid4()) for i in range(50))
+	post = make_new_post(contents=contents)
+	post_id = post.id
+	assert post.excerpt == make_excerpt(contents)
+
+	db.session.expire_all()
+	listed = [post for post in all_posts(count=10, user=None) if post.id == post_id]
+	assert 'contents' not in listed[0].__dict__
+	assert listed[0].excerpt == make_excerpt(contents)
+
+	response = client.get('/blog')
+	assert contents.split()[0].encode('utf-8') in response.data
+	assert contents.split()[-1].encode('utf-8') not in response.data
+	base_test.check_response(ensure_logged_in(client, blog_user()))
+	client.post('/blog/{}/edit'.format(post_id), data={"title": "edited", "contents": "new contents"})
+	assert BlogPost.query.get(post_id).excerpt == "new contents"
+
+def test_backfill_excerpts():
+	post = make_new_post(contents="some contents")
+	post_id = post.id
+	table = BlogPost.__table__
+	db.engine.execute(table.update().where(table.c.id == post_id).values(excerpt=None))
+	assert backfill_excerpts(batch_size=2) >= 1
+	db.session.expire_all()
+	assert BlogPost.query.get(post_id).excerpt == "some contents"
+
+def test_backfilled_sneak_peek(client):
+	"""The overview shows the new excerpt after a backfill, even though the version of the post stays the same."""
+	post = make_new_post(contents="original excerpt {}".format(uuid4()))
+	post_id = post.id
+	pages.clear()
+	assert b"original excerpt" in client.get('/blog').data
+	table = BlogPost.__table__
+	db.engine.execute(table.update().where(table.c.id == post_id).values(contents="backfilled excerpt", html_version=None))
+	backfill_excerpts()
+	pages.clear()
+	assert b"backfilled excerpt" in client.get('/blog').data
+
+def test_rendered_once(client, monkeypatch):
+	"""Posts are rendered when they are saved, and again only after the renderer changes."""
+	post = make_new_post(contents="*new*")
+	post_id, version = post.id, post.version
+	assert (post.html, post.html_version) == ("<p><em>new</em></p>", renderer_version)
+	assert post.excerpt == "new"
+
+	def fail(source):
+		raise AssertionError("rendered while viewing")
+	monkeypatch.setattr('pyserv.blog.render', fail)
+	response = client.get('/blog/{}'.format(post_id))
+	base_test.check_response(response)
+	assert b"<em>new</em>" in response.data
+
+	monkeypatch.undo()
+	monkeypatch.setattr('pyserv.blog.renderer_version', renderer_version + 1)
+	monkeypatch.setattr('pyserv.blog.render', lambda source: "<p>newer</p>")
+	# a new renderer comes with a restart, which empties the page cache
+	pages.clear()
+	response = client.get('/blog/{}'.format(post_id))
+	base_test.check_response(response)
+	assert b"<p>newer</p>" in response.data
+	# the new HTML is stored, without changing the version
+	db.session.expire_all()
+	post = BlogPost.query.get(post_id)
+	assert (post.html, post.html_version, post.version, post.excerpt) == ("<p>newer</p>", renderer_version + 1, version, "newer")
+	monkeypatch.setattr('pyserv.blog.render', fail)
+	pages.clear()
+	base_test.check_response(client.get('/blog/{}'.format(post_id)))
+
+	# or backfill_excerpts renders all posts at once
+	monkeypatch.setattr('pyserv.blog.renderer_version', renderer_version + 2)
+	monkeypatch.setattr('pyserv.blog.render', lambda source: "<p>newest</p>")
+	assert backfill_excerpts() >= 1
+	db.session.expire_all()
+	post = BlogPost.query.get(post_id)
+	assert (post.html, post.html_version, post.version, post.excerpt) == ("<p>newest</p>", renderer_version + 2, version, "newest")
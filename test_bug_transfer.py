@@ -0,0 +1,105 @@
+import json
+from uuid import uuid4
+
+import base_test
+from test_login import login
+
+from pyserv.bug import Bug, BugCheckpoint, BugPriority, BugStatus, bug_as_of, bug_counts, bug_timeline, check_bug_counts, checkpoint_interval
+from pyserv.bug_transfer import _insert_rows, _insert_statements, export_bugs, import_bugs
+from pyserv.database import db
+from pyserv.person import Contact
+from pyserv.duplicates import similar_bugs
+from pyserv.search import search
+
+def bug_line(title, messages, status="Closed", priority="High"):
+	# closed, so the bugs don't show up in the overviews of the other tests
+	return json.dumps({
+		'title': title, 'status': status, 'priority': priority,
+		'messages': [{
+			'type': 'BugUserMessage',
+			'posted': "2001-01-{:02}T12:00:00".format(day % 28 + 1),
+			'new_title': title if day == 0 else None,
+			'new_status': status,
+			'new_priority': priority,
+			'description': "{} message {}".format(title, day),
+		} for day in range(messages)],
+	})
+
+def test_import_bugs():
+	"""Imported bugs get all their messages, counts, checkpoints and search entries."""
+	titles = ["import{}".format(uuid4().hex) for i in range(5)]
+	before = bug_counts()[BugStatus.Closed, BugPriority.High]
+	lines = [bug_line(title, messages) for title, messages in zip(titles, [0, 1, 2, checkpoint_interval, 3])]
+	assert import_bugs(lines + [""], batch_size=2) == 5
+
+	assert bug_counts()[BugStatus.Closed, BugPriority.High] == before + 5
+	assert check_bug_counts() == {}
+	bugs = [Bug.query.filter_by(title=title).one() for title in titles]
+	assert [bug.messages.count() for bug in bugs] == [0, 1, 2, checkpoint_interval, 3]
+	assert BugCheckpoint.query.filter_by(bug_id=bugs[3].id).count() == 1
+	assert bug_as_of(bugs[3].id, bugs[3].messages.first().posted).title == titles[3]
+	assert [entry.message.description for entry in bug_timeline(bugs[2])] == [
+		"{} message 1".format(titles[2]), "{} message 0".format(titles[2]),
+	]
+	assert [result.ref for result in search(titles[0], kinds=["bug"], user=None)] == [bugs[0].id]
+	assert [suggestion.bug.id for suggestion in similar_bugs(titles[0])] == [bugs[0].id]
+
+def test_import_invalid_line():
+	"""The batches before an invalid line stay imported, and the error tells which line it was."""
+	title = "import{}".format(uuid4().hex)
+	try:
+		import_bugs([bug_line(title, 1), bug_line(title, 1, status="Unknown")], batch_size=1)
+		assert False, "import should have failed"
+	except ValueError as e:
+		assert "line 2" in str(e)
+	assert Bug.query.filter_by(title=title).count() == 1
+
+def test_insert_rows():
+	"""Rows are inserted in chunks, and only the statement for a full chunk is kept."""
+	table = Contact.__table__
+	prefix = "insert{}".format(uuid4().hex)
+	names = ["{}-{}".format(prefix, i) for i in range(2000)]
+	with db.engine.begin() as connection:
+		_insert_rows(connection, table, [])
+		for count in (1, 7, 1000, 2000):
+			_insert_rows(connection, table, [{'full_name': name, 'type': 'Contact'} for name in names[:count]])
+	assert Contact.query.filter(Contact.full_name.like(prefix + '%')).count() == 1 + 7 + 1000 + 2000
+	assert len([key for key in _insert_statements if key[1] is table]) == 1
+
+def test_export_round_trip():
+	"""Importing an export gives the same bugs and messages."""
+	title = "export{}".format(uuid4().hex)
+	import_bugs([bug_line(title, 3), bug_line(title, 0)])
+	exported = [json.loads(line) for line in export_bugs()]
+	originals = [bug for bug in exported if bug['title'] == title]
+	assert [len(bug['messages']) for bug in originals] == [3, 0]
+
+	import_bugs(json.dumps(bug) for bug in originals)
+	copies = [json.loads(line) for line in export_bugs()
+			if json.loads(line)['title'] == title][2:]
+	for original, copy in zip(originals, copies):
+		assert copy['id'] != original['id']
+		copy['id'] = original['id']
+		assert copy == original
+
+def test_transfer_views(client, god_user, test_user):
+	"""Only gods can import and export."""
+	user = test_user()
+	login(client, user.nickname, "")
+	base_test.check_response(client.get('/service/bug/export'), expected=403)
+	client.get('/service/logout')
+
+	god = god_user()
+	login(client, god.nickname, "")
+	title = "view{}".format(uuid4().hex)
+	response = client.post('/service/bug/import?batch_size=1', data=bug_line(title, 2) + "\n" + bug_line(title, 1))
+	base_test.check_response(response)
+	assert json.loads(response.data.decode('utf-8')) == {'imported': 2}
+	response = client.post('/service/bug/import', data="{")
+	base_test.check_response(response, expected=400)
+
+	response = client.get('/service/bug/export')
+	base_test.check_response(response)
+	assert response.mimetype == 'application/x-ndjson'
+	lines = [json.loads(line) for line in response.data.decode('utf-8').splitlines()]
+	assert sum(1 for bug in lines if bug['title'] == title) == 2
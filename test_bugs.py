@@ -1,11 +1,15 @@
+from datetime import date, datetime, timedelta
 from flask import session
+import json
 from random import choice
 from uuid import uuid4
 
 import base_test
 
-from pyserv.bug import Bug, BugPriority, BugStatus, BugUserMessage, new_message
-from pyserv.database import db
+from pyserv.bug import (Bug, BugCheckpoint, BugCount, BugPriority, BugStatus, BugUserMessage,
+		all_bugs_as_of, backfill_bug_trends, bug_as_of, bug_counts, bug_from_user, bug_sort_columns, bug_timeline, bug_trends,
+		check_bug_counts, checkpoint_interval, get_all_bugs, new_message, open_statuses)
+from pyserv.database import commit_with_retries, db, encode_cursor
 
 def test_empty_bug_overview(client):
 	"""Viewing the bug overview with no bugs shouldn't produce an error."""
@@ -115,3 +119,300 @@ def test_bug_reaction(client):
 	assert message.new_title is None
 	assert message.new_priority is None
 	assert message.new_status == status
+
+def test_bug_pages():
+	"""Going through the pages of bugs gives every bug exactly once, in order."""
+	for priority in BugPriority:
+		bug = Bug(title="test{}".format(uuid4()), status=BugStatus.Confirmed, priority=priority)
+		db.session.add(bug)
+	# a bug without title shouldn't stop the pages
+	db.session.add(Bug(title=None, status=BugStatus.Confirmed))
+	db.session.add(Bug(title=None, status=BugStatus.Confirmed))
+	db.session.commit()
+
+	for sort in bug_sort_columns:
+		for descending in (False, True):
+			all_bugs = get_all_bugs(sort=sort, descending=descending)
+			pages = []
+			page = get_all_bugs(sort=sort, descending=descending, count=2)
+			pages.extend(page)
+			while page.next_cursor is not None:
+				page = get_all_bugs(sort=sort, descending=descending, count=2, after=page.next_cursor)
+				assert len(page) <= 2
+				pages.extend(page)
+			assert [bug.id for bug in pages] == [bug.id for bug in all_bugs]
+
+def test_bug_filters(client):
+	"""Filtering the overview only shows the bugs with the given status and priority."""
+	shown = Bug(title="test{}".format(uuid4()), status=BugStatus.Testing, priority=BugPriority.Urgent)
+	hidden = Bug(title="test{}".format(uuid4()), status=BugStatus.Testing, priority=BugPriority.Low)
+	db.session.add(shown)
+	db.session.add(hidden)
+	db.session.commit()
+
+	response = client.get('/service/bug?status=Testing&priority=Urgent&sort=title&order=desc')
+	base_test.check_response(response)
+	assert shown.title.encode('utf-8') in response.data
+	assert hidden.title.encode('utf-8') not in response.data
+
+	response = client.get('/service/bug?status=Testing&count=1')
+	base_test.check_response(response)
+	assert b'Next page' in response.data
+
+	base_test.check_response(client.get('/service/bug?status=Nonexistent'), expected=400)
+	base_test.check_response(client.get('/service/bug?after=invalid'), expected=400)
+	# cursors with values of the wrong type never reach the database
+	for sort, cursor in [('status', ['New', "x"]), ('title', [1, 1]), ('title', ["a", None])]:
+		response = client.get('/service/bug', query_string={'sort': sort, 'after': encode_cursor(cursor)})
+		base_test.check_response(response, expected=400)
+	base_test.check_response(client.get('/service/bug?status=Testing&count=0'))
+	base_test.check_response(client.get('/service/bug?status=Testing&count=-1'))
+
+def test_bug_timeline():
+	"""The timeline gives the messages newest first, with the right previous values across pages."""
+	bug = make_new_bug()
+	titles = [bug.title]
+	for i in range(5):
+		title = "test{}".format(uuid4())
+		titles.append(title)
+		new_message(BugUserMessage, bug, str(uuid4()), title=title, status=bug.status, priority=bug.priority)
+	# a message that doesn't change the title
+	new_message(BugUserMessage, bug, "no change", title=bug.title, status=bug.status, priority=bug.priority)
+	db.session.add(bug)
+	db.session.commit()
+
+	entries = []
+	page = bug_timeline(bug, count=2)
+	entries.extend(page)
+	while page.next_cursor is not None:
+		page = bug_timeline(bug, before=page.next_cursor, count=2)
+		entries.extend(page)
+
+	assert len(entries) == 6
+	assert [entry.message.id for entry in entries] == sorted((entry.message.id for entry in entries), reverse=True)
+	assert entries[0].message.description == "no change"
+	assert entries[0].prev_title == titles[-1]
+	for entry, (prev_title, title) in zip(reversed(entries[1:]), zip(titles[:-1], titles[1:])):
+		assert entry.message.new_title == title
+		# the first message's previous title is unknown, since the bug was made without messages
+		if prev_title != titles[0]:
+			assert entry.prev_title == prev_title
+
+def test_bug_page_older_messages(client):
+	"""The bug profile links to older messages when there are too many."""
+	from pyserv import view
+	bug = make_new_bug()
+	descriptions = [str(uuid4()) for i in range(view.messages_per_page + 1)]
+	for description in descriptions:
+		BugUserMessage(bug, description)
+	db.session.add(bug)
+	db.session.commit()
+
+	response = client.get('/service/bug/{}'.format(bug.id))
+	base_test.check_response(response)
+	assert descriptions[-1].encode('utf-8') in response.data
+	assert descriptions[0].encode('utf-8') not in response.data
+	assert b'Load older messages' in response.data
+	for cursor in [["x"], [None], [1.5]]:
+		response = client.get('/service/bug/{}'.format(bug.id), query_string={'before': encode_cursor(cursor)})
+		base_test.check_response(response, expected=400)
+
+def test_bug_counts(client):
+	"""The bug counts follow new bugs and messages, and agree with counting from scratch."""
+	before = bug_counts()
+	bug = Bug(title="test{}".format(uuid4()), status=BugStatus.New, priority=BugPriority.Urgent)
+	db.session.add(bug)
+	db.session.commit()
+	new_message(BugUserMessage, bug, "", title=bug.title, status=BugStatus.Closed, priority=BugPriority.Low)
+	db.session.add(bug)
+	db.session.commit()
+
+	after = bug_counts()
+	assert after[BugStatus.New, BugPriority.Urgent] == before[BugStatus.New, BugPriority.Urgent]
+	assert after[BugStatus.Closed, BugPriority.Low] == before[BugStatus.Closed, BugPriority.Low] + 1
+	assert check_bug_counts() == {}
+
+	response = client.get('/service/bug/stats/api')
+	base_test.check_response(response)
+	stats = json.loads(response.data.decode('utf-8'))
+	assert stats['open']['Urgent'] == sum(after[status, BugPriority.Urgent] for status in open_statuses)
+
+def test_repair_bug_counts():
+	"""The consistency check notices and repairs counts that drifted."""
+	count = BugCount.query.get((BugStatus.Deployed, BugPriority.Medium))
+	actual = count.count
+	count.count += 3
+	db.session.commit()
+	assert check_bug_counts(repair=True) == {(BugStatus.Deployed, BugPriority.Medium): (actual + 3, actual)}
+	db.session.commit()
+	assert check_bug_counts() == {}
+
+def test_bug_as_of(client):
+	"""The state of a bug in the past is rebuilt correctly from checkpoints and messages."""
+	start = datetime(2000, 1, 1)
+	bug = bug_from_user(title="test{}".format(uuid4()), status=BugStatus.New, priority=BugPriority.Low, description="")
+	for message in bug.messages:
+		message.posted = start
+	titles = [bug.title]
+	for day in range(1, 2 * checkpoint_interval + 5):
+		title = "test{}".format(uuid4())
+		titles.append(title)
+		status = BugStatus.Confirmed if day % 2 else BugStatus.InProgress
+		new_message(BugUserMessage, bug, "", title=title, status=status, priority=bug.priority,
+				posted=start + timedelta(days=day))
+	db.session.add(bug)
+	db.session.commit()
+	assert BugCheckpoint.query.filter_by(bug_id=bug.id).count() == 2
+
+	assert bug_as_of(bug.id, start - timedelta(days=1)) is None
+	for day, title in enumerate(titles):
+		state = bug_as_of(bug.id, start + timedelta(days=day, hours=1))
+		assert state.title == title
+		assert state.priority == BugPriority.Low
+		assert state.status == (BugStatus.New if day == 0 else BugStatus.Confirmed if day % 2 else BugStatus.InProgress)
+
+	when = start + timedelta(days=checkpoint_interval + 3, hours=1)
+	states = all_bugs_as_of(when, statuses=set(BugStatus))
+	assert bug_as_of(bug.id, when) in states
+	assert not any(state.id == bug.id for state in all_bugs_as_of(start - timedelta(days=1), statuses=set(BugStatus)))
+
+	response = client.get('/service/bug/{}?as_of={}'.format(bug.id, when.strftime('%Y-%m-%dT%H:%M')))
+	base_test.check_response(response)
+	assert bug_as_of(bug.id, when).title.encode('utf-8') in response.data
+	response = client.get('/service/bug?as_of=2000-01-02&status=New&status=Confirmed&status=InProgress')
+	base_test.check_response(response)
+	assert titles[1].encode('utf-8') in response.data
+	base_test.check_response(client.get('/service/bug?as_of=yesterday'), expected=400)
+
+def test_bugs_as_of_pages(client, monkeypatch):
+	"""The bugs in the past come in pages by id, also when they are replayed a few at a time."""
+	monkeypatch.setattr('pyserv.bug.as_of_chunk_size', 3)
+	posted = datetime(1990, 1, 1)
+	bug_ids = []
+	for i in range(7):
+		bug = bug_from_user(title="past{}".format(uuid4()), status=BugStatus.Closed, priority=BugPriority.Low, description="")
+		for message in bug.messages:
+			message.posted = posted
+		db.session.add(bug)
+		db.session.commit()
+		bug_ids.append(bug.id)
+	when = posted + timedelta(days=1)
+	assert [state.id for state in all_bugs_as_of(when, statuses=[BugStatus.Closed]) if state.id in bug_ids] == bug_ids
+
+	seen = []
+	after = None
+	while True:
+		page = all_bugs_as_of(when, statuses=[BugStatus.Closed], after=after, count=2)
+		assert len(page) <= 2
+		seen.extend(state.id for state in page if state.id in bug_ids)
+		after = page.next_cursor
+		if after is None:
+			break
+	assert seen == bug_ids
+
+	response = client.get('/service/bug?as_of=1990-01-02&status=Closed&count=2')
+	base_test.check_response(response)
+	assert b'after=' in response.data
+	base_test.check_response(client.get('/service/bug?as_of=1990-01-02&after=nonsense'), expected=400)
+
+def test_checkpoint_by_time(client):
+	"""The state in the past starts from the checkpoint with the latest time, even if it isn't the latest by id."""
+	start = datetime(1991, 1, 1)
+	bug = bug_from_user(title="test{}".format(uuid4()), status=BugStatus.Closed, priority=BugPriority.Low, description="")
+	new_message(BugUserMessage, bug, "")
+	for message in bug.messages:
+		message.posted = start
+	db.session.add(bug)
+	db.session.commit()
+	first, second = sorted(message.id for message in bug.messages)
+	db.session.add(BugCheckpoint(bug_id=bug.id, message_id=second, posted=start + timedelta(days=1),
+			title="earlier", status=BugStatus.Closed, priority=BugPriority.Low))
+	db.session.add(BugCheckpoint(bug_id=bug.id, message_id=first, posted=start + timedelta(days=2),
+			title="later", status=BugStatus.Closed, priority=BugPriority.Low))
+	db.session.commit()
+
+	when = start + timedelta(days=3)
+	assert bug_as_of(bug.id, when).title == "later"
+	states = all_bugs_as_of(when, statuses=[BugStatus.Closed])
+	assert [state.title for state in states if state.id == bug.id] == ["later"]
+
+def change_elsewhere(bug, **values):
+	"""Change the bug like another process would, without our session noticing."""
+	table = Bug.__table__
+	db.engine.execute(table.update().where(table.c.id == bug.id).values(version=table.c.version + 1, **values))
+
+def test_concurrent_bug_change():
+	"""Committing over a change made in the meantime starts over instead of overwriting it."""
+	bug = make_new_bug()
+	bug_id = bug.id
+	attempts = []
+	def change():
+		bug = Bug.query.get(bug_id)
+		if not attempts:
+			change_elsewhere(bug, title="changed elsewhere")
+		attempts.append(bug.title)
+		return new_message(BugUserMessage, bug, "", priority=BugPriority.Urgent)
+	commit_with_retries(change)
+	assert len(attempts) == 2
+	bug = Bug.query.get(bug_id)
+	assert bug.title == "changed elsewhere"
+	assert bug.priority == BugPriority.Urgent
+
+def test_rebase_bug_message(client):
+	"""Only the fields that the poster changed are changed, and conflicting changes are kept."""
+	bug = bug_from_user(title="test{}".format(uuid4()), status=BugStatus.New, priority=BugPriority.Low, description="")
+	db.session.add(bug)
+	db.session.commit()
+	bug_id, title = bug.id, bug.title
+	seen = {'seen_title': title, 'seen_status': 'New', 'seen_priority': 'Low'}
+	change_elsewhere(bug, status=BugStatus.Confirmed)
+
+	response = client.post('/service/bug/{}/message'.format(bug_id), data=dict(seen,
+		title=title, status='New', priority='High', description="higher",
+	), follow_redirects=True)
+	base_test.check_response(response)
+	assert b'not applied' not in response.data
+	bug = Bug.query.get(bug_id)
+	assert (bug.status, bug.priority) == (BugStatus.Confirmed, BugPriority.High)
+
+	response = client.post('/service/bug/{}/message'.format(bug_id), data=dict(seen,
+		title=title, status='InProgress', priority='Low', description="working on it",
+	), follow_redirects=True)
+	base_test.check_response(response)
+	assert b'the status in the meantime' in response.data
+	bug = Bug.query.get(bug_id)
+	assert (bug.status, bug.priority) == (BugStatus.Confirmed, BugPriority.High)
+
+def test_bug_trends(client):
+	"""Opening, moving and closing a bug shows up in the trends of the days it happened."""
+	bug = bug_from_user(title="test{}".format(uuid4()), status=BugStatus.New, priority=BugPriority.Medium, description="")
+	for message in bug.messages:
+		message.posted = datetime(1990, 1, 1, 12)
+	db.session.add(bug)
+	db.session.commit()
+	new_message(BugUserMessage, bug, "", priority=BugPriority.High, posted=datetime(1990, 1, 2, 12))
+	db.session.commit()
+	new_message(BugUserMessage, bug, "", status=BugStatus.Closed, posted=datetime(1990, 1, 4, 12))
+	db.session.commit()
+
+	def check_trends():
+		trends = bug_trends(date(1989, 12, 31), date(1990, 1, 5))
+		assert [day for day, trend in trends] == [date(1989, 12, 31) + timedelta(days=i) for i in range(6)]
+		medium = [trend[BugPriority.Medium] for day, trend in trends]
+		high = [trend[BugPriority.High] for day, trend in trends]
+		assert [trend.open for trend in medium] == [0, 1, 0, 0, 0, 0]
+		assert [trend.opened for trend in medium] == [0, 1, 0, 0, 0, 0]
+		assert [trend.open for trend in high] == [0, 0, 1, 1, 0, 0]
+		assert [trend.closed for trend in high] == [0, 0, 0, 0, 1, 0]
+	check_trends()
+	assert backfill_bug_trends() > 0
+	check_trends()
+
+	response = client.get('/service/bug/trends/api?start=1990-01-01&end=1990-01-02')
+	base_test.check_response(response)
+	days = json.loads(response.data.decode('utf-8'))['days']
+	assert [day['day'] for day in days] == ['1990-01-01', '1990-01-02']
+	assert days[1]['priorities']['High'] == {'open': 1, 'opened': 0, 'closed': 0}
+	base_test.check_response(client.get('/service/bug/trends/api'))
+	base_test.check_response(client.get('/service/bug/trends/api?start=1990-01-02&end=1990-01-01'), expected=400)
+	base_test.check_response(client.get('/service/bug/trends/api?start=yesterday'), expected=400)
@@ -0,0 +1,119 @@
+from gzip import decompress
+import zlib
+
+import base_test
+
+from pyserv.assets import manifest
+from pyserv.compression import CompressionStats, GzipMiddleware
+
+from test_login import login
+
+def run(app, accept_encoding='gzip', method='GET'):
+	"""Call the WSGI app through a GzipMiddleware, returning the headers and the iterable body."""
+	started = []
+	def start_response(status, headers, exc_info=None):
+		started.append(dict(headers))
+	body = GzipMiddleware(app, minimum_size=100, level=6, stats=CompressionStats())(
+			{'REQUEST_METHOD': method, 'HTTP_ACCEPT_ENCODING': accept_encoding}, start_response)
+	return started, body
+
+def text_app(chunks, content_type='text/html', length=True):
+	def app(environ, start_response):
+		headers = [('Content-Type', content_type)]
+		if length:
+			headers.append(('Content-Length', str(sum(len(chunk) for chunk in chunks))))
+		start_response('200 OK', headers)
+		return chunks
+	return app
+
+def test_compress_small_and_large():
+	"""Only responses of at least the minimum size are compressed."""
+	started, body = run(text_app([b"small"]))
+	assert b"".join(body) == b"small"
+	assert 'Content-Encoding' not in started[0]
+
+	started, body = run(text_app([b"large " * 100]))
+	assert decompress(b"".join(body)) == b"large " * 100
+	assert started[0]['Content-Encoding'] == 'gzip'
+	assert 'Content-Length' not in started[0]
+
+	started, body = run(text_app([b"large " * 100]), accept_encoding='gzip;q=0')
+	assert b"".join(body) == b"large " * 100
+	assert 'Content-Encoding' not in started[0]
+
+def test_vary():
+	"""Responses that could be compressed vary on Accept-Encoding, even if they aren't compressed this time."""
+	for accept_encoding, method in [('gzip', 'GET'), ('identity', 'GET'), ('gzip', 'HEAD')]:
+		started, body = run(text_app([b"large " * 100]), accept_encoding=accept_encoding, method=method)
+		b"".join(body)
+		assert started[0]['Vary'] == 'Accept-Encoding'
+	started, body = run(text_app([b"large " * 100]), method='HEAD')
+	assert b"".join(body) == b"large " * 100
+	assert 'Content-Encoding' not in started[0]
+
+	started, body = run(text_app([b"small"]))
+	b"".join(body)
+	assert 'Vary' not in started[0]
+	started, body = run(text_app([b"\x89PNG" * 100], content_type='image/png'), accept_encoding='identity')
+	b"".join(body)
+	assert 'Vary' not in started[0]
+
+def test_write_callable():
+	"""Data given to the write callable comes before the body, compressed or not."""
+	def writing_app(environ, start_response):
+		write = start_response('200 OK', [('Content-Type', 'text/plain')])
+		write(b"written " * 20)
+		return [b"returned " * 20]
+	started, body = run(writing_app)
+	assert decompress(b"".join(body)) == b"written " * 20 + b"returned " * 20
+	started, body = run(writing_app, accept_encoding='identity')
+	assert b"".join(body) == b"written " * 20 + b"returned " * 20
+
+def test_skip_incompressible():
+	"""Images and content that is compressed already are left alone."""
+	started, body = run(text_app([b"\x89PNG" * 100], content_type='image/png'))
+	assert b"".join(body) == b"\x89PNG" * 100
+
+	def gzipped_app(environ, start_response):
+		start_response('200 OK', [('Content-Type', 'text/css'), ('Content-Encoding', 'gzip')])
+		return [b"x" * 200]
+	started, body = run(gzipped_app)
+	assert b"".join(body) == b"x" * 200
+
+def test_compress_streaming():
+	"""Streamed responses are compressed chunk by chunk, without waiting for the rest."""
+	def streaming_app(environ, start_response):
+		start_response('200 OK', [('Content-Type', 'application/x-ndjson')])
+		for i in range(3):
+			yield "line {}\n".format(i).encode('utf-8') * 20
+	started, body = run(streaming_app)
+	decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+	chunks = iter(body)
+	# the first compressed chunk can be decompressed on its own
+	assert decompressor.decompress(next(chunks)) == b"line 0\n" * 20
+	assert started[0]['Content-Encoding'] == 'gzip'
+	rest = b"".join(decompressor.decompress(chunk) for chunk in chunks) + decompressor.flush()
+	assert rest == b"line 1\n" * 20 + b"line 2\n" * 20
+
+	started, body = run(text_app([b"short ", b"stream"], length=False))
+	assert b"".join(body) == b"short stream"
+	assert 'Content-Encoding' not in started[0]
+
+def test_compressed_pages(client, god_user):
+	"""Pages are compressed, the precompressed static files aren't compressed again."""
+	response = client.get('/service/bug?status=Closed&count=100', headers={'Accept-Encoding': 'gzip'})
+	base_test.check_response(response)
+	assert response.headers['Content-Encoding'] == 'gzip'
+	assert b"</html>" in decompress(response.data)
+
+	response = client.get('/static/{}'.format(manifest['style/base.css']), headers={'Accept-Encoding': 'gzip'})
+	with open('static/style/base.css', 'rb') as stylesheet:
+		assert decompress(response.data) == stylesheet.read()
+
+	god = god_user()
+	login(client, god.nickname, "")
+	response = client.get('/service/stats/compression')
+	base_test.check_response(response)
+	stats = response.get_json()['compression']
+	assert stats['responses'] >= 1
+	assert 0 < stats['ratio'] < 1
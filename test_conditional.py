@@ -0,0 +1,97 @@
+import os
+from uuid import uuid4
+
+import base_test
+
+from pyserv.bug import Bug, BugStatus, BugUserMessage, new_message
+from pyserv.conditional import site_version
+import pyserv.conditional
+from pyserv.database import db
+
+from test_blog import make_new_post
+from test_login import ensure_logged_in
+
+def no_rendering(*args, **kwargs):
+	raise AssertionError("rendered a template")
+
+def test_post_not_modified(client, monkeypatch):
+	"""Asking for a blog post with its ETag gives a 304, until the post changes."""
+	post = make_new_post()
+	url = '/blog/{}'.format(post.id)
+	response = client.get(url)
+	base_test.check_response(response)
+	etag = response.headers['ETag']
+	# a time can't tell that someone logged in or that the site changed
+	assert 'Last-Modified' not in response.headers
+	assert etag.startswith('W/')
+	assert 'no-cache' in response.headers['Cache-Control']
+
+	with monkeypatch.context() as patch:
+		patch.setattr('pyserv.view.render_template', no_rendering)
+		response = client.get(url, headers={'If-None-Match': etag})
+		base_test.check_response(response, 304)
+		assert response.headers['ETag'] == etag
+		base_test.check_response(client.get(url, headers={'If-Modified-Since': 'Fri, 01 Jan 2100 00:00:00 GMT'}))
+
+	post = db.session.merge(post)
+	post.title = "changed{}".format(uuid4())
+	db.session.commit()
+	response = client.get(url, headers={'If-None-Match': etag})
+	base_test.check_response(response)
+	assert response.headers['ETag'] != etag
+
+def test_private_post_no_etag(client):
+	"""Errors don't get validators."""
+	post = make_new_post(public=False)
+	response = client.get('/blog/{}'.format(post.id))
+	base_test.check_response(response, 403)
+	assert 'ETag' not in response.headers
+
+def test_bug_not_modified(client, test_user):
+	"""The ETag of a bug changes with new messages, and differs between visitors."""
+	bug = Bug(title="etag{}".format(uuid4()), status=BugStatus.Closed)
+	db.session.add(bug)
+	db.session.commit()
+	bug_id = bug.id
+	url = '/service/bug/{}'.format(bug_id)
+	etag = client.get(url).headers['ETag']
+	base_test.check_response(client.get(url, headers={'If-None-Match': etag}), 304)
+
+	new_message(BugUserMessage, Bug.query.get(bug_id), "nothing changes")
+	db.session.commit()
+	new_etag = client.get(url).headers['ETag']
+	assert new_etag != etag
+
+	ensure_logged_in(client, test_user())
+	response = client.get(url, headers={'If-None-Match': new_etag})
+	base_test.check_response(response)
+	assert 'private' in response.headers['Cache-Control']
+
+def test_json_not_modified(client):
+	"""The JSON endpoints give a 304 too."""
+	response = client.get('/service/bug/stats/api')
+	base_test.check_response(response)
+	base_test.check_response(client.get('/service/bug/stats/api', headers={'If-None-Match': response.headers['ETag']}), 304)
+
+def test_search_not_modified(client, test_user):
+	"""Searching with GET gives a 304, until something that can be found changes."""
+	url = '/service/search/api?term=etag'
+	response = client.get(url)
+	base_test.check_response(response)
+	etag = response.headers['ETag']
+	base_test.check_response(client.get(url, headers={'If-None-Match': etag}), 304)
+
+	test_user()
+	base_test.check_response(client.get(url, headers={'If-None-Match': etag}))
+
+def test_site_version_contents(monkeypatch):
+	"""Only changing the contents of the code changes the site version, not touching it."""
+	version = site_version()
+	path = pyserv.conditional.__file__
+	stat = os.stat(path)
+	try:
+		os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+		monkeypatch.setattr('pyserv.conditional._site_version', None)
+		assert site_version() == version
+	finally:
+		os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns))
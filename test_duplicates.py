@@ -0,0 +1,69 @@
+import json
+from uuid import uuid4
+
+import base_test
+
+from pyserv.bug import BugPriority, BugStatus, BugUserMessage, bug_from_user, new_message
+from pyserv.database import db
+from pyserv.duplicates import signature, similar_bugs, similarity, trigrams
+
+def report(title, description=""):
+	bug = bug_from_user(title=title, status=BugStatus.Closed, priority=BugPriority.Low, description=description)
+	db.session.add(bug)
+	db.session.commit()
+	return bug
+
+def unique_words():
+	return " ".join(uuid4().hex[:8] for i in range(4))
+
+def test_trigrams():
+	assert trigrams("Ab, c!") == {"  a", " ab", "ab ", "  c", " c "}
+	assert trigrams(None) == set()
+	assert signature("") is None
+
+def test_signature_similarity():
+	"""Signatures of similar texts are similar, and of different texts are not."""
+	words = unique_words()
+	assert similarity(signature(words), signature(words)) == 1
+	assert similarity(signature(words), signature(" ".join(reversed(words.split())))) == 1
+	assert similarity(signature(words), signature(unique_words())) < 0.3
+
+def test_suggest_duplicates():
+	"""Reports with mostly the same words are suggested, others aren't."""
+	words = unique_words()
+	bug = report(words, description="crashes on " + words)
+	other = report(unique_words())
+	suggestions = similar_bugs(" ".join(words.split()[1:]))
+	assert [suggestion.bug.id for suggestion in suggestions] == [bug.id]
+	assert 0.3 <= suggestions[0].score <= 1
+	assert similar_bugs(words, description="crashes on " + words)[0].score == 1
+
+def test_renamed_bug():
+	"""Changing the title of a bug changes what it is similar to."""
+	old_title = unique_words()
+	new_title = unique_words()
+	bug = report(old_title)
+	new_message(BugUserMessage, bug, "", title=new_title)
+	db.session.commit()
+	assert bug.id not in [suggestion.bug.id for suggestion in similar_bugs(old_title)]
+	assert bug.id in [suggestion.bug.id for suggestion in similar_bugs(new_title)]
+
+def test_duplicates_api(client):
+	words = unique_words()
+	bug = report(words)
+	response = client.get('/service/bug/duplicates/api', query_string={'title': words})
+	base_test.check_response(response)
+	suggestions = json.loads(response.data.decode('utf-8'))['suggestions']
+	assert [suggestion['id'] for suggestion in suggestions] == [bug.id]
+	assert suggestions[0]['url'] == '/service/bug/{}'.format(bug.id)
+	base_test.check_response(client.get('/service/bug/duplicates/api?count=many'), expected=400)
+	# a negative count doesn't slice off only the last few suggestions
+	for count in (-3, 0):
+		response = client.get('/service/bug/duplicates/api', query_string={'title': words, 'count': count})
+		base_test.check_response(response)
+		assert len(json.loads(response.data.decode('utf-8'))['suggestions']) == 1
+
+def test_form_asks_for_duplicates(client):
+	response = client.get('/service/bug/new')
+	base_test.check_response(response)
+	assert b'/service/bug/duplicates/api' in response.data
@@ -0,0 +1,72 @@
+from uuid import uuid4
+
+import base_test
+
+from pyserv.bug import Bug, BugStatus
+from pyserv.database import db
+from pyserv.fragment import FragmentCache, fragments
+from pyserv.page_cache import pages
+
+from test_login import login
+
+def test_fragment_lru():
+	"""The least recently used fragments are evicted first, and each is rendered once while it is cached."""
+	cache = FragmentCache(2)
+	renders = []
+	def render(html):
+		def do_render():
+			renders.append(html)
+			return html
+		return do_render
+
+	assert cache.get_or_render(('bug', 1, 1, 'public'), render("one")) == "one"
+	assert cache.get_or_render(('bug', 2, 1, 'public'), render("two")) == "two"
+	assert cache.get_or_render(('bug', 1, 1, 'public'), render("other")) == "one"
+	cache.get_or_render(('bug', 3, 1, 'public'), render("three"))
+	# bug 2 was used longest ago
+	assert cache.get_or_render(('bug', 2, 1, 'public'), render("two again")) == "two again"
+	assert renders == ["one", "two", "three", "two again"]
+	assert cache.stats() == {'size': 2, 'fragments': 2, 'hits': 1, 'misses': 4, 'evictions': 2}
+
+def test_fragment_invalidate():
+	"""Invalidating an object forgets all of its fragments, but not those of other objects."""
+	cache = FragmentCache(10)
+	cache.get_or_render(('blog_post', 1, 1, 'public'), lambda: "public")
+	cache.get_or_render(('blog_post', 1, 1, 'blog'), lambda: "blog")
+	cache.get_or_render(('blog_post', 2, 1, 'public'), lambda: "other")
+	cache.invalidate('blog_post', "1")
+	assert cache.get_or_render(('blog_post', 1, 1, 'public'), lambda: "new") == "new"
+	assert cache.get_or_render(('blog_post', 2, 1, 'public'), lambda: "new") == "other"
+
+def test_cached_bug_rows(client, god_user):
+	"""Bug rows come from the cache the second time, and show the changes after a message."""
+	bug = Bug(title="fragment{}".format(uuid4()), status=BugStatus.Closed)
+	db.session.add(bug)
+	db.session.commit()
+	bug_id = bug.id
+	old_title = bug.title
+
+	response = client.get('/service/bug?status=Closed&count=100')
+	base_test.check_response(response)
+	assert old_title.encode('utf-8') in response.data
+	hits = fragments.hits
+	# anonymous visitors would get the whole page from the page cache
+	pages.clear()
+	base_test.check_response(client.get('/service/bug?status=Closed&count=100'))
+	assert fragments.hits > hits
+
+	new_title = "fragment{}".format(uuid4())
+	response = client.post('/service/bug/{}/message'.format(bug_id), data={
+		'title': new_title, 'status': 'Closed', 'priority': 'Low', 'description': "",
+	}, follow_redirects=True)
+	base_test.check_response(response)
+	response = client.get('/service/bug?status=Closed&count=100')
+	assert new_title.encode('utf-8') in response.data
+	assert old_title.encode('utf-8') not in response.data
+
+	base_test.check_response(client.get('/service/stats/cache'), expected=403)
+	god = god_user()
+	login(client, god.nickname, "")
+	response = client.get('/service/stats/cache')
+	base_test.check_response(response)
+	assert response.get_json()['fragments']['hits'] == fragments.hits
@@ -11,3 +11,13 @@ def test_blog_escapes(client):
 	response = client.get('/blog')
 	base_test.check_response(response)
 	assert "<marquee>".encode('utf-8') not in response.data
+
+def test_blog_contents_escapes(client):
+	"""HTML in the contents of a post is escaped on its page, even though the rendered HTML isn't."""
+	post = make_new_post(contents="<marquee>Whee!</marquee> [click](javascript:alert(1))")
+
+	response = client.get('/blog/{}'.format(post.id))
+	base_test.check_response(response)
+	assert "<marquee>".encode('utf-8') not in response.data
+	assert "javascript:alert(1)".encode('utf-8') in response.data
+	assert 'href="javascript'.encode('utf-8') not in response.data
@@ -1,4 +1,4 @@
-from flask import session
+from flask import g, session
 
 import base_test
 
@@ -57,3 +57,33 @@ def test_login_gives_auth(client):
 	assert has_auth(levels.logged_in)
 	assert b'You were logged out' in logout(client).data
 	assert not has_auth(levels.logged_in)
+
+def test_single_user_lookup(client, test_user):
+	"""However often a page checks auth, the logged in user is only looked up once."""
+	user = test_user()
+	ensure_logged_in(client, user)
+	# this page stacks require_auth and shows the user in the navbar
+	base_test.check_response(client.get('/service/api_key'))
+	assert g.user_lookups == 1
+
+def test_rehash_on_login(client, test_user):
+	"""Logging in upgrades a password hashed with old settings to the ones in the config."""
+	from pyserv import config
+	user = test_user()
+	old_hash = user.password
+	old_algorithm = config.password_algorithm
+	try:
+		config.password_algorithm = 'scrypt'
+		config.password_cost = 2
+		ensure_logged_in(client, user)
+	finally:
+		config.password_algorithm = old_algorithm
+		config.password_cost = 1
+
+	user = User.query.get(user.id)
+	assert user.password_algorithm == 'scrypt'
+	assert user.password_cost == 2
+	assert user.password != old_hash
+	# and you can still log in with the new hash
+	assert get_login(user.nickname, user._actual_password) == user
+	assert get_login(user.nickname, "wrong") is None
@@ -0,0 +1,22 @@
+from pyserv.markup import render
+
+def test_paragraphs():
+	assert render("") == ""
+	assert render("one\ntwo\n\nthree") == "<p>one\ntwo</p>\n<p>three</p>"
+
+def test_blocks():
+	assert render("# Title\n- one\n- two\nafter") == "<h2>Title</h2>\n<ul>\n<li>one</li>\n<li>two</li>\n</ul>\n<p>after</p>"
+	assert render("### Small") == "<h4>Small</h4>"
+	assert render("#hashtag") == "<p>#hashtag</p>"
+
+def test_inline():
+	assert render("**bold** and *emphasis*") == "<p><strong>bold</strong> and <em>emphasis</em></p>"
+	assert render("`*not emphasis* <b>`") == "<p><code>*not emphasis* &lt;b&gt;</code></p>"
+	assert render("[PyServ](https://example.com/a?b=1&c=2)") == '<p><a href="https://example.com/a?b=1&amp;c=2">PyServ</a></p>'
+	assert render("[home](/blog)") == '<p><a href="/blog">home</a></p>'
+
+def test_escapes():
+	"""Nothing in the source can make its own tags or attributes."""
+	assert render("<script>alert(1)</script>") == "<p>&lt;script&gt;alert(1)&lt;/script&gt;</p>"
+	assert "<a" not in render("[click](javascript:alert(1))")
+	assert render('[x](/a"onclick="alert(1))') == '<p><a href="/a&quot;onclick=&quot;alert(1">x</a>)</p>'
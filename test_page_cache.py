@@ -0,0 +1,99 @@
+from threading import Event, Thread
+from uuid import uuid4
+
+import base_test
+
+from pyserv.bug import Bug, BugStatus
+from pyserv.database import db, get_version
+from pyserv.page_cache import CachedPage, PageCache, page_version_name, pages
+
+from test_login import ensure_logged_in
+
+def test_stale_while_revalidate():
+	"""While one thread regenerates an outdated page, the others get the outdated page."""
+	cache = PageCache(10, wait_timeout=5)
+	cache.get_or_render('page', 1, lambda: CachedPage(1, b"old", 'text/html'))
+
+	started = Event()
+	release = Event()
+	def slow_render():
+		started.set()
+		release.wait(5)
+		return CachedPage(2, b"new", 'text/html')
+	results = []
+	filler = Thread(target=lambda: results.append(cache.get_or_render('page', 2, slow_render)))
+	filler.start()
+	started.wait(5)
+
+	def fail():
+		raise AssertionError("rendered twice")
+	assert cache.get_or_render('page', 2, fail).body == b"old"
+	release.set()
+	filler.join()
+	assert results[0].body == b"new"
+	assert cache.get_or_render('page', 2, fail).body == b"new"
+	assert cache.stats()['stale_hits'] == 1
+
+def test_single_fill():
+	"""Visitors of a page that isn't cached yet wait for the first one to render it."""
+	cache = PageCache(10, wait_timeout=5)
+	started = Event()
+	release = Event()
+	renders = []
+	def slow_render():
+		renders.append(1)
+		started.set()
+		release.wait(5)
+		return CachedPage(1, b"page", 'text/html')
+	results = []
+	threads = [Thread(target=lambda: results.append(cache.get_or_render('page', 1, slow_render))) for i in range(5)]
+	threads[0].start()
+	started.wait(5)
+	for thread in threads[1:]:
+		thread.start()
+	release.set()
+	for thread in threads:
+		thread.join()
+	assert len(renders) == 1
+	assert [result.body for result in results] == [b"page"] * 5
+
+def test_bump_after_commit():
+	"""The pages are outdated by committing a change, not by making it or by rolling it back."""
+	version = get_version(page_version_name)
+	db.session.add(Bug(title="rolled back{}".format(uuid4()), status=BugStatus.Closed))
+	db.session.flush()
+	assert get_version(page_version_name) == version
+	db.session.rollback()
+	assert get_version(page_version_name) == version
+
+	db.session.add(Bug(title="committed{}".format(uuid4()), status=BugStatus.Closed))
+	db.session.commit()
+	assert get_version(page_version_name) == version + 1
+
+def test_anonymous_pages(client, test_user):
+	"""Anonymous visitors get the cached page until a bug changes, logged in users never do."""
+	bug = Bug(title="page{}".format(uuid4()), status=BugStatus.Closed)
+	db.session.add(bug)
+	db.session.commit()
+	bug_url = '/service/bug/{}'.format(bug.id)
+
+	base_test.check_response(client.get(bug_url))
+	hits = pages.hits
+	response = client.get(bug_url)
+	base_test.check_response(response)
+	assert pages.hits == hits + 1
+	assert bug.title.encode('utf-8') in response.data
+
+	new_title = "page{}".format(uuid4())
+	client.post(bug_url + '/message', data={'title': new_title, 'description': ""})
+	# the flashed message is only for us, so it isn't cached
+	response = client.get(bug_url)
+	assert b"Message posted!" in response.data
+	response = client.get(bug_url)
+	assert new_title.encode('utf-8') in response.data
+	assert b"Message posted!" not in response.data
+
+	hits = pages.hits
+	ensure_logged_in(client, test_user())
+	base_test.check_response(client.get(bug_url))
+	assert pages.hits == hits
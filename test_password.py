@@ -0,0 +1,27 @@
+import base_test
+
+from pyserv import config
+from pyserv.password import check_password, hash_password
+
+def test_hash_in_pool():
+	"""Hashing in the worker processes gives the same result as hashing on the request thread."""
+	salt = b"salt"
+	inline = hash_password("password", salt, 'pbkdf2_sha256', 10)
+	config.password_workers = 1
+	try:
+		assert hash_password("password", salt, 'pbkdf2_sha256', 10) == inline
+		assert check_password("password", salt, inline, 'pbkdf2_sha256', 10)
+		assert not check_password("drowssap", salt, inline, 'pbkdf2_sha256', 10)
+	finally:
+		config.password_workers = 0
+
+def test_algorithms_differ():
+	"""Each algorithm and cost gives a different hash."""
+	salt = b"salt"
+	hashes = {
+		hash_password("password", salt, 'pbkdf2_sha256', 1),
+		hash_password("password", salt, 'pbkdf2_sha256', 2),
+		hash_password("password", salt, 'scrypt', 2),
+		hash_password("password", salt, 'scrypt', 4),
+	}
+	assert len(hashes) == 4
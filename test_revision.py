@@ -0,0 +1,63 @@
+import json
+from uuid import uuid4
+
+import base_test
+from test_blog import make_new_post
+from test_login import ensure_logged_in
+
+from pyserv.database import db
+from pyserv.revision import BlogRevision, apply_delta, make_delta, post_revisions, revision_contents, snapshot_interval
+
+def test_delta():
+	old = "one\ntwo\nthree\nfour\n"
+	new = "one\n2\nthree\nfour\nfive"
+	delta = make_delta(old, new)
+	assert json.loads(delta) == [1, -1, ["2\n"], 2, ["five"]]
+	assert apply_delta(old, delta) == new
+	assert apply_delta("", make_delta(None, new)) == new
+	assert apply_delta(new, make_delta(new, "")) == ""
+
+def test_revisions():
+	"""Every edit can be rebuilt, from a snapshot and a few deltas."""
+	versions = ["\n".join("line {} of version {}".format(line, version if line == version % 5 else 0)
+			for line in range(5)) for version in range(2 * snapshot_interval + 5)]
+	post = make_new_post(contents=versions[0])
+	for contents in versions[1:]:
+		post.contents = contents
+		db.session.commit()
+	post.public = not post.public
+	db.session.commit()
+
+	revisions = BlogRevision.query.filter_by(post_id=post.id).order_by(BlogRevision.number).all()
+	assert [revision.number for revision in revisions] == list(range(1, len(versions) + 1))
+	assert [revision.number for revision in revisions if revision.snapshot is not None] == [1, snapshot_interval + 1, 2 * snapshot_interval + 1]
+	for number, contents in enumerate(versions, 1):
+		assert revision_contents(post.id, number) == contents
+	assert revision_contents(post.id, len(versions) + 1) is None
+	assert [revision.number for revision in post_revisions(post.id)][:2] == [len(versions), len(versions) - 1]
+
+def test_revision_views(client, blog_user):
+	post = make_new_post(contents="first line\nsecond line")
+	post_id = post.id
+	base_test.check_response(client.get('/blog/{}/revisions'.format(post_id)), expected=403)
+	base_test.check_response(ensure_logged_in(client, blog_user()))
+	client.post('/blog/{}/edit'.format(post_id), data={"title": "edited", "contents": "first line\nchanged line"})
+
+	response = client.get('/blog/{}/revisions'.format(post_id))
+	base_test.check_response(response)
+	assert b'Revision 2' in response.data and b'Revision 1' in response.data
+	response = client.get('/blog/{}/revisions/2'.format(post_id))
+	base_test.check_response(response)
+	assert b'-second line' in response.data
+	assert b'+changed line' in response.data
+	base_test.check_response(client.get('/blog/{}/revisions/3'.format(post_id)), expected=404)
+
+def test_post_from_before_revisions():
+	"""The history of a post without revisions starts with the version before its first edit."""
+	post = make_new_post(contents="old contents")
+	table = BlogRevision.__table__
+	db.engine.execute(table.delete().where(table.c.post_id == post.id))
+	post.contents = "new contents"
+	db.session.commit()
+	assert revision_contents(post.id, 1) == "old contents"
+	assert revision_contents(post.id, 2) == "new contents"
@@ -0,0 +1,57 @@
+import json
+from uuid import uuid4
+
+import base_test
+from test_blog import make_new_post
+from test_bugs import make_new_bug
+
+from pyserv.bug import BugUserMessage, new_message
+from pyserv.database import db
+from pyserv.search import search
+
+def test_search_bug(client):
+	"""Bugs can be found by their title and the descriptions of their messages."""
+	bug = make_new_bug()
+	word = uuid4().hex
+	new_message(BugUserMessage, bug, "it crashes on {}".format(word), title="Problem with {}".format(bug.title))
+	db.session.add(bug)
+	db.session.commit()
+
+	results = search(bug.title, user=None)
+	assert [(result.kind, result.ref) for result in results] == [('bug', bug.id)]
+	results = search(word, user=None)
+	assert [(result.kind, result.parent) for result in results] == [('bug_message', bug.id)]
+	assert "[{}]".format(word) in results[0].snippet
+
+def test_search_blog_visibility(client, blog_user):
+	"""Private blog posts can only be found by users with blog rights."""
+	post = make_new_post(public=False)
+	assert not search(post.contents, user=None)
+	assert [result.ref for result in search(post.contents, user=blog_user())] == [post.id]
+
+def test_search_api(client, test_user):
+	"""The search API returns JSON results, and doesn't show private posts."""
+	user = test_user()
+	private = make_new_post(title="private {}".format(user.nickname), public=False)
+	response = client.get('/service/search/api', query_string={'term': user.nickname})
+	base_test.check_response(response)
+	results = json.loads(response.data.decode('utf-8'))['results']
+	assert [(result['kind'], result['id']) for result in results] == [('user', user.id)]
+	assert results[0]['url'] == '/user/{}'.format(user.id)
+
+	response = client.post('/service/bug/search/api', data={'term': user.nickname})
+	base_test.check_response(response)
+	assert json.loads(response.data.decode('utf-8'))['results'] == []
+
+def test_search_api_count(client):
+	"""The count of results is at least 1 and at most max_search_results_per_page, so paging always ends."""
+	word = uuid4().hex
+	for i in range(3):
+		make_new_post(title="counted {}".format(word), public=True)
+	for count, expected in [(-1, 1), (0, 1), (2, 2), (1000, 3)]:
+		response = client.get('/service/search/api', query_string={'term': word, 'kind': 'blog_post', 'count': count})
+		base_test.check_response(response)
+		page = json.loads(response.data.decode('utf-8'))
+		assert len(page['results']) == expected
+		if expected < 3:
+			assert page['next_start'] == expected
@@ -0,0 +1,108 @@
+from datetime import datetime, timedelta
+from flask import request
+from tempfile import TemporaryDirectory
+
+import base_test
+from test_login import ensure_logged_in, logout
+
+from pyserv.app import app
+from pyserv.auth import has_auth, levels
+from pyserv.session import FileSessionStore, ServerSessionInterface, SQLSessionStore, _new_sid, sweep_ended_sessions
+
+def check_store(store):
+	"""Sessions can be saved, loaded, deleted and swept from the store."""
+	later = datetime.utcnow() + timedelta(hours=1)
+	earlier = datetime.utcnow() - timedelta(hours=1)
+	store.save("alive", b"data", later)
+	store.save("changed", b"old data", later)
+	store.save("changed", b"new data", later)
+	store.save("expired", b"data", earlier)
+	store.save("deleted", b"data", later)
+	store.delete("deleted")
+
+	assert store.load("alive") == b"data"
+	assert store.load("changed") == b"new data"
+	assert store.load("expired") is None
+	assert store.load("deleted") is None
+	assert store.load("nonexistent") is None
+
+	assert store.sweep() >= 1
+	assert store.load("alive") == b"data"
+
+def test_sql_store():
+	check_store(SQLSessionStore())
+
+def test_file_store():
+	with TemporaryDirectory() as directory:
+		check_store(FileSessionStore(directory))
+
+def session_cookie(response):
+	"""Get the session id that the response sets in the cookie."""
+	for header in response.headers.getlist('Set-Cookie'):
+		name, _, rest = header.partition('=')
+		if name == app.session_cookie_name:
+			return rest.partition(';')[0]
+
+def logged_in_with_cookie(sid):
+	"""Does a fresh client with the given session id count as logged in?"""
+	other_client = app.test_client()
+	with other_client:
+		other_client.set_cookie('localhost', app.session_cookie_name, sid)
+		base_test.check_response(other_client.get('/'))
+		return has_auth(levels.logged_in)
+
+def test_logout_ends_session(client, test_user):
+	"""After logging out, a copy of the old cookie doesn't log you in."""
+	user = test_user()
+	sid = session_cookie(ensure_logged_in(client, user))
+	assert sid
+	assert logged_in_with_cookie(sid)
+	logout(client)
+	assert not logged_in_with_cookie(sid)
+
+def test_malformed_sid(client):
+	"""A cookie that isn't a session id never reaches the store, so it can't be a path."""
+	loaded = []
+	class RecordingStore(SQLSessionStore):
+		def load(self, sid):
+			loaded.append(sid)
+			return super().load(sid)
+	interface = ServerSessionInterface(RecordingStore(), 10, 60, 0)
+	with app.test_request_context(headers={'Cookie': '{}=../../etc/passwd'.format(app.session_cookie_name)}):
+		opened = interface.open_session(app, request)
+	assert opened.new
+	assert opened.sid != "../../etc/passwd"
+	assert loaded == []
+
+def test_forget_everywhere():
+	"""Ending a session in one process drops it from the cache of the others at their next check."""
+	store = SQLSessionStore()
+	sid = _new_sid()
+	other_sid = _new_sid()
+	for cached_sid in (sid, other_sid):
+		store.save(cached_sid, b"old data", datetime.utcnow() + timedelta(hours=1))
+	one_process = ServerSessionInterface(store, 10, 60, 0)
+	other_process = ServerSessionInterface(store, 10, 60, 0)
+	assert one_process._load(sid) == b"old data"
+	assert one_process._load(other_sid) == b"old data"
+	store.save(sid, b"new data", datetime.utcnow() + timedelta(hours=1))
+	store.save(other_sid, b"new data", datetime.utcnow() + timedelta(hours=1))
+	# still cached
+	assert one_process._load(sid) == b"old data"
+
+	other_process._forget(sid)
+	assert one_process._load(sid) is None
+	# only the ended session is dropped
+	assert one_process._load(other_sid) == b"old data"
+
+def test_end_check_interval():
+	"""Processes don't check for ended sessions more often than the interval."""
+	store = SQLSessionStore()
+	sid = _new_sid()
+	store.save(sid, b"data", datetime.utcnow() + timedelta(hours=1))
+	one_process = ServerSessionInterface(store, 10, 60, 3600)
+	other_process = ServerSessionInterface(store, 10, 60, 0)
+	assert one_process._load(sid) == b"data"
+	other_process._forget(sid)
+	assert one_process._load(sid) == b"data"
+	assert sweep_ended_sessions(0) >= 1
@@ -0,0 +1,38 @@
+import os
+
+import base_test
+
+from pyserv.templates import module_directory, preload_templates, template_names, template_timings
+
+from test_login import login
+
+def test_template_names():
+	"""All templates are found, including the forms."""
+	names = template_names()
+	assert 'base.tpl' in names
+	assert 'front_page.html' in names
+	assert 'forms/bug.tpl' in names
+
+def test_preloaded_templates():
+	"""The tests preload the templates, so they are all compiled to modules already."""
+	timings = preload_templates()
+	assert set(timings) == set(template_names())
+	assert all(seconds is not None for seconds in timings.values())
+	assert os.path.exists(os.path.join(module_directory(), 'forms', 'bug.tpl.py'))
+
+def test_template_stats(client, god_user, test_user):
+	"""Rendering a page counts for its template, and only gods can see the counts."""
+	renders = template_timings().get('login_form.html', {}).get('renders', 0)
+	base_test.check_response(client.get('/service/login'))
+	assert template_timings()['login_form.html']['renders'] == renders + 1
+
+	user = test_user()
+	login(client, user.nickname, "")
+	base_test.check_response(client.get('/service/stats/templates'), expected=403)
+	client.get('/service/logout')
+
+	god = god_user()
+	login(client, god.nickname, "")
+	response = client.get('/service/stats/templates')
+	base_test.check_response(response)
+	assert response.get_json()['templates']['login_form.html']['renders'] >= renders + 1
@@ -1,3 +1,6 @@
+<%!
+ from pyserv.fragment import fragments, visibility_class
+%>
 <%def name="title(post)">
 %if post.public:
  ${post.title}
@@ -6,13 +9,18 @@
 %endif
 </%def>
 <%def name="sneak_peek(post)">
+ ## backfill_excerpts changes the excerpt without changing the version, so the excerpt is part of the key
+ ${fragments.get_or_render(('blog_post', post.id, post.version, post.excerpt, visibility_class()), lambda: capture(render_sneak_peek, post)) | n}
+</%def>
+<%def name="render_sneak_peek(post)">
  <div class="sneak_peek">
   <h2><a href="${url_for('blog_post_profile', post_id=post.id)}">${title(post)}</a></h2>
-  <p class="post_contents">${post.contents}</p>
+  <p class="post_contents">${post.excerpt}</p>
  </div>
 </%def>
 <%def name="post_buttons(post)">
  <div class="post_buttons">
   <a href="${url_for('blog_edit_post', post_id=post.id)}" class="button">Edit</a>
+  <a href="${url_for('blog_post_revisions', post_id=post.id)}" class="button">History</a>
  </div>
 </%def>
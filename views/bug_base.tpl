@@ -1,5 +1,6 @@
 <%!
- from pyserv.bug import BugPriority, BugStatus
+ from pyserv.bug import Bug, BugPriority, BugStatus, open_statuses
+ from pyserv.fragment import fragments, visibility_class
 %>
 
 <%def name="show_enum(member)">
@@ -22,6 +23,15 @@
 </%def>
 
 <%def name="table_row(bug)">
+ ## BugStates from the past don't have a version, but they don't change either
+ % if isinstance(bug, Bug):
+  ${fragments.get_or_render(('bug', bug.id, bug.version, visibility_class()), lambda: capture(render_table_row, bug)) | n}
+ % else:
+  ${render_table_row(bug)}
+ % endif
+</%def>
+
+<%def name="render_table_row(bug)">
  <tr>
   <td>${bug.id}</td>
   <td>${show_enum(bug.status)}</td>
@@ -30,6 +40,15 @@
  </tr>
 </%def>
 
+<%def name="open_summary(counts)">
+ <p class="bug_summary">
+  <strong>Open bugs:</strong>
+  % for priority in list(BugPriority)[::-1]:
+   ${show_enum(priority)}: ${sum(counts.get((status, priority), 0) for status in open_statuses)}${"" if loop.last else ","}
+  % endfor
+ </p>
+</%def>
+
 <%def name="current_status(bug)">
  <p>
   <strong>Status:</strong> ${show_enum(bug.status)}<br>
@@ -37,17 +56,15 @@
  </p>
 </%def>
 
-<%def name="messages(bug)">
- <% prev_title = prev_status = prev_priority = None %>
- % for message in bug.messages:
-  ${list_message(message, prev_title, prev_status, prev_priority)}
+<%def name="messages(timeline, older_url=None)">
+ ## the timeline is newest first, and knows the previous values even across pages
+ % for entry in timeline:
+  ${list_message(entry.message, entry.prev_title, entry.prev_status, entry.prev_priority)}
   <hr>
-  <%
-  if message.new_title is not None: prev_title = message.new_title
-  if message.new_status is not None: prev_status = message.new_status
-  if message.new_priority is not None: prev_priority = message.new_priority
-  %>
  % endfor
+ % if older_url:
+  <a href="${older_url}">Load older messages</a>
+ % endif
 </%def>
 
 <%def name="list_message(bug_message, prev_title=None, prev_status=None, prev_priority=None)">
@@ -84,3 +101,15 @@
   % endfor
  </select>
 </%def>
+
+<%def name="status_checkboxes(selected=(), name='status')">
+ % for status in BugStatus:
+  <label><input type="checkbox" name="${name}" value="${status.name}" ${"checked" if status in selected else ""}/>${show_enum(status)}</label>
+ % endfor
+</%def>
+
+<%def name="priority_checkboxes(selected=(), name='priority')">
+ % for priority in BugPriority:
+  <label><input type="checkbox" name="${name}" value="${priority.name}" ${"checked" if priority in selected else ""}/>${show_enum(priority)}</label>
+ % endfor
+</%def>
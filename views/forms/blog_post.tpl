@@ -1,11 +1,12 @@
 <%namespace name="blog_view" file="../blog_base.tpl"/>
 
 <%
+draft = context.get('draft') or {}
 if post:
 	action = url_for('blog_edit_post', post_id=post.id)
-	title = post.title
-	contents = post.contents
-	public = int(post.public)
+	title = draft.get('title', post.title)
+	contents = draft.get('contents', post.contents)
+	public = int(draft.get('public', post.public))
 else:
 	action = url_for('blog_new_post')
 	title = ""
@@ -13,6 +14,9 @@ else:
 	public = 0
 %>
 <form action="${action}" method="POST">
+% if post:
+	<input type="hidden" name="version" value="${post.version}"/>
+% endif
 	<label for="title">Title</label> <input type="text" id="title" name="title" value="${title}" size="30"/><br/>
 	<label for="contents">Description:</label><br/>
 	<textarea id="contents" name="contents">${contents}</textarea><br/>
@@ -2,9 +2,45 @@
 
 <form action="${url_for('bug_report')}" method="POST">
 	<label for="title">Title</label> <input type="text" id="title" name="title" size="30"/><br/>
+	<div id="duplicates" class="duplicates" hidden>
+		This might already be reported as:
+		<ul id="duplicate_list"></ul>
+	</div>
 	<label for="status">Status</label> ${bug_view.status_input()}<br/>
 	<label for="priority">Priority</label> ${bug_view.priority_input()}<br/>
 	<label for="description">Description:</label><br/>
 	<textarea id="description" name="description"></textarea><br/>
 	<input type="submit" name="submit" value="Report!"/>
 </form>
+<script>
+	// suggest possible duplicates while the reporter is typing
+	(function() {
+		var api = "${url_for('bug_duplicates_api')}";
+		var title = document.getElementById("title");
+		var description = document.getElementById("description");
+		var box = document.getElementById("duplicates");
+		var list = document.getElementById("duplicate_list");
+		var timer = null;
+		function suggest() {
+			var query = "?title=" + encodeURIComponent(title.value) + "&description=" + encodeURIComponent(description.value);
+			fetch(api + query).then(function(response) { return response.json(); }).then(function(data) {
+				list.innerHTML = "";
+				data.suggestions.forEach(function(suggestion) {
+					var item = document.createElement("li");
+					var link = document.createElement("a");
+					link.href = suggestion.url;
+					link.textContent = "#" + suggestion.id + ": " + suggestion.title + " (" + suggestion.status + ")";
+					item.appendChild(link);
+					list.appendChild(item);
+				});
+				box.hidden = !data.suggestions.length;
+			});
+		}
+		function schedule() {
+			clearTimeout(timer);
+			timer = setTimeout(suggest, 250);
+		}
+		title.addEventListener("input", schedule);
+		description.addEventListener("change", schedule);
+	})();
+</script>
@@ -1,6 +1,10 @@
 <%namespace name="bug_view" file="../bug_base.tpl"/>
 
 <form action="${url_for('bug_message', bug_id=bug.id)}" method="POST">
+	## what the bug looked like, so only the fields you change are changed
+	<input type="hidden" name="seen_title" value="${bug.title}"/>
+	<input type="hidden" name="seen_status" value="${bug.status.name}"/>
+	<input type="hidden" name="seen_priority" value="${bug.priority.name}"/>
 	<label for="title">Title</label> <input type="text" id="title" name="title" size="30" value="${bug.title}"/><br/>
 	<label for="status">Status</label> ${bug_view.status_input(selected=bug.status)}<br/>
 	<label for="priority">Priority</label> ${bug_view.priority_input(selected=bug.priority)}<br/>